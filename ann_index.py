@@ -0,0 +1,527 @@
+"""Índice ANN (IVF) global sobre los embeddings de todos los PDFs.
+
+Los vectores normalizados se agrupan en ``nlist`` listas mediante k-means
+esférico; una consulta solo puntúa los vectores de las ``nprobe`` listas
+cuyos centroides son más parecidos a ella. Subir ``nprobe`` mejora el
+recall a costa de latencia (con ``nprobe >= nlist`` la búsqueda es exacta).
+
+Mientras el índice tiene pocos vectores no se entrena y la búsqueda es
+exhaustiva. Se entrena al alcanzar ``train_min`` vectores y se reentrena
+cuando el número de vectores se multiplica por ``retrain_factor``.
+
+Persistencia: una base ``.npz`` con todos los vectores más segmentos
+pequeños de solo adición (``<ruta>.<n>.seg.npz``), uno por modificación,
+con los PDFs eliminados y los vectores agregados. Cada proceso de gunicorn
+tiene su propia copia en memoria: las modificaciones se hacen bajo un
+bloqueo de fichero y las búsquedas aplican los segmentos nuevos que hayan
+escrito otros procesos, sin releer la base. La base solo se reescribe al
+reentrenar, al acumular ``max_segments`` segmentos o cuando la proporción
+de vectores eliminados supera ``max_deleted_ratio``; entonces se borran los
+segmentos que incluye.
+
+Los vectores eliminados se marcan como borrados y se descartan físicamente
+al reescribir la base.
+
+Con ``quantization`` ('int8' o 'binary') los vectores se guardan cuantizados
+(en memoria y en disco) y ``search`` devuelve similitudes aproximadas: el
+llamador debe reordenar los candidatos con los embeddings float32.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from quantization import approximate_scores, dequantize, quantize
+from vector_index import normalize_rows
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+SEGMENT_SUFFIX = '.seg.npz'
+
+
+def kmeans(vectors, nlist, iterations=10, seed=0):
+    """K-means esférico (similitud coseno). Devuelve los centroides normalizados."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        # Las listas vacías se reinician con un vector al azar
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, path=None, nlist=None, nprobe=8, train_min=4096, retrain_factor=4,
+                 max_train_samples=100000, quantization=None, max_segments=64, max_deleted_ratio=0.25):
+        self.path = path
+        self.quantization = quantization
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.retrain_factor = retrain_factor
+        self.max_train_samples = max_train_samples
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self._lock = threading.RLock()
+        self._reset()
+        self._loaded_mtime = None
+        # Último segmento aplicado y último incluido en la base cargada
+        self._seq = 0
+        self._base_seq = 0
+
+    def _reset(self):
+        # Arrays con capacidad >= _size; las filas [0, _size) son las válidas
+        self._size = 0
+        self._capacity = 0
+        self._vectors = None  # códigos si hay cuantización
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._ids = np.zeros(0, dtype='<U36')
+        self._pdf_codes = np.zeros(0, dtype=np.int32)
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_count = 0
+        # Cada PDF se guarda por fila como un entero (comparar cadenas de
+        # 36 caracteres en un millón de filas es lento)
+        self._pdf_names = []
+        self._pdf_code = {}
+        self._dim = 0
+        self._centroids = None
+        self._trained_size = 0
+        self._members = None
+
+    def __len__(self):
+        return self._size - self._deleted_count
+
+    def memory_bytes(self):
+        """Memoria de los vectores (o códigos y escalas) en uso."""
+        with self._lock:
+            if not self._size:
+                return 0
+            return self._vectors[:self._size].nbytes + self._scales[:self._size].nbytes
+
+    def pdf_ids(self):
+        """Conjunto de PDFs con vectores en el índice."""
+        with self._lock:
+            codes = np.unique(self._pdf_codes[:self._size][~self._deleted[:self._size]])
+            return {self._pdf_names[code] for code in codes}
+
+    # -- persistencia ------------------------------------------------------
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    @contextmanager
+    def _file_lock(self):
+        if not self.path or fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _segment_path(self, seq):
+        return f'{self.path}.{seq:08d}{SEGMENT_SUFFIX}'
+
+    def _segment_seqs(self):
+        """Números de los segmentos en disco, en orden."""
+        if not self.path:
+            return []
+        directory, prefix = os.path.split(self.path)
+        prefix += '.'
+        try:
+            names = os.listdir(directory or '.')
+        except OSError:
+            return []
+        seqs = []
+        for name in names:
+            if name.startswith(prefix) and name.endswith(SEGMENT_SUFFIX):
+                number = name[len(prefix):-len(SEGMENT_SUFFIX)]
+                if number.isdigit():
+                    seqs.append(int(number))
+        return sorted(seqs)
+
+    def exists(self):
+        return self._file_mtime() is not None
+
+    def load(self):
+        """Carga el índice desde disco. Devuelve False si no hay fichero."""
+        with self._file_lock():
+            return self._load_locked()
+
+    def _load_locked(self):
+        mtime = self._file_mtime()
+        if mtime is None:
+            return False
+        with np.load(self.path, allow_pickle=False) as data:
+            # Un índice guardado con otra cuantización se reconstruye
+            stored = str(data['quantization']) if 'quantization' in data else ''
+            if stored != (self.quantization or ''):
+                return False
+            with self._lock:
+                self._reset()
+                vectors = data['vectors']
+                self._size = self._capacity = len(vectors)
+                self._vectors = vectors if self._size else None
+                self._ids = data['ids']
+                if 'pdf_names' in data:
+                    self._pdf_names = [str(name) for name in data['pdf_names']]
+                    self._pdf_codes = data['pdf_codes'].astype(np.int32)
+                else:
+                    # Formato anterior: el id del PDF en cada fila
+                    names, codes = np.unique(data['pdf_ids'], return_inverse=True)
+                    self._pdf_names = [str(name) for name in names]
+                    self._pdf_codes = codes.astype(np.int32)
+                self._pdf_code = {name: code for code, name in enumerate(self._pdf_names)}
+                self._assign = data['assign']
+                self._deleted = np.zeros(self._size, dtype=bool)
+                self._centroids = data['centroids'] if data['centroids'].size else None
+                self._trained_size = int(data['trained_size'])
+                if self.quantization:
+                    self._scales = data['scales']
+                self._dim = int(data['dim']) if 'dim' in data else (vectors.shape[1] if self._size else 0)
+                self._seq = self._base_seq = int(data['seq']) if 'seq' in data else 0
+                self._loaded_mtime = mtime
+        with self._lock:
+            self._apply_segments()
+        return True
+
+    def _save_base(self):
+        """Reescribe la base con los vectores vigentes y borra los segmentos que incluye."""
+        with self._lock:
+            self._compact()
+            if not self.path:
+                return
+            used, codes = np.unique(self._pdf_codes[:self._size], return_inverse=True)
+            tmp_path = self.path + '.tmp.npz'
+            np.savez(
+                tmp_path,
+                vectors=self._vectors[:self._size] if self._size else np.zeros((0, 0), dtype=np.float32),
+                ids=self._ids[:self._size],
+                pdf_names=np.asarray([self._pdf_names[code] for code in used], dtype='<U36'),
+                pdf_codes=codes.astype(np.int32),
+                assign=self._assign[:self._size],
+                centroids=self._centroids if self._centroids is not None else np.zeros((0, 0), dtype=np.float32),
+                trained_size=np.int64(self._trained_size),
+                quantization=np.str_(self.quantization or ''),
+                scales=self._scales[:self._size],
+                dim=np.int64(self._dim),
+                seq=np.int64(self._seq)
+            )
+            # Reemplazo atómico: los lectores nunca ven un fichero a medias
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = self._file_mtime()
+            self._base_seq = self._seq
+        for seq in self._segment_seqs():
+            if seq <= self._base_seq:
+                try:
+                    os.remove(self._segment_path(seq))
+                except OSError:
+                    pass
+
+    def _save_segment(self, removed, rows):
+        """Escribe una modificación como un segmento nuevo (sin tocar la base)."""
+        if not self.path:
+            return
+        pdf_ids, ids, codes, scales, assign = rows or (
+            np.zeros(0, dtype='<U36'), np.zeros(0, dtype='<U36'),
+            np.zeros((0, 0), dtype=np.float32), None, np.zeros(0, dtype=np.int32)
+        )
+        seq = self._seq + 1
+        tmp_path = f'{self.path}.tmp-{seq:08d}.npz'
+        np.savez(
+            tmp_path,
+            removed=np.asarray(removed, dtype='<U36'),
+            pdf_ids=pdf_ids,
+            ids=ids,
+            vectors=codes,
+            scales=scales if scales is not None else np.zeros(0, dtype=np.float32),
+            assign=assign,
+            dim=np.int64(self._dim)
+        )
+        os.replace(tmp_path, self._segment_path(seq))
+        self._seq = seq
+
+    def _apply_segments(self):
+        """Aplica los segmentos posteriores al último aplicado (con el bloqueo de fichero)."""
+        for seq in self._segment_seqs():
+            if seq <= self._seq:
+                continue
+            with np.load(self._segment_path(seq), allow_pickle=False) as data:
+                self._remove_pdfs([str(pdf_id) for pdf_id in data['removed']])
+                if len(data['ids']):
+                    self._dim = int(data['dim'])
+                    scales = data['scales'] if self.quantization else None
+                    self._append_rows(data['pdf_ids'], data['ids'], data['vectors'], scales, data['assign'])
+            self._seq = seq
+            self._members = None
+
+    def _stale(self):
+        mtime = self._file_mtime()
+        if mtime is None:
+            return False
+        if mtime != self._loaded_mtime:
+            return True
+        seqs = self._segment_seqs()
+        return bool(seqs) and seqs[-1] > self._seq
+
+    def sync(self):
+        """Se pone al día con lo que hayan guardado otros procesos."""
+        if self._stale():
+            with self._file_lock():
+                self._sync_locked()
+
+    def _sync_locked(self):
+        mtime = self._file_mtime()
+        if mtime is None:
+            return
+        if mtime != self._loaded_mtime:
+            # La base cambió (reentrenamiento o compactación): recargar
+            self._load_locked()
+        else:
+            with self._lock:
+                self._apply_segments()
+
+    # -- modificaciones ----------------------------------------------------
+
+    def _reserve(self, needed, dim, dtype):
+        if needed <= self._capacity:
+            return
+        # Capacidad creciente en potencias de dos: inserciones O(1) amortizadas
+        capacity = max(1024, 1 << (needed - 1).bit_length())
+
+        def grow(array, shape, array_dtype):
+            buffer = np.empty(shape, dtype=array_dtype)
+            if self._size:
+                buffer[:self._size] = array[:self._size]
+            return buffer
+
+        self._vectors = grow(self._vectors, (capacity, dim), dtype)
+        if self.quantization:
+            self._scales = grow(self._scales, capacity, np.float32)
+        self._ids = grow(self._ids, capacity, '<U36')
+        self._pdf_codes = grow(self._pdf_codes, capacity, np.int32)
+        self._assign = grow(self._assign, capacity, np.int32)
+        self._deleted = grow(self._deleted, capacity, bool)
+        self._capacity = capacity
+
+    def _codes_for(self, pdf_ids):
+        codes = np.empty(len(pdf_ids), dtype=np.int32)
+        for i, pdf_id in enumerate(pdf_ids):
+            pdf_id = str(pdf_id)
+            code = self._pdf_code.get(pdf_id)
+            if code is None:
+                code = self._pdf_code[pdf_id] = len(self._pdf_names)
+                self._pdf_names.append(pdf_id)
+            codes[i] = code
+        return codes
+
+    def _append_rows(self, pdf_ids, ids, codes, scales, assign):
+        needed = self._size + len(ids)
+        self._reserve(needed, codes.shape[1], codes.dtype)
+        rows = slice(self._size, needed)
+        self._vectors[rows] = codes
+        if self.quantization:
+            self._scales[rows] = scales
+        self._ids[rows] = ids
+        self._pdf_codes[rows] = self._codes_for(pdf_ids)
+        self._assign[rows] = assign
+        self._deleted[rows] = False
+        self._size = needed
+
+    def _encode(self, batches):
+        """``[(pdf_id, ids, vectores)]`` -> filas listas para ``_append_rows``."""
+        batches = [(pdf_id, ids, vectors) for pdf_id, ids, vectors in batches if len(ids)]
+        if not batches:
+            return None
+        pdf_ids = np.concatenate([np.full(len(ids), pdf_id, dtype='<U36') for pdf_id, ids, _ in batches])
+        ids = np.concatenate([np.asarray(ids, dtype='<U36') for _, ids, _ in batches])
+        vectors = normalize_rows(np.vstack([vectors for _, _, vectors in batches]))
+        assign = self._assign_lists(vectors)
+        self._dim = vectors.shape[1]
+        scales = None
+        if self.quantization:
+            vectors, scales = quantize(self.quantization, vectors)
+        return pdf_ids, ids, vectors, scales, assign
+
+    def _remove_pdfs(self, pdf_ids):
+        """Marca como borrados los vectores de los PDFs. Devuelve cuántos."""
+        codes = [self._pdf_code[pdf_id] for pdf_id in pdf_ids if pdf_id in self._pdf_code]
+        if not codes or not self._size:
+            return 0
+        mask = np.isin(self._pdf_codes[:self._size], codes) & ~self._deleted[:self._size]
+        count = int(mask.sum())
+        if count:
+            self._deleted[:self._size] |= mask
+            self._deleted_count += count
+            self._members = None
+        return count
+
+    def _compact(self):
+        """Descarta físicamente los vectores marcados como borrados."""
+        if not self._deleted_count:
+            return
+        keep = ~self._deleted[:self._size]
+        self._vectors = self._vectors[:self._size][keep]
+        if self.quantization:
+            self._scales = self._scales[:self._size][keep]
+        self._ids = self._ids[:self._size][keep]
+        self._pdf_codes = self._pdf_codes[:self._size][keep]
+        self._assign = self._assign[:self._size][keep]
+        self._size = self._capacity = len(self._ids)
+        self._deleted = np.zeros(self._size, dtype=bool)
+        self._deleted_count = 0
+        self._members = None
+
+    def _assign_lists(self, vectors):
+        if self._centroids is None:
+            return np.zeros(len(vectors), dtype=np.int32)
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _float_rows(self, rows):
+        """Vectores float32 de las filas indicadas (reconstruidos si están cuantizados)."""
+        vectors = self._vectors[:self._size][rows]
+        if not self.quantization:
+            return vectors
+        return dequantize(self.quantization, vectors, self._scales[:self._size][rows], self._dim)
+
+    def _scores(self, rows, query):
+        vectors = self._vectors[:self._size][rows]
+        if not self.quantization:
+            return vectors @ query
+        return approximate_scores(self.quantization, vectors, self._scales[:self._size][rows], query)
+
+    def _commit(self, removed, batches):
+        """Aplica una modificación y la guarda (como segmento o reescribiendo la base)."""
+        with self._file_lock():
+            self._sync_locked()
+            with self._lock:
+                count = self._remove_pdfs(removed)
+                rows = self._encode(batches)
+                if not count and rows is None:
+                    return
+                if rows is not None:
+                    self._append_rows(*rows)
+                self._members = None
+                retrained = self._maybe_train()
+                segments = self._seq - self._base_seq
+                if retrained or segments >= self.max_segments or \
+                        self._deleted_count > self.max_deleted_ratio * self._size:
+                    self._save_base()
+                else:
+                    self._save_segment(removed if count else [], rows)
+
+    def add(self, pdf_id, ids, vectors):
+        """Agrega los vectores de un PDF (sustituye los que ya tuviera)."""
+        if not len(ids):
+            return
+        self._commit([pdf_id], [(pdf_id, ids, vectors)])
+
+    def remove(self, pdf_ids):
+        """Elimina todos los vectores de los PDFs indicados (un solo segmento)."""
+        if isinstance(pdf_ids, str):
+            pdf_ids = [pdf_ids]
+        pdf_ids = list(pdf_ids)
+        if pdf_ids:
+            self._commit(pdf_ids, [])
+
+    def build(self, batches):
+        """Reconstruye el índice a partir de ``(pdf_id, ids, vectores)``."""
+        with self._file_lock():
+            with self._lock:
+                self._reset()
+                for batch in batches:
+                    rows = self._encode([batch])
+                    if rows is not None:
+                        self._append_rows(*rows)
+                self._maybe_train()
+                # La base nueva sustituye a todos los segmentos existentes
+                self._seq = max(self._segment_seqs() + [self._seq])
+                self._save_base()
+
+    # -- entrenamiento -----------------------------------------------------
+
+    def _maybe_train(self):
+        """Entrena (o reentrena) las listas si toca. Devuelve True si lo hizo."""
+        size = len(self)
+        if size < self.train_min:
+            return False
+        if self._centroids is not None and size < self._trained_size * self.retrain_factor:
+            return False
+
+        self._compact()
+        nlist = self.nlist or int(4 * np.sqrt(self._size))
+        nlist = max(1, min(nlist, self._size // 39 or 1))
+        if self._size > self.max_train_samples:
+            sample = np.random.default_rng(0).choice(self._size, self.max_train_samples, replace=False)
+            training = self._float_rows(sample)
+        else:
+            training = self._float_rows(slice(None))
+        if self.quantization:
+            training = normalize_rows(training)
+        print(f"Entrenando índice ANN: {self._size} vectores, {nlist} listas...")
+        self._centroids = kmeans(training, nlist)
+        self._trained_size = self._size
+        # Por bloques: con cuantización cada bloque se reconstruye en float32
+        block = 65536
+        self._assign[:self._size] = np.concatenate([
+            self._assign_lists(self._float_rows(slice(start, start + block)))
+            for start in range(0, self._size, block)
+        ])
+        self._members = None
+        return True
+
+    # -- búsqueda ----------------------------------------------------------
+
+    def _list_members(self):
+        if self._members is None:
+            assign = self._assign[:self._size]
+            order = np.argsort(assign, kind='stable')
+            if self._deleted_count:
+                order = order[~self._deleted[:self._size][order]]
+            nlist = len(self._centroids) if self._centroids is not None else 1
+            bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+            self._members = (order, bounds)
+        return self._members
+
+    def search(self, query, k=3, nprobe=None):
+        """Devuelve ``[(embedding_id, pdf_id, similitud), ...]`` de mayor a menor."""
+        self.sync()
+        query = normalize_rows(query)[0]
+        with self._lock:
+            if not len(self) or k <= 0:
+                return []
+
+            nprobe = nprobe or self.nprobe
+            if self._centroids is None or nprobe >= len(self._centroids):
+                candidates = np.arange(self._size)
+                if self._deleted_count:
+                    candidates = candidates[~self._deleted[:self._size]]
+            else:
+                order, bounds = self._list_members()
+                probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+                candidates = np.concatenate([order[bounds[l]:bounds[l + 1]] for l in probe])
+
+            scores = self._scores(candidates, query)
+            if len(candidates) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(candidates))
+            top = top[np.argsort(-scores[top])]
+            return [(str(self._ids[candidates[i]]), self._pdf_names[self._pdf_codes[candidates[i]]], float(scores[i]))
+                    for i in top]
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from vector_index import normalize_rows
+
+
+class AnswerCache:
+    """Caché semántica de respuestas del LLM por PDF.
+
+    Una respuesta se reutiliza cuando la nueva pregunta es del mismo PDF,
+    recupera exactamente los mismos chunks y su embedding tiene una
+    similitud coseno >= ``threshold`` con la de una pregunta anterior.
+    Las entradas caducan a los ``ttl`` segundos y, al superar
+    ``max_entries`` grupos de chunks, se descartan las menos usadas.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600, threshold=0.95, per_key=8):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.per_key = per_key
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(pdf_id, chunk_ids):
+        return (pdf_id, tuple(sorted(chunk_ids)))
+
+    def lookup(self, pdf_id, chunk_ids, query_embedding):
+        """Devuelve ``(respuesta, contexto)`` o None si no hay acierto."""
+        result = self._lookup(pdf_id, chunk_ids, query_embedding)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def _lookup(self, pdf_id, chunk_ids, query_embedding):
+        key = self._key(pdf_id, chunk_ids)
+        query = normalize_rows(query_embedding)[0]
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._entries.get(key)
+            if not bucket:
+                return None
+
+            bucket[:] = [entry for entry in bucket if now - entry[0] < self.ttl]
+            if not bucket:
+                del self._entries[key]
+                return None
+
+            similarities = np.stack([entry[1] for entry in bucket]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            self._entries.move_to_end(key)
+            _, _, response, context = bucket[best]
+            return response, context
+
+    def store(self, pdf_id, chunk_ids, query_embedding, response, context):
+        key = self._key(pdf_id, chunk_ids)
+        entry = (time.monotonic(), normalize_rows(query_embedding)[0], response, context)
+
+        with self._lock:
+            bucket = self._entries.setdefault(key, [])
+            bucket.append(entry)
+            del bucket[:-self.per_key]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, pdf_id):
+        """Descarta todas las respuestas de un PDF (p. ej. al reingerirlo)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == pdf_id]:
+                del self._entries[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
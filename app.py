@@ -1,34 +1,201 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Blueprint, current_app, g, has_request_context, render_template, request, jsonify, send_file, Response, stream_with_context
 import os
+import base64
+import shutil
+import hashlib
 import sqlite3
+import threading
+import time
 import uuid
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import json
 from dotenv import load_dotenv
 import requests
-from sentence_transformers import SentenceTransformer
-import PyPDF2
-import fitz  # PyMuPDF is the package name, but we import fitz
-from PIL import Image
-import io
+import numpy as np
+
+from ann_index import IVFIndex
+from chunking import WordChunker, chunker_for_model
+from answer_cache import AnswerCache
+from db_pool import ConnectionPool, configure_connection
+from llm_client import LLMClient
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, server_timing_header
+from text_search import bm25_search, create_fts, reciprocal_rank_fusion
+from thumbnails import IMAGE_SIZES, derivative_key, make_derivative, remove_derivatives
+from pdf_extraction import extract_pages
+from quantization import (MODE_CODES as QUANTIZATION_CODES, MODES as QUANTIZATION_MODES, QuantizedMatrix, quantize,
+                          quantized_from_blob, quantized_to_blob)
+from vector_index import VectorIndex, embedding_from_blob, embedding_to_blob, normalize_rows, rescore
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'data/uploads'
-app.config['IMAGES_FOLDER'] = 'data/images'
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max
+# Las dependencias pesadas (torch, sentence-transformers, PyMuPDF) se importan
+# solo cuando se necesitan; las rutas /api/history o /api/list-pdfs y los
+# scripts que importan este módulo no las cargan nunca.
+bp = Blueprint('rag', __name__)
+
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'data/database.sqlite')
+
+# Modelo de embeddings, construido la primera vez que se usa. Con
+# 'gunicorn --preload' y PRELOAD_EMBEDDING_MODEL=1 se carga en el proceso
+# maestro y los workers lo comparten mediante copy-on-write.
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2')
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+def get_embedding_model():
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                from sentence_transformers import SentenceTransformer
+                
+                print("Cargando modelo de embeddings...")
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+                print("Modelo de embeddings cargado!")
+    return _embedding_model
+
+# Troceado del texto: 'tokens' respeta las frases y la longitud máxima del
+# modelo (ver chunking.MODEL_CHUNKING); 'words' es el chunker clásico de 500
+# palabras. CHUNK_MAX_TOKENS y CHUNK_OVERLAP_TOKENS sustituyen los valores
+# del modelo.
+CHUNKING_STRATEGY = os.getenv('CHUNKING_STRATEGY', 'tokens')
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', 0)) or None
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS')) if os.getenv('CHUNK_OVERLAP_TOKENS') else None
+_chunker = None
+
+def get_chunker():
+    global _chunker
+    if _chunker is None:
+        if CHUNKING_STRATEGY == 'words':
+            _chunker = WordChunker()
+        else:
+            _chunker = chunker_for_model(get_embedding_model(), EMBEDDING_MODEL_NAME,
+                                         CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS)
+    return _chunker
+
+# Preparación del modelo: /healthz no está listo hasta completarla
+model_ready = threading.Event()
+_warm_up_lock = threading.Lock()
+_warm_up_pid = None
+
+def warm_up_model():
+    """Codifica un lote de prueba para pagar la inicialización perezosa del modelo."""
+    try:
+        get_embedding_model().encode(['Preparando el modelo de embeddings.'] * 8, batch_size=8)
+        encode_query('preparando el modelo')
+        print("Modelo de embeddings preparado")
+    except Exception as e:
+        print(f"Advertencia: Error al preparar el modelo: {str(e)}")
+    finally:
+        model_ready.set()
+
+def start_warm_up():
+    """Lanza la preparación del modelo en este proceso (idempotente)."""
+    global _warm_up_pid
+    with _warm_up_lock:
+        if _warm_up_pid == os.getpid():
+            return
+        _warm_up_pid = os.getpid()
+        model_ready.clear()
+        threading.Thread(target=warm_up_model, name='model-warm-up', daemon=True).start()
+
+# Caché LRU de embeddings de consultas, por texto normalizado
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', 1024))
 
-# Crear directorios necesarios
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['IMAGES_FOLDER'], exist_ok=True)
-os.makedirs('data', exist_ok=True)
+_model_uncased = None
 
-# Inicializar modelos
-print("Cargando modelo de embeddings...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-print("Modelo de embeddings cargado!")
+def model_is_uncased():
+    """True si el tokenizador del modelo pasa el texto a minúsculas."""
+    global _model_uncased
+    if _model_uncased is None:
+        tokenizer = getattr(get_embedding_model(), 'tokenizer', None)
+        _model_uncased = bool(getattr(tokenizer, 'do_lower_case', False))
+    return _model_uncased
+
+def normalize_query(text):
+    # Ignorar la caja solo si el modelo no la distingue (all-MiniLM-L6-v2);
+    # en un modelo cased "Apple" y "apple" tienen embeddings distintos
+    normalized = ' '.join(text.split())
+    return normalized.lower() if model_is_uncased() else normalized
+
+@lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def _encode_normalized_query(normalized):
+    embedding = np.asarray(get_embedding_model().encode(normalized), dtype=np.float32)
+    # Se comparte entre peticiones: que nadie pueda modificarlo
+    embedding.flags.writeable = False
+    return embedding
+
+def encode_query(text):
+    return _encode_normalized_query(normalize_query(text))
+
+# Tamaño de lote para encode() y máximo de chunks acumulados
+# en memoria antes de codificarlos e insertarlos durante la ingesta
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+EMBEDDING_WINDOW_CHUNKS = int(os.getenv('EMBEDDING_WINDOW_CHUNKS', 1024))
+
+# Ingesta en segundo plano: hilos por proceso, intervalo de sondeo de la
+# tabla ingest_jobs y segundos tras los que un trabajo 'running' sin
+# actividad se considera abandonado (p. ej. porque el worker murió)
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 1))
+INGEST_POLL_SECONDS = float(os.getenv('INGEST_POLL_SECONDS', 5))
+INGEST_STALE_SECONDS = int(os.getenv('INGEST_STALE_SECONDS', 600))
+# Las etapas largas (codificación, imágenes) renuevan updated_at al menos
+# con esta frecuencia para que otro worker no reclame el trabajo
+INGEST_HEARTBEAT_SECONDS = max(1.0, INGEST_STALE_SECONDS / 4)
+
+# Extracción de texto en paralelo: procesos del pool y mínimo de páginas
+# para que compense arrancarlo
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', 1))
+EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv('EXTRACT_PARALLEL_MIN_PAGES', 32))
+
+# Una subida con el campo replacePdfId es una nueva versión de ese PDF: se
+# reutiliza su id y solo se recalculan las páginas cuyo texto cambió. Con
+# REINGEST_BY_FILENAME=1 también se trata así cualquier subida con el mismo
+# nombre que un PDF ya ingerido (desactivado por defecto: nombres como
+# manual.pdf se repiten entre documentos distintos)
+REINGEST_BY_FILENAME = os.getenv('REINGEST_BY_FILENAME', '0') == '1'
+
+# Generar las miniaturas de las imágenes nuevas durante la ingesta (si no,
+# se generan en la primera petición a /api/image?size=thumb)
+THUMBNAILS_AT_INGEST = os.getenv('THUMBNAILS_AT_INGEST', '1') == '1'
+
+# Motor de extracción de texto: 'pymupdf' (una sola pasada para texto e
+# imágenes) o 'pypdf2' como alternativa opcional
+PDF_ENGINE = os.getenv('PDF_ENGINE', 'pymupdf')
+
+# Recuperación: chunks enviados al LLM y búsqueda híbrida (BM25 + vectores
+# fusionados por RRF). Con FTS_PREFILTER_MIN_CHUNKS > 0, en los PDFs con al
+# menos ese número de chunks solo se puntúan con vectores los candidatos de
+# la búsqueda de texto, sin cargar el documento completo en memoria.
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 3))
+RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', 20))
+HYBRID_SEARCH_ENABLED = os.getenv('HYBRID_SEARCH_ENABLED', '1') == '1'
+RRF_K = int(os.getenv('RRF_K', 60))
+FTS_PREFILTER_MIN_CHUNKS = int(os.getenv('FTS_PREFILTER_MIN_CHUNKS', 0))
+FTS_PREFILTER_CANDIDATES = int(os.getenv('FTS_PREFILTER_CANDIDATES', 1000))
+
+# Cuantización de los vectores en memoria: 'int8' (4x menos memoria) o
+# 'binary' (32x menos). La búsqueda puntúa con los vectores cuantizados y
+# reordena los QUANTIZATION_SHORTLIST mejores con los float32 de la base de
+# datos, que se conservan siempre. 'none' mantiene float32 en memoria.
+EMBEDDING_QUANTIZATION = os.getenv('EMBEDDING_QUANTIZATION', 'none').lower()
+if EMBEDDING_QUANTIZATION not in QUANTIZATION_MODES:
+    if EMBEDDING_QUANTIZATION not in ('', 'none'):
+        print(f"Advertencia: EMBEDDING_QUANTIZATION={EMBEDDING_QUANTIZATION} no es válido (none, int8, binary); se usa float32.")
+    EMBEDDING_QUANTIZATION = None
+QUANTIZATION_SHORTLIST = int(os.getenv('QUANTIZATION_SHORTLIST', 100))
+
+# Historial enviado al LLM: solo los turnos recientes que caben en
+# HISTORY_TOKEN_BUDGET (como mucho HISTORY_MAX_MESSAGES filas); los
+# anteriores se resumen en chat_sessions.summary en segundo plano
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 2000))
+HISTORY_MAX_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', 20))
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', '1') == '1'
+SUMMARY_BATCH_MESSAGES = int(os.getenv('SUMMARY_BATCH_MESSAGES', 40))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', 400))
 
 # Configuración de OpenRouter
 # IMPORTANTE: la API key ya no se guarda en el código. Se debe definir como variable de entorno OPENROUTER_API_KEY.
@@ -37,11 +204,56 @@ MODEL_NAME = "openai/gpt-3.5-turbo"  # Modelo válido de OpenRouter
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', API_URL)
 
+def openrouter_headers():
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": os.getenv('OPENROUTER_HTTP_REFERER', 'http://localhost:5000'),
+        "X-Title": os.getenv('OPENROUTER_APP_NAME', 'RAG Chatbot'),
+    }
+
+# Cliente compartido: conexiones keep-alive, timeouts, reintentos y límite
+# de llamadas simultáneas por proceso
+llm_client = LLMClient(
+    OPENROUTER_API_URL,
+    headers=openrouter_headers(),
+    pool_size=int(os.getenv('LLM_POOL_SIZE', 16)),
+    connect_timeout=float(os.getenv('LLM_CONNECT_TIMEOUT', 5)),
+    read_timeout=float(os.getenv('LLM_READ_TIMEOUT', 30)),
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', 2)),
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+    queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', 30))
+)
+
 # Base de datos
+fts_available = False
+
+def ensure_column(c, table, column, definition):
+    """Agrega una columna a una tabla existente si todavía no la tiene.
+
+    Devuelve True si la columna se acaba de crear.
+    """
+    c.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+    return False
+
 def init_db():
-    conn = sqlite3.connect('data/database.sqlite')
+    global fts_available
+    os.makedirs(os.path.dirname(DATABASE_PATH) or '.', exist_ok=True)
+    conn = configure_connection(sqlite3.connect(DATABASE_PATH))
     c = conn.cursor()
     
+    # En una base de datos nueva, el espacio liberado al borrar se puede
+    # devolver con PRAGMA incremental_vacuum (las existentes se convierten
+    # con storage_gc.py). El modo WAL ya escribió la cabecera, así que el
+    # cambio requiere un VACUUM, inmediato con la base de datos vacía.
+    c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'")
+    if c.fetchone()[0] == 0:
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        c.execute('VACUUM')
+    
     # Tabla de PDFs
     c.execute('''
         CREATE TABLE IF NOT EXISTS pdf_files (
@@ -50,9 +262,23 @@ def init_db():
             file_path TEXT NOT NULL,
             file_size INTEGER,
             uploaded_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            total_pages INTEGER DEFAULT 0
+            total_pages INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'ready',
+            content_hash TEXT,
+            image_count INTEGER DEFAULT 0
         )
     ''')
+    ensure_column(c, 'pdf_files', 'status', "TEXT DEFAULT 'ready'")
+    ensure_column(c, 'pdf_files', 'content_hash', 'TEXT')
+    # Fin de la última ingesta: versión con la que cada proceso comprueba si
+    # su copia en memoria de los vectores del PDF sigue al día
+    ensure_column(c, 'pdf_files', 'indexed_at', 'TEXT')
+    # Número de imágenes desnormalizado (se mantiene en la ingesta)
+    if ensure_column(c, 'pdf_files', 'image_count', 'INTEGER DEFAULT 0'):
+        c.execute('''
+            UPDATE pdf_files
+            SET image_count = (SELECT COUNT(*) FROM pdf_images WHERE pdf_id = pdf_files.id)
+        ''')
     
     # Tabla de páginas
     c.execute('''
@@ -61,9 +287,11 @@ def init_db():
             pdf_id TEXT NOT NULL,
             page_number INTEGER NOT NULL,
             text_content TEXT,
+            text_hash TEXT,
             FOREIGN KEY (pdf_id) REFERENCES pdf_files(id) ON DELETE CASCADE
         )
     ''')
+    ensure_column(c, 'pdf_pages', 'text_hash', 'TEXT')
     
     # Tabla de imágenes
     c.execute('''
@@ -73,9 +301,11 @@ def init_db():
             page_number INTEGER NOT NULL,
             image_path TEXT,
             image_index INTEGER,
+            content_hash TEXT,
             FOREIGN KEY (pdf_id) REFERENCES pdf_files(id) ON DELETE CASCADE
         )
     ''')
+    ensure_column(c, 'pdf_images', 'content_hash', 'TEXT')
     
     # Tabla de embeddings
     c.execute('''
@@ -84,12 +314,19 @@ def init_db():
             pdf_id TEXT NOT NULL,
             page_id TEXT,
             chunk_text TEXT NOT NULL,
-            embedding TEXT NOT NULL,
+            embedding BLOB NOT NULL,
             chunk_index INTEGER,
+            char_start INTEGER,
+            char_end INTEGER,
             FOREIGN KEY (pdf_id) REFERENCES pdf_files(id) ON DELETE CASCADE,
             FOREIGN KEY (page_id) REFERENCES pdf_pages(id) ON DELETE CASCADE
         )
     ''')
+    # Posición del chunk dentro del texto de la página (para citarlo)
+    ensure_column(c, 'embeddings', 'char_start', 'INTEGER')
+    ensure_column(c, 'embeddings', 'char_end', 'INTEGER')
+    # Copia cuantizada del embedding (EMBEDDING_QUANTIZATION): modo, escala y códigos
+    ensure_column(c, 'embeddings', 'embedding_q', 'BLOB')
     
     # Tabla de sesiones
     c.execute('''
@@ -97,9 +334,17 @@ def init_db():
             id TEXT PRIMARY KEY,
             title TEXT,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            summary TEXT,
+            summary_until TEXT,
+            summary_until_id TEXT
         )
     ''')
+    # Resumen de los mensajes anteriores a la ventana de historial; cubre
+    # hasta el mensaje (summary_until, summary_until_id) inclusive
+    ensure_column(c, 'chat_sessions', 'summary', 'TEXT')
+    ensure_column(c, 'chat_sessions', 'summary_until', 'TEXT')
+    ensure_column(c, 'chat_sessions', 'summary_until_id', 'TEXT')
     
     # Tabla de mensajes
     c.execute('''
@@ -115,235 +360,1010 @@ def init_db():
         )
     ''')
     
+    # Tabla de trabajos de ingesta (cola persistente)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id TEXT PRIMARY KEY,
+            pdf_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT,
+            pages_done INTEGER DEFAULT 0,
+            total_pages INTEGER DEFAULT 0,
+            images INTEGER DEFAULT 0,
+            pages_reused INTEGER DEFAULT 0,
+            content_hash TEXT,
+            error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
     # Índices
     c.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_pdf ON embeddings(pdf_id)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)')
+    # Necesario para que las comprobaciones de FOREIGN KEY al borrar páginas no recorran embeddings
+    c.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_page ON embeddings(page_id)')
+    # Índices compuestos para la paginación por clave (keyset)
+    c.execute('DROP INDEX IF EXISTS idx_messages_session')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_session_created ON messages(session_id, created_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_updated ON chat_sessions(updated_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pdf_files_status_uploaded ON pdf_files(status, uploaded_at, id)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_images_pdf ON pdf_images(pdf_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_images_hash ON pdf_images(content_hash)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_pages_pdf ON pdf_pages(pdf_id)')
+    ensure_column(c, 'ingest_jobs', 'pages_reused', 'INTEGER DEFAULT 0')
+    ensure_column(c, 'ingest_jobs', 'content_hash', 'TEXT')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_hash ON ingest_jobs(content_hash)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pdf_files_hash ON pdf_files(content_hash)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pdf_files_filename ON pdf_files(filename)')
+    
+    # Un único embedding por chunk. Las bases de datos antiguas pueden tener
+    # chunks duplicados; en ese caso hay que ejecutar dedup_embeddings.py.
+    try:
+        c.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_embeddings_chunk
+            ON embeddings(pdf_id, page_id, chunk_index)
+        ''')
+    except sqlite3.IntegrityError:
+        print("Advertencia: hay embeddings duplicados en la base de datos. Ejecuta 'python dedup_embeddings.py' para repararla.")
+    
+    # Búsqueda de texto completo sobre los chunks (BM25)
+    fts_available = create_fts(c)
     
     conn.commit()
     conn.close()
 
-init_db()
+# Pool de conexiones por proceso (WAL, synchronous=NORMAL, busy timeout...)
+db_pool = ConnectionPool(DATABASE_PATH, max_idle=int(os.getenv('SQLITE_POOL_SIZE', 8)))
 
 def get_db():
-    conn = sqlite3.connect('data/database.sqlite')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def cosine_similarity(vec1, vec2):
-    import numpy as np
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    dot_product = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-    return float(dot_product / (norm1 * norm2))
-
-def chunk_text(text, chunk_size=500, overlap=50):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        if chunk.strip():
-            chunks.append(chunk)
-    return chunks
-
-@app.route('/')
-def index():
-    return render_template('index.html')
+    return db_pool.connect()
 
-@app.route('/api/upload-pdf', methods=['POST'])
-def upload_pdf():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
+def load_pdf_vectors(pdf_id):
+    """Matriz de embeddings de un PDF para el índice en memoria.
+
+    Con EMBEDDING_QUANTIZATION devuelve una QuantizedMatrix leída de
+    embedding_q; las filas sin copia cuantizada (o de otro modo) se
+    cuantizan al vuelo a partir del float32.
+    """
+    if EMBEDDING_QUANTIZATION:
+        return load_pdf_quantized_vectors(pdf_id)
+    return load_pdf_embeddings(pdf_id)
+
+def load_pdf_embeddings(pdf_id):
+    """Carga todos los embeddings de un PDF listo como una matriz float32.
+
+    Un PDF que aún se está ingiriendo (o que no existe) no devuelve nada, para
+    no dejar en memoria una matriz parcial.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('''
+        SELECT e.id, e.embedding
+        FROM embeddings e
+        JOIN pdf_pages p ON e.page_id = p.id
+        JOIN pdf_files f ON e.pdf_id = f.id AND f.status = 'ready'
+        WHERE e.pdf_id = ?
+    ''', (pdf_id,))
     
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+    ids = []
+    vectors = []
+    for row in c.fetchall():
+        try:
+            vectors.append(embedding_from_blob(row['embedding']))
+            ids.append(row['id'])
+        except Exception as e:
+            print(f"Error procesando chunk: {e}")
+    conn.close()
     
-    if not file.filename.endswith('.pdf'):
-        return jsonify({'error': 'File must be a PDF'}), 400
+    if not vectors:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    return ids, np.vstack(vectors)
+
+def load_pdf_quantized_vectors(pdf_id):
+    conn = get_db()
+    c = conn.cursor()
+    # El float32 solo se lee para las filas que aún no tienen copia cuantizada
+    c.execute('''
+        SELECT e.id, e.embedding_q,
+               CASE WHEN e.embedding_q IS NULL OR substr(e.embedding_q, 1, 1) != ? THEN e.embedding END AS embedding
+        FROM embeddings e
+        JOIN pdf_pages p ON e.page_id = p.id
+        JOIN pdf_files f ON e.pdf_id = f.id AND f.status = 'ready'
+        WHERE e.pdf_id = ?
+    ''', (bytes([QUANTIZATION_CODES[EMBEDDING_QUANTIZATION]]), pdf_id))
     
-    pdf_id = str(uuid.uuid4())
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f'{pdf_id}_{filename}')
-    file.save(file_path)
+    ids = []
+    rows = []
+    for row in c.fetchall():
+        try:
+            quantized = quantized_from_blob(EMBEDDING_QUANTIZATION, row['embedding_q'])
+            if quantized is None:
+                codes, scales = quantize(EMBEDDING_QUANTIZATION, normalize_rows(embedding_from_blob(row['embedding'])))
+                quantized = (codes[0], scales[0])
+            rows.append(quantized)
+            ids.append(row['id'])
+        except Exception as e:
+            print(f"Error procesando chunk: {e}")
+    conn.close()
     
+    if not rows:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    return ids, QuantizedMatrix.from_rows(EMBEDDING_QUANTIZATION, rows)
+
+def fetch_embeddings(ids):
+    """Embeddings float32 de los chunks indicados (para reordenar candidatos)."""
+    conn = get_db()
+    c = conn.cursor()
+    found = []
+    vectors = []
     try:
-        # Extraer texto
-        with open(file_path, 'rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            num_pages = len(pdf_reader.pages)
+        # SQLite limita el número de parámetros por consulta
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            c.execute(f'SELECT id, embedding FROM embeddings WHERE id IN ({placeholders})', batch)
+            for row in c.fetchall():
+                found.append(row['id'])
+                vectors.append(embedding_from_blob(row['embedding']))
+    finally:
+        conn.close()
+    if not vectors:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    return found, np.vstack(vectors)
+
+def pdf_index_version(pdf_id):
+    """Versión de los vectores de un PDF listo (None si no existe o no está listo).
+
+    Con varios workers, la ingesta o el borrado ocurren en uno solo: los demás
+    detectan el cambio comparando esta versión con la de su copia en memoria.
+    """
+    conn = get_db()
+    try:
+        row = conn.execute("SELECT status, indexed_at FROM pdf_files WHERE id = ?", (pdf_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None or row['status'] != 'ready':
+        return None
+    return row['indexed_at'] or ''
+
+# Índice vectorial en memoria para la búsqueda en /api/chat
+vector_index = VectorIndex(load_pdf_vectors, quantization=EMBEDDING_QUANTIZATION,
+                           fetcher=fetch_embeddings, shortlist=QUANTIZATION_SHORTLIST,
+                           version=pdf_index_version)
+
+# Índice ANN global para buscar en todos los documentos a la vez
+# (scope 'all' en /api/chat). ANN_NPROBE equilibra recall y latencia.
+ALL_DOCUMENTS = '*'
+ANN_INDEX_PATH = os.getenv('ANN_INDEX_PATH', 'data/ann_index.npz')
+ann_index = IVFIndex(
+    ANN_INDEX_PATH,
+    nlist=int(os.getenv('ANN_NLIST', 0)) or None,
+    nprobe=int(os.getenv('ANN_NPROBE', 8)),
+    train_min=int(os.getenv('ANN_TRAIN_MIN', 4096)),
+    max_segments=int(os.getenv('ANN_MAX_SEGMENTS', 64)),
+    quantization=EMBEDDING_QUANTIZATION
+)
+_ann_index_ready = False
+_ann_index_lock = threading.Lock()
+
+def iter_ready_pdf_vectors():
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT id FROM pdf_files WHERE status = 'ready'")
+    pdf_ids = [row['id'] for row in c.fetchall()]
+    conn.close()
+    
+    for pdf_id in pdf_ids:
+        # El índice ANN se entrena con float32 y cuantiza él mismo si procede
+        ids, matrix = load_pdf_embeddings(pdf_id)
+        if ids:
+            yield pdf_id, ids, matrix
+
+def ensure_ann_index():
+    """Carga el índice ANN de disco o, si no existe, lo construye desde la base de datos."""
+    global _ann_index_ready
+    if _ann_index_ready:
+        return ann_index
+    with _ann_index_lock:
+        if not _ann_index_ready:
+            if not ann_index.load():
+                print("Construyendo el índice ANN a partir de la base de datos...")
+                ann_index.build(iter_ready_pdf_vectors())
+                print(f"Índice ANN construido: {len(ann_index)} vectores")
+            _ann_index_ready = True
+    return ann_index
+
+# Caché semántica de respuestas: preguntas casi idénticas sobre los mismos
+# chunks de un PDF se responden sin llamar al LLM
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv('ANSWER_CACHE_SIZE', 512)),
+    ttl=int(os.getenv('ANSWER_CACHE_TTL', 3600)),
+    threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+)
+
+# Métricas para /metrics. Las etapas del pipeline comparten un histograma
+# (etiqueta 'stage'); dentro de una petición también van a Server-Timing.
+metrics_registry = Registry()
+STAGE_SECONDS = metrics_registry.histogram(
+    'rag_stage_duration_seconds', 'Duración de cada etapa de la ingesta y del chat', ['stage'])
+HTTP_REQUEST_SECONDS = metrics_registry.histogram(
+    'rag_http_request_duration_seconds', 'Duración de las peticiones HTTP (sin el cuerpo de los streams)',
+    ['endpoint', 'method', 'status'])
+INGESTED_ITEMS = metrics_registry.counter(
+    'rag_ingested_items_total', 'Elementos procesados en la ingesta (pages, pages_reused, chunks, images)', ['kind'])
+INGEST_JOBS = metrics_registry.counter('rag_ingest_jobs_total', 'Trabajos de ingesta terminados', ['status'])
+CHAT_REQUESTS = metrics_registry.counter(
+    'rag_chat_requests_total', 'Respuestas de /api/chat por origen (llm, cache, error)', ['result'])
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if has_request_context():
+        g.setdefault('stage_timings', []).append((stage, seconds))
+
+@contextmanager
+def stage_timer(stage):
+    """Mide una etapa del pipeline (histograma y cabecera Server-Timing)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def cache_stats():
+    """Aciertos, fallos y entradas de cada caché: {nombre: (hits, misses, entradas)}."""
+    query_info = _encode_normalized_query.cache_info()
+    return {
+        'answer': (answer_cache.hits, answer_cache.misses, len(answer_cache)),
+        'query_embedding': (query_info.hits, query_info.misses, query_info.currsize),
+        'vector_index': (vector_index.hits, vector_index.misses, len(vector_index)),
+    }
+
+def cache_hit_ratio():
+    return {(name,): hits / (hits + misses) if hits + misses else 0.0
+            for name, (hits, misses, _) in cache_stats().items()}
+
+def ingest_queue_depth():
+    depth = {('queued',): 0, ('running',): 0}
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        c.execute('''
+            SELECT status, COUNT(*) FROM ingest_jobs
+            WHERE status IN ('queued', 'running')
+            GROUP BY status
+        ''')
+        depth.update({(row[0],): row[1] for row in c.fetchall()})
+    finally:
+        conn.close()
+    return depth
+
+metrics_registry.counter('rag_cache_hits_total', 'Aciertos de cada caché', ['cache'],
+                         callback=lambda: {(name,): stats[0] for name, stats in cache_stats().items()})
+metrics_registry.counter('rag_cache_misses_total', 'Fallos de cada caché', ['cache'],
+                         callback=lambda: {(name,): stats[1] for name, stats in cache_stats().items()})
+metrics_registry.gauge('rag_cache_hit_ratio', 'Proporción de aciertos de cada caché desde el arranque', ['cache'],
+                       callback=cache_hit_ratio)
+metrics_registry.gauge('rag_cache_entries', 'Entradas en cada caché', ['cache'],
+                       callback=lambda: {(name,): stats[2] for name, stats in cache_stats().items()})
+metrics_registry.gauge('rag_ingest_queue_depth', 'Trabajos de ingesta en cola o en curso', ['status'],
+                       callback=ingest_queue_depth)
+metrics_registry.gauge('rag_ann_index_vectors', 'Vectores en el índice ANN global de este proceso',
+                       callback=lambda: {(): len(ann_index)})
+metrics_registry.gauge('rag_vector_memory_bytes', 'Memoria de los vectores en cada índice (cuantizados o float32)',
+                       ['index'], callback=lambda: {('pdf',): vector_index.memory_bytes(),
+                                                    ('ann',): ann_index.memory_bytes()})
+metrics_registry.gauge('rag_llm_in_flight', 'Llamadas al LLM en curso en este proceso',
+                       callback=lambda: {(): llm_client.in_flight})
+metrics_registry.gauge('rag_embedding_model_loaded', '1 si el modelo de embeddings ya está cargado',
+                       callback=lambda: {(): int(model_ready.is_set())})
+
+def encode_chunks(pending, heartbeat=None):
+    """Codifica en lotes los chunks pendientes y devuelve su matriz float32.
+
+    ``pending`` es una lista de tuplas ``(page_id, chunk_index, chunk)`` con
+    ``chunk`` de tipo chunking.Chunk. ``heartbeat`` se llama entre tramos de
+    la codificación para señalar que la ingesta sigue viva.
+    """
+    texts = [chunk.text for _, _, chunk in pending]
+    # Un error del modelo hace fallar la ingesta: perder el lote en silencio
+    # dejaría páginas sin embeddings que una reingesta daría por procesadas
+    step = EMBEDDING_BATCH_SIZE * 8
+    parts = []
+    with stage_timer('encode'):
+        for start in range(0, len(texts), step):
+            if heartbeat and start:
+                heartbeat()
+            parts.append(np.asarray(
+                get_embedding_model().encode(texts[start:start + step], batch_size=EMBEDDING_BATCH_SIZE),
+                dtype=np.float32
+            ))
+    return np.vstack(parts)
+
+def store_chunks(c, pdf_id, pending, embeddings):
+    """Inserta con executemany los chunks ya codificados y devuelve sus ids."""
+    ids = [str(uuid.uuid4()) for _ in pending]
+    quantized = [None] * len(ids)
+    if EMBEDDING_QUANTIZATION:
+        codes, scales = quantize(EMBEDDING_QUANTIZATION, normalize_rows(embeddings))
+        quantized = [quantized_to_blob(EMBEDDING_QUANTIZATION, code_row, scale)
+                     for code_row, scale in zip(codes, scales)]
+    with stage_timer('db_insert'):
+        c.executemany('''
+            INSERT INTO embeddings (id, pdf_id, page_id, chunk_text, embedding, embedding_q,
+                                    chunk_index, char_start, char_end)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (embedding_id, pdf_id, page_id, chunk.text, embedding_to_blob(embedding), embedding_q,
+             chunk_index, chunk.char_start, chunk.char_end)
+            for embedding_id, (page_id, chunk_index, chunk), embedding, embedding_q
+            in zip(ids, pending, embeddings, quantized)
+        ])
+    INGESTED_ITEMS.inc(len(ids), kind='chunks')
+    return ids
+
+def update_ingest_job(c, job_id, **fields):
+    """Actualiza el progreso de un trabajo de ingesta (sin hacer commit)."""
+    fields['updated_at'] = datetime.now().isoformat()
+    assignments = ', '.join(f'{column} = ?' for column in fields)
+    c.execute(f'UPDATE ingest_jobs SET {assignments} WHERE id = ?', list(fields.values()) + [job_id])
+
+def store_image_bytes(image_data, ext):
+    """Guarda una imagen direccionada por contenido y devuelve (ruta, hash).
+
+    Las imágenes idénticas (logos, cabeceras...) se escriben una sola vez en
+    IMAGES_FOLDER/shared/ y todas las filas de pdf_images apuntan al mismo
+    archivo. Un archivo reutilizado se marca con la hora actual para que un
+    borrado concurrente no lo elimine antes de que la ingesta guarde su fila
+    (ver SHARED_IMAGE_MIN_AGE_SECONDS).
+    """
+    content_hash = hashlib.sha256(image_data).hexdigest()
+    image_dir = os.path.join(current_app.config['IMAGES_FOLDER'], 'shared', content_hash[:2])
+    image_path = os.path.join(image_dir, f'{content_hash}.{ext}')
+    
+    try:
+        os.utime(image_path)
+        exists = True
+    except FileNotFoundError:
+        exists = False
+    
+    if not exists:
+        os.makedirs(image_dir, exist_ok=True)
+        # Escribir en un temporal y renombrar para no dejar archivos a medias
+        tmp_path = f'{image_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, "wb") as img_file:
+            img_file.write(image_data)
+        os.replace(tmp_path, image_path)
+        
+        if THUMBNAILS_AT_INGEST:
+            try:
+                make_derivative(image_path, current_app.config['THUMBNAILS_FOLDER'], content_hash, 'thumb')
+            except Exception as e:
+                print(f"Advertencia: no se pudo generar la miniatura de {image_path}: {str(e)}")
+    
+    return image_path, content_hash
+
+def file_sha256(file_path):
+    """Hash SHA-256 del contenido de un archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def discard_partial_pdf(c, pdf_id):
+    """Elimina las filas de un PDF cuya ingesta no terminó."""
+    for table in ('embeddings', 'pdf_images', 'pdf_pages'):
+        c.execute(f'DELETE FROM {table} WHERE pdf_id = ?', (pdf_id,))
+    c.execute('DELETE FROM pdf_files WHERE id = ?', (pdf_id,))
+
+def ingest_pdf(job_id, pdf_id, filename, file_path, file_hash=None):
+    """Extrae texto, embeddings e imágenes de un PDF ya guardado en disco.
+
+    Un PDF nuevo queda con status 'processing' hasta el final; el progreso se
+    confirma página a página en ingest_jobs para /api/ingest-status.
+
+    Si ``pdf_id`` ya existe y está listo, la ingesta es incremental: las
+    páginas cuyo hash de texto no cambió conservan sus embeddings y solo se
+    recalculan las demás. El documento sigue disponible mientras tanto.
+    Devuelve ``(num_pages, image_count)``.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('SELECT status FROM pdf_files WHERE id = ?', (pdf_id,))
+    existing = c.fetchone()
+    incremental = existing is not None and existing['status'] == 'ready'
+    try:
+        # Abrir el PDF una sola vez con PyMuPDF
+        import fitz  # PyMuPDF is the package name, but we import fitz
+        
+        with fitz.open(file_path) as pdf_document:
+            num_pages = len(pdf_document)
             
-            conn = get_db()
-            c = conn.cursor()
+            # Páginas ya ingeridas: número de página -> (id, hash del texto)
+            existing_pages = {}
+            if incremental:
+                c.execute('SELECT id, page_number, text_hash FROM pdf_pages WHERE pdf_id = ?', (pdf_id,))
+                existing_pages = {row['page_number']: (row['id'], row['text_hash']) for row in c.fetchall()}
+            else:
+                # Limpiar restos de un intento anterior del mismo trabajo
+                discard_partial_pdf(c, pdf_id)
+                
+                # Guardar PDF
+                c.execute('''
+                    INSERT INTO pdf_files (id, filename, file_path, file_size, total_pages, status)
+                    VALUES (?, ?, ?, ?, ?, 'processing')
+                ''', (pdf_id, filename, file_path, os.path.getsize(file_path), num_pages))
+            update_ingest_job(c, job_id, stage='extract', total_pages=num_pages, pages_done=0, pages_reused=0)
+            conn.commit()
             
-            # Guardar PDF
-            c.execute('''
-                INSERT INTO pdf_files (id, filename, file_path, file_size, total_pages)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (pdf_id, filename, file_path, os.path.getsize(file_path), num_pages))
+            # Vectores nuevos para actualizar el índice en memoria
+            indexed_ids = []
+            indexed_vectors = []
             
-            # Extraer texto de cada página
-            for page_num in range(num_pages):
-                try:
-                    page = pdf_reader.pages[page_num]
-                    
-                    # Intentar extraer texto de diferentes maneras
-                    text = ''
-                    
-                    # Método 1: Extracción estándar
-                    text = page.extract_text() or ''
-                    
-                    # Si no se extrajo suficiente texto, intentar con parámetros alternativos
-                    if len(text.strip()) < 10:  # Si el texto es muy corto
-                        # Intentar con extracción más agresiva
-                        text = page.extract_text(x_tolerance=3, y_tolerance=3) or ''
-                    
-                    # Si aún no hay suficiente texto, intentar extraer por palabras
-                    if len(text.strip()) < 10:
-                        words = page.extract_words()
-                        if words:
-                            text = ' '.join(word['text'] for word in words)
-                    
-                    # Si aún no hay texto, registrar una advertencia
-                    if not text.strip():
-                        print(f"Advertencia: No se pudo extraer texto de la página {page_num + 1}")
-                        text = f"[Contenido no extraíble de la página {page_num + 1}]"
-                    
-                    # Insertar en la base de datos
-                    page_id = str(uuid.uuid4())
-                    c.execute('''
-                        INSERT INTO pdf_pages (id, pdf_id, page_number, text_content)
-                        VALUES (?, ?, ?, ?)
-                    ''', (page_id, pdf_id, page_num + 1, text))
-                    
-                    # Crear embeddings solo si hay suficiente texto
-                    if len(text.strip()) > 10:
-                        chunks = chunk_text(text)
-                        for i, chunk in enumerate(chunks):
-                            try:
-                                embedding = embedding_model.encode(chunk)
-                                embedding_json = json.dumps(embedding.tolist())
-                                embedding_id = str(uuid.uuid4())
-                                c.execute('''
-                                    INSERT INTO embeddings (id, pdf_id, page_id, chunk_text, embedding, chunk_index)
-                                    VALUES (?, ?, ?, ?, ?, ?)
-                                ''', (embedding_id, pdf_id, page_id, chunk, embedding_json, i))
-                            except Exception as e:
-                                print(f"Error al crear embedding para el chunk {i} de la página {page_num + 1}: {str(e)}")
+            # En una reingesta el PDF sigue 'ready' y consultable: los cambios
+            # de contenido (páginas, chunks, imágenes) se preparan en memoria y
+            # se escriben en la misma transacción que lo marca como
+            # reindexado. Hasta entonces solo se confirma el progreso del
+            # trabajo, y un fallo deja intacta la versión anterior. Un PDF
+            # nuevo no es visible hasta el final y se escribe por ventanas
+            changed_pages = []   # (texto, page_id) de las páginas modificadas
+            new_pages = []       # (page_id, pdf_id, número, texto)
+            encoded_chunks = []  # (chunks, embeddings, hashes) pendientes de guardar
+            image_rows = []
+            
+            # Chunks pendientes de codificar: se codifican en lotes. El hash
+            # del texto de cada página se guarda solo cuando sus chunks ya
+            # están almacenados, para que una reingesta tras un fallo no la
+            # dé por procesada
+            pending_chunks = []
+            pending_hashes = []
+            chunker = get_chunker()
+            
+            # Latido del trabajo: renueva updated_at (con commit) como mucho
+            # cada INGEST_HEARTBEAT_SECONDS. Cuando se llama no hay cambios de
+            # contenido de una reingesta sin confirmar
+            last_heartbeat = [time.monotonic()]
+            
+            def heartbeat():
+                if time.monotonic() - last_heartbeat[0] >= INGEST_HEARTBEAT_SECONDS:
+                    update_ingest_job(c, job_id)
+                    conn.commit()
+                    last_heartbeat[0] = time.monotonic()
+            
+            def write_pages():
+                for _, page_id in changed_pages:
+                    c.execute('DELETE FROM embeddings WHERE pdf_id = ? AND page_id = ?', (pdf_id, page_id))
+                c.executemany('UPDATE pdf_pages SET text_content = ?, text_hash = NULL WHERE id = ?', changed_pages)
+                c.executemany('''
+                    INSERT INTO pdf_pages (id, pdf_id, page_number, text_content)
+                    VALUES (?, ?, ?, ?)
+                ''', new_pages)
+                changed_pages.clear()
+                new_pages.clear()
+            
+            def store_encoded_chunks():
+                for chunks, vectors, hashes in encoded_chunks:
+                    if chunks:
+                        indexed_ids.extend(store_chunks(c, pdf_id, chunks, vectors))
+                        indexed_vectors.append(vectors)
+                    c.executemany('UPDATE pdf_pages SET text_hash = ? WHERE id = ?', hashes)
+                encoded_chunks.clear()
+            
+            def flush_pending_chunks():
+                vectors = encode_chunks(pending_chunks, heartbeat=heartbeat) if pending_chunks else None
+                encoded_chunks.append((list(pending_chunks), vectors, list(pending_hashes)))
+                pending_chunks.clear()
+                pending_hashes.clear()
+                if not incremental:
+                    write_pages()
+                    store_encoded_chunks()
+            
+            # Extraer el texto de todas las páginas (en paralelo si está configurado)
+            def report_extraction(pages_done):
+                update_ingest_job(c, job_id, pages_done=pages_done)
+                conn.commit()
+            
+            with stage_timer('extract'):
+                extracted_pages = extract_pages(
+                    file_path, num_pages,
+                    engine=PDF_ENGINE,
+                    workers=EXTRACT_WORKERS,
+                    min_parallel_pages=EXTRACT_PARALLEL_MIN_PAGES,
+                    progress=report_extraction,
+                    document=pdf_document
+                )
+            update_ingest_job(c, job_id, stage='text', pages_done=0)
+            
+            # Preparar cada página y encolar sus chunks
+            pages_reused = 0
+            for page_num, text, error, _, _ in extracted_pages:
+                if error is not None:
+                    print(f"Error al procesar la página {page_num + 1}: {error}")
+                else:
+                    # El hash incluye la configuración del chunker: si cambia,
+                    # las páginas se vuelven a trocear en la siguiente reingesta
+                    text_hash = text_sha256(f'{chunker.signature}\n{text}')
+                    previous = existing_pages.get(page_num + 1)
+                    if previous and previous[1] == text_hash:
+                        # Página sin cambios: se conservan sus embeddings
+                        pages_reused += 1
+                        page_id = None
+                    elif previous:
+                        # Página modificada: sustituir su texto y sus chunks
+                        page_id = previous[0]
+                        changed_pages.append((text, page_id))
+                    else:
+                        page_id = str(uuid.uuid4())
+                        new_pages.append((page_id, pdf_id, page_num + 1, text))
                     
-                    # Mostrar progreso cada 10 páginas
-                    if (page_num + 1) % 10 == 0:
-                        print(f"Procesadas {page_num + 1}/{num_pages} páginas...")
-                        
-                except Exception as e:
-                    print(f"Error al procesar la página {page_num + 1}: {str(e)}")
-                    continue
+                    if page_id:
+                        # Encolar chunks solo si hay suficiente texto
+                        if len(text.strip()) > 10:
+                            with stage_timer('chunk'):
+                                chunks = chunker.chunk(text)
+                            for i, chunk in enumerate(chunks):
+                                pending_chunks.append((page_id, i, chunk))
+                        pending_hashes.append((text_hash, page_id))
                 
-                # Crear embeddings
-                chunks = chunk_text(text)
-                for i, chunk in enumerate(chunks):
-                    embedding = embedding_model.encode(chunk)
-                    embedding_json = json.dumps(embedding.tolist())
-                    
-                    embedding_id = str(uuid.uuid4())
-                    c.execute('''
-                        INSERT INTO embeddings (id, pdf_id, page_id, chunk_text, embedding, chunk_index)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (embedding_id, pdf_id, page_id, chunk, embedding_json, i))
+                if len(pending_chunks) >= EMBEDDING_WINDOW_CHUNKS:
+                    flush_pending_chunks()
+                
+                # Progreso visible para /api/ingest-status
+                update_ingest_job(c, job_id, pages_done=page_num + 1, pages_reused=pages_reused)
+                conn.commit()
             
-            # Extraer imágenes usando PyMuPDF
+            update_ingest_job(c, job_id, stage='embeddings')
+            flush_pending_chunks()
+            update_ingest_job(c, job_id, stage='images')
+            conn.commit()
+            
+            # Extraer imágenes reutilizando el documento ya abierto
             image_count = 0
+            images_start = time.perf_counter()
             try:
-                # Abrir el PDF con PyMuPDF
-                pdf_document = fitz.open(file_path)
+                # Caché por documento: cada xref se decodifica una sola vez
+                xref_cache = {}
                 
-                for page_num in range(len(pdf_document)):
-                    page = pdf_document.load_page(page_num)
-                    image_list = page.get_images(full=True)
+                for extracted in extracted_pages:
+                    heartbeat()
+                    page_num = extracted.page_num
+                    image_xrefs = extracted.image_xrefs
+                    needs_render = extracted.needs_render
+                    
+                    # Con PyPDF2 no se conocen las imágenes: buscarlas con PyMuPDF
+                    if image_xrefs is None:
+                        page = pdf_document.load_page(page_num)
+                        image_xrefs = [img[0] for img in page.get_images(full=True)]
+                        needs_render = not image_xrefs and page.get_text().strip() == ''
                     
-                    if image_list:
-                        for img_index, img in enumerate(image_list):
-                            xref = img[0]
+                    page_images = []
+                    for xref in image_xrefs:
+                        if xref not in xref_cache:
                             base_image = pdf_document.extract_image(xref)
-                            image_data = base_image["image"]
-                            
-                            # Crear directorio si no existe
-                            image_dir = os.path.join(app.config['IMAGES_FOLDER'], pdf_id)
-                            os.makedirs(image_dir, exist_ok=True)
-                            
-                            # Guardar la imagen
-                            image_path = os.path.join(image_dir, f'page_{page_num + 1}_img_{img_index + 1}.png')
-                            with open(image_path, "wb") as img_file:
-                                img_file.write(image_data)
-                            
-                            # Guardar en la base de datos
-                            image_id = str(uuid.uuid4())
-                            c.execute('''
-                                INSERT INTO pdf_images (id, pdf_id, page_number, image_path, image_index)
-                                VALUES (?, ?, ?, ?, ?)
-                            ''', (image_id, pdf_id, page_num + 1, image_path, image_count))
-                            image_count += 1
-                            
-                            print(f"Imagen {img_index + 1} extraída de la página {page_num + 1}")
+                            xref_cache[xref] = store_image_bytes(base_image["image"], base_image.get("ext", "png"))
+                        page_images.append(xref_cache[xref])
                     
-                    # Si no hay imágenes en la página, intentar renderizar la página como imagen
-                    elif page.get_text().strip() == '':  # Si la página está vacía de texto
-                        pix = page.get_pixmap()
-                        image_dir = os.path.join(app.config['IMAGES_FOLDER'], pdf_id)
-                        os.makedirs(image_dir, exist_ok=True)
-                        image_path = os.path.join(image_dir, f'page_{page_num + 1}_render.png')
-                        pix.save(image_path)
-                        
-                        # Guardar en la base de datos
-                        image_id = str(uuid.uuid4())
-                        c.execute('''
-                            INSERT INTO pdf_images (id, pdf_id, page_number, image_path, image_index)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (image_id, pdf_id, page_num + 1, image_path, image_count))
-                        image_count += 1
-                        
+                    # Si la página no tiene imágenes ni texto, renderizarla como imagen
+                    if needs_render:
+                        pix = pdf_document.load_page(page_num).get_pixmap()
+                        page_images.append(store_image_bytes(pix.tobytes("png"), "png"))
                         print(f"Página {page_num + 1} guardada como imagen")
+                    
+                    # Una fila por imagen distinta de la página
+                    seen_hashes = set()
+                    for image_path, content_hash in page_images:
+                        if content_hash in seen_hashes:
+                            continue
+                        seen_hashes.add(content_hash)
+                        image_rows.append((str(uuid.uuid4()), pdf_id, page_num + 1, image_path,
+                                           image_count, content_hash))
+                        image_count += 1
                 
-                pdf_document.close()
-                print(f"Total de imágenes extraídas: {image_count}")
-                
+                print(f"Total de imágenes extraídas: {image_count} ({len(xref_cache)} distintas en el documento)")
+            
             except Exception as e:
                 print(f"Advertencia: Error al extraer imágenes: {str(e)}")
                 print("La aplicación continuará funcionando, pero sin extracción de imágenes.")
                 # Continuar sin imágenes - no es crítico
+            observe_stage('images', time.perf_counter() - images_start)
             
+            # Cambios de la reingesta y estado final en una sola transacción
+            write_pages()
+            store_encoded_chunks()
+            # La nueva versión puede tener menos páginas que la anterior
+            removed_pages = [page_id for number, (page_id, _) in existing_pages.items() if number > num_pages]
+            for page_id in removed_pages:
+                c.execute('DELETE FROM embeddings WHERE pdf_id = ? AND page_id = ?', (pdf_id, page_id))
+                c.execute('DELETE FROM pdf_pages WHERE id = ?', (page_id,))
+            # En una reingesta las imágenes se vuelven a asociar desde cero
+            # (los archivos compartidos que ya existen no se reescriben)
+            if incremental:
+                c.execute('DELETE FROM pdf_images WHERE pdf_id = ?', (pdf_id,))
+            c.executemany('''
+                INSERT INTO pdf_images (id, pdf_id, page_number, image_path, image_index, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', image_rows)
+            
+            indexed_at = datetime.now().isoformat()
+            c.execute('''
+                UPDATE pdf_files
+                SET status = 'ready', filename = ?, file_path = ?, file_size = ?, total_pages = ?,
+                    content_hash = ?, image_count = ?, indexed_at = ?
+                WHERE id = ?
+            ''', (filename, file_path, os.path.getsize(file_path), num_pages, file_hash, image_count,
+                  indexed_at, pdf_id))
+            update_ingest_job(c, job_id, status='done', stage='done', images=image_count)
             conn.commit()
-            conn.close()
+            INGESTED_ITEMS.inc(num_pages, kind='pages')
+            INGESTED_ITEMS.inc(pages_reused, kind='pages_reused')
+            INGESTED_ITEMS.inc(image_count, kind='images')
+    except Exception:
+        conn.rollback()
+        # Una reingesta fallida no llegó a escribir contenido: la versión
+        # anterior sigue intacta y consultable
+        if not incremental:
+            discard_partial_pdf(c, pdf_id)
+            conn.commit()
+        raise
+    finally:
+        conn.close()
+    
+    if incremental:
+        print(f"Reingesta de {filename}: {pages_reused}/{num_pages} páginas sin cambios")
+    
+    # Reemplazar lo que el índice haya podido cargar durante la ingesta
+    vector_index.invalidate(pdf_id)
+    answer_cache.invalidate(pdf_id)
+    answer_cache.invalidate(ALL_DOCUMENTS)
+    if incremental:
+        # El índice global necesita todos los vectores del PDF, no solo los nuevos
+        indexed_ids, matrix = load_pdf_embeddings(pdf_id)
+        indexed_vectors = [matrix] if indexed_ids else []
+        if not indexed_ids:
+            ensure_ann_index().remove([pdf_id])
+    elif indexed_ids:
+        vector_index.add(pdf_id, indexed_ids, np.vstack(indexed_vectors), version=indexed_at)
+    if indexed_ids:
+        ensure_ann_index().add(pdf_id, indexed_ids, np.vstack(indexed_vectors))
+    
+    return num_pages, image_count
+
+# Cola de ingesta: la tabla ingest_jobs es la cola persistente y cada proceso
+# arranca sus propios hilos (los hilos no sobreviven a un fork de gunicorn)
+ingest_wakeup = threading.Event()
+_ingest_workers_lock = threading.Lock()
+_ingest_workers_pid = None
+
+def claim_next_ingest_job():
+    """Reserva el trabajo en cola más antiguo; None si no hay ninguno."""
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        # Devolver a la cola los trabajos abandonados por un worker caído
+        stale_before = datetime.fromtimestamp(datetime.now().timestamp() - INGEST_STALE_SECONDS).isoformat()
+        c.execute('''
+            UPDATE ingest_jobs SET status = 'queued'
+            WHERE status = 'running' AND updated_at < ?
+        ''', (stale_before,))
+        conn.commit()
+        
+        while True:
+            c.execute('''
+                SELECT id, pdf_id, filename, file_path, content_hash FROM ingest_jobs
+                WHERE status = 'queued'
+                ORDER BY created_at
+                LIMIT 1
+            ''')
+            job = c.fetchone()
+            if job is None:
+                return None
             
-            return jsonify({
-                'success': True,
-                'pdfId': pdf_id,
-                'pages': num_pages,
-                'images': image_count
-            })
+            # Otro hilo u otro proceso puede haberlo reservado primero
+            c.execute('''
+                UPDATE ingest_jobs SET status = 'running', updated_at = ?
+                WHERE id = ? AND status = 'queued'
+            ''', (datetime.now().isoformat(), job['id']))
+            conn.commit()
+            if c.rowcount == 1:
+                return dict(job)
+    finally:
+        conn.close()
+
+def run_ingest_job(job):
+    try:
+        with stage_timer('ingest'):
+            num_pages, image_count = ingest_pdf(job['id'], job['pdf_id'], job['filename'], job['file_path'], job['content_hash'])
+        INGEST_JOBS.inc(status='done')
+        print(f"PDF {job['filename']} procesado: {num_pages} páginas, {image_count} imágenes")
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        INGEST_JOBS.inc(status='error')
+        print(f"Error al procesar el PDF {job['filename']}: {str(e)}")
+        conn = get_db()
+        update_ingest_job(conn.cursor(), job['id'], status='error', stage='error', error=str(e))
+        conn.commit()
+        conn.close()
 
-@app.route('/api/list-pdfs', methods=['GET'])
-def list_pdfs():
+def ingest_worker_loop(flask_app):
+    # La ingesta usa current_app.config fuera de cualquier petición
+    with flask_app.app_context():
+        run_ingest_worker()
+
+def run_ingest_worker():
+    while True:
+        try:
+            job = claim_next_ingest_job()
+        except Exception as e:
+            print(f"Error al leer la cola de ingesta: {str(e)}")
+            job = None
+        
+        if job is None:
+            ingest_wakeup.wait(INGEST_POLL_SECONDS)
+            ingest_wakeup.clear()
+            continue
+        
+        run_ingest_job(job)
+
+def start_ingest_workers():
+    """Arranca los hilos de ingesta de este proceso (idempotente)."""
+    global _ingest_workers_pid
+    with _ingest_workers_lock:
+        if _ingest_workers_pid == os.getpid():
+            return
+        _ingest_workers_pid = os.getpid()
+        flask_app = current_app._get_current_object()
+        for i in range(INGEST_WORKERS):
+            threading.Thread(target=ingest_worker_loop, args=(flask_app,), name=f'ingest-worker-{i}', daemon=True).start()
+
+
+@bp.before_app_request
+def ensure_ingest_workers():
+    # Reanuda los trabajos pendientes tras un reinicio o un fork
+    start_ingest_workers()
+
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    # La primera sonda arranca la preparación si nadie lo hizo antes
+    start_warm_up()
+    if not model_ready.is_set():
+        return jsonify({'status': 'warming_up'}), 503
+    return jsonify({'status': 'ok'})
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@bp.after_app_request
+def record_request_timing(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    # Tiempos por etapa visibles en las herramientas de desarrollo del navegador
+    timings = g.pop('stage_timings', []) + [('total', elapsed)]
+    response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@bp.route('/')
+def index():
+    return render_template('index.html')
+
+@bp.route('/api/upload-pdf', methods=['POST'])
+def upload_pdf():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    if not file.filename.endswith('.pdf'):
+        return jsonify({'error': 'File must be a PDF'}), 400
+    
+    filename = secure_filename(file.filename)
+    replace_pdf_id = request.form.get('replacePdfId') or None
+    
     conn = get_db()
     c = conn.cursor()
     
+    # Nueva versión de un PDF concreto: debe existir y no estar ingiriéndose
+    if replace_pdf_id:
+        c.execute("SELECT status FROM pdf_files WHERE id = ?", (replace_pdf_id,))
+        row = c.fetchone()
+        if not row or row['status'] != 'ready':
+            conn.close()
+            return jsonify({'error': 'PDF a reemplazar no encontrado'}), 404
+        c.execute('''
+            SELECT 1 FROM ingest_jobs WHERE pdf_id = ? AND status IN ('queued', 'running') LIMIT 1
+        ''', (replace_pdf_id,))
+        if c.fetchone():
+            conn.close()
+            return jsonify({'error': 'El PDF tiene una ingesta en curso'}), 409
+    
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    tmp_path = os.path.join(upload_folder, f'upload_{uuid.uuid4().hex}.tmp')
+    file.save(tmp_path)
+    content_hash = file_sha256(tmp_path)
+    
+    # Un PDF idéntico a uno ya ingerido (o en cola) no se vuelve a procesar
     c.execute('''
-        SELECT 
-            id, filename, file_size, uploaded_at, total_pages,
-            (SELECT COUNT(*) FROM pdf_images WHERE pdf_id = pdf_files.id) as image_count
-        FROM pdf_files
-        ORDER BY uploaded_at DESC
-    ''')
+        SELECT id FROM pdf_files
+        WHERE content_hash = ? AND status = 'ready'
+        LIMIT 1
+    ''', (content_hash,))
+    duplicate = c.fetchone()
+    if duplicate:
+        conn.close()
+        os.remove(tmp_path)
+        return jsonify({
+            'success': True,
+            'pdfId': duplicate['id'],
+            'status': 'done',
+            'duplicate': True
+        })
+    
+    c.execute('''
+        SELECT id, pdf_id FROM ingest_jobs
+        WHERE content_hash = ? AND status IN ('queued', 'running')
+        LIMIT 1
+    ''', (content_hash,))
+    active_job = c.fetchone()
+    if active_job:
+        conn.close()
+        os.remove(tmp_path)
+        return jsonify({
+            'success': True,
+            'jobId': active_job['id'],
+            'pdfId': active_job['pdf_id'],
+            'status': 'queued',
+            'duplicate': True
+        }), 202
+    
+    # Nueva versión de un PDF: el indicado por el cliente o, si está
+    # activado, el último con el mismo nombre
+    pdf_id = replace_pdf_id
+    if not pdf_id and REINGEST_BY_FILENAME:
+        c.execute('''
+            SELECT id FROM pdf_files
+            WHERE filename = ? AND status = 'ready'
+            ORDER BY uploaded_at DESC
+            LIMIT 1
+        ''', (filename,))
+        previous = c.fetchone()
+        if previous:
+            pdf_id = previous['id']
+    pdf_id = pdf_id or str(uuid.uuid4())
+    
+    file_path = os.path.join(upload_folder, f'{pdf_id}_{filename}')
+    os.replace(tmp_path, file_path)
+    
+    # Encolar la ingesta; el procesamiento ocurre en segundo plano
+    job_id = str(uuid.uuid4())
+    now = datetime.now().isoformat()
+    c.execute('''
+        INSERT INTO ingest_jobs (id, pdf_id, filename, file_path, content_hash, status, stage, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, 'queued', 'queued', ?, ?)
+    ''', (job_id, pdf_id, filename, file_path, content_hash, now, now))
+    conn.commit()
+    conn.close()
+    
+    start_ingest_workers()
+    ingest_wakeup.set()
+    
+    return jsonify({
+        'success': True,
+        'jobId': job_id,
+        'pdfId': pdf_id,
+        'status': 'queued'
+    }), 202
+
+@bp.route('/api/ingest-status/<job_id>', methods=['GET'])
+def ingest_status(job_id):
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('SELECT * FROM ingest_jobs WHERE id = ?', (job_id,))
+    row = c.fetchone()
+    conn.close()
+    
+    if not row:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    
+    return jsonify({
+        'jobId': row['id'],
+        'pdfId': row['pdf_id'],
+        'filename': row['filename'],
+        'status': row['status'],
+        'stage': row['stage'],
+        'pagesDone': row['pages_done'],
+        'totalPages': row['total_pages'],
+        'images': row['images'],
+        'pagesReused': row['pages_reused'],
+        'error': row['error'],
+        'createdAt': row['created_at'],
+        'updatedAt': row['updated_at']
+    })
+
+# Paginación por clave (keyset): el cursor codifica la clave de ordenación
+# de la última fila devuelta, así que cada página es una búsqueda por índice
+# en lugar de un OFFSET que recorre todas las filas anteriores
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_MESSAGES_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    # Todas las claves de ordenación son (fecha, id) en texto
+    if not isinstance(values, list) or len(values) != 2 or not all(isinstance(v, str) for v in values):
+        raise ValueError('Cursor inválido')
+    return values
+
+def page_params(default_limit):
+    """Lee ``limit`` y ``cursor`` de la petición. Lanza ValueError si no son válidos."""
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        raise ValueError('limit debe ser un número entero')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit debe estar entre 1 y {MAX_PAGE_SIZE}')
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+def split_page(rows, limit, key_columns):
+    """Recorta la fila extra pedida y devuelve ``(filas, siguiente_cursor)``."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][column] for column in key_columns])
+
+@bp.route('/api/list-pdfs', methods=['GET'])
+def list_pdfs():
+    try:
+        limit, cursor = page_params(DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
+    c = conn.cursor()
+    
+    # Keyset: los más recientes primero, desempate por id
+    if cursor:
+        c.execute('''
+            SELECT id, filename, file_size, uploaded_at, total_pages, image_count
+            FROM pdf_files
+            WHERE status = 'ready' AND (uploaded_at, id) < (?, ?)
+            ORDER BY uploaded_at DESC, id DESC
+            LIMIT ?
+        ''', (*cursor, limit + 1))
+    else:
+        c.execute('''
+            SELECT id, filename, file_size, uploaded_at, total_pages, image_count
+            FROM pdf_files
+            WHERE status = 'ready'
+            ORDER BY uploaded_at DESC, id DESC
+            LIMIT ?
+        ''', (limit + 1,))
+    rows, next_cursor = split_page(c.fetchall(), limit, ('uploaded_at', 'id'))
     
     pdfs = []
-    for row in c.fetchall():
+    for row in rows:
         pdfs.append({
             'id': row['id'],
             'filename': row['filename'],
@@ -354,9 +1374,172 @@ def list_pdfs():
         })
     
     conn.close()
-    return jsonify({'pdfs': pdfs})
+    return jsonify({'pdfs': pdfs, 'nextCursor': next_cursor})
+
+# Páginas que se devuelven al sistema de archivos tras cada borrado (solo
+# si la base de datos usa auto_vacuum=INCREMENTAL)
+DELETE_VACUUM_PAGES = int(os.getenv('DELETE_VACUUM_PAGES', 2000))
+# Una imagen compartida sin filas solo se borra al eliminar un PDF si nadie
+# la ha escrito ni reutilizado en este tiempo: una ingesta en curso puede
+# estar usándola sin haber guardado aún su fila. Las más recientes quedan
+# para storage_gc.py (que aplica el mismo margen)
+SHARED_IMAGE_MIN_AGE_SECONDS = 3600
 
-@app.route('/api/chat', methods=['POST'])
+def delete_pdfs(pdf_ids):
+    """Elimina PDFs con sus filas, archivos y entradas en cachés e índices.
+
+    Devuelve ``(borrados, no_encontrados, en_proceso)``. Los PDFs con una
+    ingesta en curso no se borran.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    deleted, not_found, busy = [], [], []
+    upload_paths = []
+    images = set()
+    try:
+        for pdf_id in pdf_ids:
+            c.execute('SELECT file_path FROM pdf_files WHERE id = ?', (pdf_id,))
+            row = c.fetchone()
+            if row is None:
+                not_found.append(pdf_id)
+                continue
+            
+            c.execute("SELECT 1 FROM ingest_jobs WHERE pdf_id = ? AND status = 'running'", (pdf_id,))
+            if c.fetchone():
+                busy.append(pdf_id)
+                continue
+            
+            c.execute('SELECT image_path, content_hash FROM pdf_images WHERE pdf_id = ?', (pdf_id,))
+            images.update((r['image_path'], r['content_hash']) for r in c.fetchall() if r['image_path'])
+            c.execute('SELECT file_path FROM ingest_jobs WHERE pdf_id = ?', (pdf_id,))
+            upload_paths.extend({row['file_path']} | {r['file_path'] for r in c.fetchall()})
+            
+            discard_partial_pdf(c, pdf_id)
+            c.execute('DELETE FROM ingest_jobs WHERE pdf_id = ?', (pdf_id,))
+            deleted.append(pdf_id)
+        conn.commit()
+        
+        # Las imágenes compartidas solo se borran si ningún otro PDF las usa
+        # (el archivo compartido se direcciona por su hash, que está indexado)
+        orphan_images = []
+        for image_path, content_hash in images:
+            if content_hash:
+                c.execute('SELECT 1 FROM pdf_images WHERE content_hash = ? LIMIT 1', (content_hash,))
+            else:
+                c.execute('SELECT 1 FROM pdf_images WHERE image_path = ? LIMIT 1', (image_path,))
+            if c.fetchone() is None:
+                orphan_images.append(image_path)
+        
+        if deleted and DELETE_VACUUM_PAGES:
+            c.execute(f'PRAGMA incremental_vacuum({DELETE_VACUUM_PAGES})')
+            c.fetchall()
+    finally:
+        conn.close()
+    
+    for path in upload_paths:
+        if path and os.path.isfile(path):
+            os.remove(path)
+    
+    images_dir = os.path.abspath(current_app.config['IMAGES_FOLDER'])
+    thumbs_dir = current_app.config['THUMBNAILS_FOLDER']
+    now = time.time()
+    for image_path in orphan_images:
+        try:
+            if now - os.path.getmtime(image_path) < SHARED_IMAGE_MIN_AGE_SECONDS:
+                continue
+            os.remove(image_path)
+        except FileNotFoundError:
+            pass
+        remove_derivatives(thumbs_dir, derivative_key(os.path.relpath(os.path.abspath(image_path), images_dir)))
+    
+    for pdf_id in deleted:
+        # Carpeta de imágenes por PDF de las ingestas anteriores a shared/
+        legacy_dir = os.path.join(images_dir, pdf_id)
+        if os.path.isdir(legacy_dir):
+            shutil.rmtree(legacy_dir, ignore_errors=True)
+        
+        vector_index.invalidate(pdf_id)
+        answer_cache.invalidate(pdf_id)
+    if deleted:
+        # Un solo segmento del índice ANN para todo el lote
+        ensure_ann_index().remove(deleted)
+        answer_cache.invalidate(ALL_DOCUMENTS)
+    
+    return deleted, not_found, busy
+
+@bp.route('/api/pdfs/<pdf_id>', methods=['DELETE'])
+def delete_pdf(pdf_id):
+    deleted, _, busy = delete_pdfs([pdf_id])
+    if busy:
+        return jsonify({'error': 'El PDF se está procesando; inténtalo cuando termine'}), 409
+    if not deleted:
+        return jsonify({'error': 'PDF no encontrado'}), 404
+    return jsonify({'success': True, 'deleted': deleted})
+
+@bp.route('/api/pdfs/delete', methods=['POST'])
+def delete_pdfs_bulk():
+    data = request.json or {}
+    pdf_ids = data.get('ids')
+    if not isinstance(pdf_ids, list) or not pdf_ids:
+        return jsonify({'error': 'Se requiere una lista de ids'}), 400
+    
+    deleted, not_found, busy = delete_pdfs(list(dict.fromkeys(pdf_ids)))
+    return jsonify({'success': True, 'deleted': deleted, 'notFound': not_found, 'processing': busy})
+
+def prefiltered_vector_search(c, message, query_embedding, pdf_id, k):
+    """Puntúa con vectores solo los candidatos de la búsqueda de texto.
+
+    Devuelve ``(coincidencias_vectoriales, ids_bm25)`` o None si la búsqueda de
+    texto no encontró nada.
+    """
+    rows = bm25_search(c, message, pdf_id, limit=FTS_PREFILTER_CANDIDATES, with_embeddings=True)
+    if not rows:
+        return None
+    
+    ids = [row['id'] for row in rows]
+    matrix = normalize_rows(np.vstack([embedding_from_blob(row['embedding']) for row in rows]))
+    scores = matrix @ normalize_rows(query_embedding)[0]
+    top = np.argsort(-scores)[:k]
+    return [(ids[i], float(scores[i])) for i in top], ids[:k]
+
+def vector_search(query_embedding, pdf_id, k):
+    """Similitud coseno: en un PDF (índice en memoria) o en todos (índice ANN)."""
+    with stage_timer('vector_search'):
+        if pdf_id:
+            return vector_index.search(pdf_id, query_embedding, k=k)
+        if EMBEDDING_QUANTIZATION:
+            # Similitudes aproximadas: se reordena una lista más larga con float32
+            matches = ensure_ann_index().search(query_embedding, k=max(k, QUANTIZATION_SHORTLIST))
+            return rescore([chunk_id for chunk_id, _, _ in matches], query_embedding, fetch_embeddings, k)
+        return [(chunk_id, score) for chunk_id, _, score in ensure_ann_index().search(query_embedding, k=k)]
+
+def retrieve_chunks(c, message, query_embedding, pdf_id=None):
+    """Devuelve ``[(embedding_id, puntuación), ...]`` con los RETRIEVAL_TOP_K mejores chunks.
+
+    Sin ``pdf_id`` busca en todos los documentos (índice ANN global).
+    """
+    if not (HYBRID_SEARCH_ENABLED and fts_available):
+        return vector_search(query_embedding, pdf_id, RETRIEVAL_TOP_K)
+    
+    k = max(RETRIEVAL_TOP_K, RETRIEVAL_CANDIDATES)
+    prefiltered = None
+    if pdf_id and FTS_PREFILTER_MIN_CHUNKS:
+        c.execute('SELECT COUNT(*) FROM embeddings WHERE pdf_id = ?', (pdf_id,))
+        if c.fetchone()[0] >= FTS_PREFILTER_MIN_CHUNKS:
+            with stage_timer('prefilter'):
+                prefiltered = prefiltered_vector_search(c, message, query_embedding, pdf_id, k)
+    
+    if prefiltered:
+        vector_matches, keyword_ids = prefiltered
+    else:
+        vector_matches = vector_search(query_embedding, pdf_id, k)
+        with stage_timer('bm25'):
+            keyword_ids = [row['id'] for row in bm25_search(c, message, pdf_id, limit=k)]
+    
+    fused = reciprocal_rank_fusion([[chunk_id for chunk_id, _ in vector_matches], keyword_ids], k=RRF_K)
+    return fused[:RETRIEVAL_TOP_K]
+
+@bp.route('/api/chat', methods=['POST'])
 def chat():
     data = request.json
     message = data.get('message')
@@ -369,106 +1552,158 @@ def chat():
     conn = get_db()
     c = conn.cursor()
     
-    # Crear sesión si no existe
-    if not session_id:
-        session_id = str(uuid.uuid4())
+    try:
+        # Crear la sesión si no existe (también si el cliente envía un
+        # sessionId desconocido: messages tiene una clave foránea a ella)
+        session_id = session_id or str(uuid.uuid4())
         c.execute('''
-            INSERT INTO chat_sessions (id, title, created_at, updated_at)
+            INSERT OR IGNORE INTO chat_sessions (id, title, created_at, updated_at)
             VALUES (?, ?, ?, ?)
         ''', (session_id, message[:50], datetime.now().isoformat(), datetime.now().isoformat()))
+        
+        # Guardar mensaje del usuario
+        user_message_id = str(uuid.uuid4())
+        c.execute('''
+            INSERT INTO messages (id, session_id, role, content, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_message_id, session_id, 'user', message, datetime.now().isoformat()))
+        # Confirmar ya: no mantener el bloqueo de escritura durante la llamada al LLM
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     
-    # Guardar mensaje del usuario
-    user_message_id = str(uuid.uuid4())
-    c.execute('''
-        INSERT INTO messages (id, session_id, role, content, created_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_message_id, session_id, 'user', message, datetime.now().isoformat()))
-    
-    # Buscar contexto relevante
+    # Buscar contexto relevante: en un PDF (pdfId) o en todos (scope 'all')
     context = None
-    if pdf_id:
+    cache_key = None
+    search_all = data.get('scope') == 'all'
+    if pdf_id or search_all:
         # Generar embedding de la pregunta
-        query_embedding = embedding_model.encode(message)
+        with stage_timer('embed_query'):
+            query_embedding = encode_query(message)
         
-        # Buscar chunks similares
-        c.execute('''
-            SELECT e.id, e.chunk_text, e.embedding, p.page_number, e.pdf_id
-            FROM embeddings e
-            JOIN pdf_pages p ON e.page_id = p.id
-            WHERE e.pdf_id = ?
-        ''', (pdf_id,))
+        # Buscar los chunks más relevantes (vectores + BM25)
+        cache_scope = ALL_DOCUMENTS if search_all else pdf_id
+        with stage_timer('retrieve'):
+            top_matches = retrieve_chunks(c, message, query_embedding, None if search_all else pdf_id)
         
-        chunks = []
-        for row in c.fetchall():
-            try:
-                chunk_embedding = json.loads(row['embedding'])
-                similarity = cosine_similarity(query_embedding, chunk_embedding)
-                chunks.append({
+        context_start = time.perf_counter()
+        top_chunks = []
+        if top_matches:
+            if ANSWER_CACHE_ENABLED:
+                cache_key = (cache_scope, [chunk_id for chunk_id, _ in top_matches], query_embedding)
+            scores = dict(top_matches)
+            placeholders = ','.join('?' * len(scores))
+            c.execute(f'''
+                SELECT e.id, e.pdf_id, e.chunk_text, e.char_start, e.char_end, p.page_number, f.filename
+                FROM embeddings e
+                JOIN pdf_pages p ON e.page_id = p.id
+                JOIN pdf_files f ON e.pdf_id = f.id
+                WHERE e.id IN ({placeholders})
+            ''', list(scores))
+            
+            for row in c.fetchall():
+                top_chunks.append({
                     'text': row['chunk_text'],
-                    'similarity': similarity,
-                    'page_number': row['page_number']
+                    'similarity': scores[row['id']],
+                    'pdf_id': row['pdf_id'],
+                    'filename': row['filename'],
+                    'page_number': row['page_number'],
+                    'char_start': row['char_start'],
+                    'char_end': row['char_end']
                 })
-            except Exception as e:
-                print(f"Error procesando chunk: {e}")
-                continue
-        
-        chunks.sort(key=lambda x: x['similarity'], reverse=True)
-        top_chunks = chunks[:3]
+            top_chunks.sort(key=lambda x: x['similarity'], reverse=True)
         
         if top_chunks:
             relevant_text = '\n\n'.join([c['text'] for c in top_chunks])
-            page_numbers = list(set([c['page_number'] for c in top_chunks]))
+            # Páginas referenciadas, agrupadas por PDF
+            pages_by_pdf = {}
+            filenames = {}
+            for chunk in top_chunks:
+                pages_by_pdf.setdefault(chunk['pdf_id'], set()).add(chunk['page_number'])
+                filenames[chunk['pdf_id']] = chunk['filename']
             
             # Obtener imágenes
-            if page_numbers:
+            images = []
+            seen_paths = set()
+            for ref_pdf_id, page_numbers in pages_by_pdf.items():
                 placeholders = ','.join('?' * len(page_numbers))
                 c.execute(f'''
                     SELECT id, page_number, image_path
                     FROM pdf_images
                     WHERE pdf_id = ? AND page_number IN ({placeholders})
-                ''', [pdf_id] + page_numbers)
-            else:
-                c.execute('''
-                    SELECT id, page_number, image_path
-                    FROM pdf_images
-                    WHERE pdf_id = ?
-                ''', (pdf_id,))
+                ''', [ref_pdf_id] + list(page_numbers))
+                
+                for row in c.fetchall():
+                    # Las imágenes compartidas (logos, cabeceras) se devuelven una sola vez
+                    if row['image_path'] in seen_paths:
+                        continue
+                    seen_paths.add(row['image_path'])
+                    
+                    # Normalizar ruta para que sea relativa a IMAGES_FOLDER
+                    raw_path = row['image_path'] or ''
+                    # Usar separadores tipo Unix para simplificar
+                    rel_path = raw_path.replace('\\', '/')
+                    # Quitar prefijo data/images/ si viene incluido
+                    if rel_path.startswith('data/images/'):
+                        rel_path = rel_path[len('data/images/'):]
+                    images.append({
+                        'pageNumber': row['page_number'],
+                        'imagePath': rel_path
+                    })
             
-            images = []
-            for row in c.fetchall():
-                # Normalizar ruta para que sea relativa a IMAGES_FOLDER
-                raw_path = row['image_path'] or ''
-                # Usar separadores tipo Unix para simplificar
-                rel_path = raw_path.replace('\\', '/')
-                # Quitar prefijo data/images/ si viene incluido
-                if rel_path.startswith('data/images/'):
-                    rel_path = rel_path[len('data/images/'):]
-                images.append({
-                    'pageNumber': row['page_number'],
-                    'imagePath': rel_path
-                })
+            pdf_references = []
+            for ref_pdf_id, page_numbers in pages_by_pdf.items():
+                for pn in page_numbers:
+                    reference = {'pdfId': ref_pdf_id, 'pageNumber': pn}
+                    if search_all:
+                        reference['filename'] = filenames[ref_pdf_id]
+                    pdf_references.append(reference)
+            
+            # Fragmentos exactos usados, en orden de relevancia
+            citations = [{
+                'pdfId': chunk['pdf_id'],
+                'pageNumber': chunk['page_number'],
+                'charStart': chunk['char_start'],
+                'charEnd': chunk['char_end']
+            } for chunk in top_chunks]
             
             context = {
                 'relevantText': relevant_text,
                 'images': images,
-                'pdfReferences': [{'pdfId': pdf_id, 'pageNumber': pn} for pn in page_numbers]
+                'pdfReferences': pdf_references,
+                'citations': citations
             }
+        observe_stage('context', time.perf_counter() - context_start)
     
-    # Obtener historial
-    c.execute('''
-        SELECT role, content
-        FROM messages
-        WHERE session_id = ?
-        ORDER BY created_at ASC
-    ''', (session_id,))
-    
-    history = []
-    for row in c.fetchall():
-        history.append({
-            'role': row['role'],
-            'content': row['content']
+    # Respuesta en caché para una pregunta equivalente sobre los mismos chunks
+    cached = answer_cache.lookup(*cache_key) if cache_key else None
+    if cached:
+        assistant_response, context = cached
+        CHAT_REQUESTS.inc(result='cache')
+        save_assistant_message(c, session_id, assistant_response, context)
+        conn.commit()
+        conn.close()
+        
+        if data.get('stream'):
+            return Response(
+                sse_event({'sessionId': session_id, 'context': chat_response_context(context), 'cached': True}, 'meta') +
+                sse_event({'token': assistant_response}) +
+                sse_event({'response': assistant_response, 'sessionId': session_id, 'cached': True}, 'done'),
+                mimetype='text/event-stream'
+            )
+        return jsonify({
+            'response': assistant_response,
+            'sessionId': session_id,
+            'context': chat_response_context(context),
+            'cached': True
         })
     
+    # Obtener historial: resumen de lo antiguo más los turnos recientes
+    with stage_timer('history'):
+        summary, history = load_history_window(c, session_id, user_message_id)
+    
     # Preparar mensaje para OpenRouter
     system_message = {
         'role': 'system',
@@ -484,86 +1719,62 @@ Cuando respondas preguntas sobre documentos:
     if context and context.get('relevantText'):
         user_content = f"Contexto del documento:\n{context['relevantText']}\n\nPregunta del usuario: {message}"
         if context.get('pdfReferences'):
-            refs = ', '.join([f"Página {r['pageNumber']}" for r in context['pdfReferences']])
+            refs = ', '.join([
+                f"{r['filename']}, página {r['pageNumber']}" if r.get('filename') else f"Página {r['pageNumber']}"
+                for r in context['pdfReferences']
+            ])
             user_content += f"\n\nReferencias: {refs}"
         if context.get('images'):
             img_refs = ', '.join([f"Imagen en página {img['pageNumber']}" for img in context['images']])
             user_content += f"\n\nImágenes disponibles: {img_refs}"
     
-    messages = [system_message] + [
+    summary_messages = [{
+        'role': 'system',
+        'content': f"Resumen de la conversación anterior:\n{summary}"
+    }] if summary else []
+    
+    messages = [system_message] + summary_messages + [
         {'role': msg['role'], 'content': msg['content']} 
-        for msg in history[:-1]
+        for msg in history
     ] + [{'role': 'user', 'content': user_content}]
     
+    # Modo streaming: reenviar los tokens al navegador por SSE
+    if data.get('stream'):
+        conn.close()
+        return stream_chat_response(session_id, messages, context, cache_key)
+    
     # Llamar a OpenRouter usando requests
     try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": os.getenv('OPENROUTER_HTTP_REFERER', 'http://localhost:5000'),
-            "X-Title": os.getenv('OPENROUTER_APP_NAME', 'RAG Chatbot'),
-        }
-        
-        data = {
-            "model": MODEL_NAME,
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 2000
-        }
-        
-        response = requests.post(API_URL, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
+        with stage_timer('llm'):
+            response = llm_client.chat_completion(openrouter_payload(messages))
+        CHAT_REQUESTS.inc(result='llm')
         
         try:
             response_data = response.json()
             if 'choices' in response_data and len(response_data['choices']) > 0:
                 assistant_response = response_data['choices'][0]['message']['content']
+                if cache_key:
+                    answer_cache.store(*cache_key, assistant_response, context)
             else:
                 assistant_response = "No se pudo obtener una respuesta del modelo."
         except ValueError as e:
             error_msg = f"Error al procesar la respuesta de la API: {str(e)}\nRespuesta: {response.text[:200]}"
             assistant_response = error_msg
         
-        # Guardar respuesta
-        assistant_message_id = str(uuid.uuid4())
-        # Guardar solo la ruta relativa de las imágenes, compatible con /api/image
-        image_ids = ','.join([img['imagePath'] for img in context['images']]) if context and context.get('images') else None
-        pdf_refs = ','.join([f"{r['pdfId']}:{r['pageNumber']}" for r in context['pdfReferences']]) if context and context.get('pdfReferences') else None
-        
-        c.execute('''
-            INSERT INTO messages (id, session_id, role, content, image_ids, pdf_references, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (assistant_message_id, session_id, 'assistant', assistant_response, image_ids, pdf_refs, datetime.now().isoformat()))
-        
-        c.execute('''
-            UPDATE chat_sessions
-            SET updated_at = ?
-            WHERE id = ?
-        ''', (datetime.now().isoformat(), session_id))
-        
+        save_assistant_message(c, session_id, assistant_response, context)
         conn.commit()
         conn.close()
         
         return jsonify({
             'response': assistant_response,
             'sessionId': session_id,
-            'context': {
-                'images': context['images'] if context else [],
-                'pdfReferences': context['pdfReferences'] if context else []
-            } if context else None
+            'context': chat_response_context(context)
         })
     except requests.exceptions.RequestException as e:
         if 'conn' in locals():
             conn.close()
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error en la API de OpenRouter: {error_details}")
-        if hasattr(e, 'response') and e.response is not None:
-            try:
-                error_data = e.response.json()
-                print(f"Respuesta de error de la API: {error_data}")
-            except:
-                print(f"Respuesta de error (texto): {e.response.text}")
+        CHAT_REQUESTS.inc(result='error')
+        log_openrouter_error(e)
         return jsonify({'error': f'Error al comunicarse con la API: {str(e)}'}), 500
     except Exception as e:
         if 'conn' in locals():
@@ -573,22 +1784,264 @@ Cuando respondas preguntas sobre documentos:
         print(f"Error en /api/chat: {error_details}")
         return jsonify({'error': f'Error al procesar el chat: {str(e)}'}), 500
 
-@app.route('/api/history', methods=['GET'])
+def estimate_tokens(text):
+    # Aproximación (~4 caracteres por token); evita cargar un tokenizer
+    return len(text) // 4 + 1
+
+def load_history_window(c, session_id, exclude_message_id):
+    """Devuelve ``(resumen, mensajes_recientes)`` para el prompt.
+
+    Lee como mucho HISTORY_MAX_MESSAGES + 1 filas, de la más reciente hacia
+    atrás, y se queda con las que caben en HISTORY_TOKEN_BUDGET. Si quedan
+    mensajes fuera de la ventana que el resumen todavía no cubre, programa
+    su actualización en segundo plano.
+    """
+    c.execute('SELECT summary, summary_until, summary_until_id FROM chat_sessions WHERE id = ?', (session_id,))
+    session = c.fetchone()
+    summary = session['summary'] if session else None
+    
+    # Solo los mensajes posteriores a lo que ya está resumido
+    if session and session['summary_until']:
+        c.execute('''
+            SELECT id, role, content, created_at FROM messages
+            WHERE session_id = ? AND id != ? AND (created_at, id) > (?, ?)
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', (session_id, exclude_message_id, session['summary_until'], session['summary_until_id'], HISTORY_MAX_MESSAGES + 1))
+    else:
+        c.execute('''
+            SELECT id, role, content, created_at FROM messages
+            WHERE session_id = ? AND id != ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', (session_id, exclude_message_id, HISTORY_MAX_MESSAGES + 1))
+    rows = c.fetchall()
+    
+    window = []
+    used_tokens = 0
+    boundary = None
+    for row in rows:
+        tokens = estimate_tokens(row['content'])
+        if len(window) >= HISTORY_MAX_MESSAGES or used_tokens + tokens > HISTORY_TOKEN_BUDGET:
+            # Mensaje más reciente que se queda fuera de la ventana
+            boundary = (row['created_at'], row['id'])
+            break
+        window.append({'role': row['role'], 'content': row['content']})
+        used_tokens += tokens
+    window.reverse()
+    
+    if boundary and SUMMARY_ENABLED:
+        schedule_session_summary(session_id, boundary)
+    return summary, window
+
+# Sesiones con un resumen en curso en este proceso
+_summaries_in_progress = set()
+_summaries_lock = threading.Lock()
+
+def schedule_session_summary(session_id, boundary):
+    with _summaries_lock:
+        if session_id in _summaries_in_progress:
+            return
+        _summaries_in_progress.add(session_id)
+    threading.Thread(target=update_session_summary, args=(session_id, boundary), daemon=True).start()
+
+def update_session_summary(session_id, boundary):
+    """Incorpora al resumen los mensajes hasta ``boundary`` (inclusive).
+
+    Procesa como mucho SUMMARY_BATCH_MESSAGES mensajes por llamada; si queda
+    más pendiente, el siguiente turno lo retoma.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute('SELECT summary, summary_until, summary_until_id FROM chat_sessions WHERE id = ?', (session_id,))
+        session = c.fetchone()
+        if session is None:
+            return
+        
+        c.execute('''
+            SELECT id, role, content, created_at FROM messages
+            WHERE session_id = ? AND (created_at, id) > (?, ?) AND (created_at, id) <= (?, ?)
+            ORDER BY created_at ASC, id ASC
+            LIMIT ?
+        ''', (session_id, session['summary_until'] or '', session['summary_until_id'] or '',
+              boundary[0], boundary[1], SUMMARY_BATCH_MESSAGES))
+        rows = c.fetchall()
+        if not rows:
+            return
+        conn.close()
+        
+        transcript = '\n'.join(
+            f"{'Usuario' if row['role'] == 'user' else 'Asistente'}: {row['content']}" for row in rows
+        )
+        prompt = (
+            f"Resumen actual:\n{session['summary'] or '(vacío)'}\n\n"
+            f"Mensajes nuevos:\n{transcript}\n\n"
+            "Actualiza el resumen incorporando los mensajes nuevos. Conserva los datos, "
+            "nombres, cifras, páginas y decisiones importantes. Responde solo con el resumen."
+        )
+        with stage_timer('summary'):
+            response = llm_client.chat_completion({
+                "model": MODEL_NAME,
+                "messages": [
+                    {'role': 'system', 'content': 'Resumes conversaciones de forma concisa y fiel.'},
+                    {'role': 'user', 'content': prompt}
+                ],
+                "temperature": 0.2,
+                "max_tokens": SUMMARY_MAX_TOKENS
+            })
+        new_summary = response.json()['choices'][0]['message']['content'].strip()
+        if not new_summary:
+            return
+        
+        last = rows[-1]
+        conn = get_db()
+        c = conn.cursor()
+        # Solo si nadie más actualizó el resumen mientras tanto
+        c.execute('''
+            UPDATE chat_sessions
+            SET summary = ?, summary_until = ?, summary_until_id = ?
+            WHERE id = ? AND summary_until IS ? AND summary_until_id IS ?
+        ''', (new_summary, last['created_at'], last['id'], session_id,
+              session['summary_until'], session['summary_until_id']))
+        conn.commit()
+    except Exception as e:
+        print(f"Error al resumir la sesión {session_id}: {str(e)}")
+    finally:
+        conn.close()
+        with _summaries_lock:
+            _summaries_in_progress.discard(session_id)
+
+def openrouter_payload(messages):
+    return {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 2000
+    }
+
+def log_openrouter_error(e):
+    import traceback
+    error_details = traceback.format_exc()
+    print(f"Error en la API de OpenRouter: {error_details}")
+    if hasattr(e, 'response') and e.response is not None:
+        try:
+            error_data = e.response.json()
+            print(f"Respuesta de error de la API: {error_data}")
+        except:
+            print(f"Respuesta de error (texto): {e.response.text}")
+
+def chat_response_context(context):
+    if not context:
+        return None
+    return {
+        'images': context['images'],
+        'pdfReferences': context['pdfReferences'],
+        'citations': context.get('citations', [])
+    }
+
+def save_assistant_message(c, session_id, assistant_response, context):
+    """Guarda la respuesta del asistente y actualiza la sesión (sin commit)."""
+    assistant_message_id = str(uuid.uuid4())
+    # Guardar solo la ruta relativa de las imágenes, compatible con /api/image
+    image_ids = ','.join([img['imagePath'] for img in context['images']]) if context and context.get('images') else None
+    pdf_refs = ','.join([f"{r['pdfId']}:{r['pageNumber']}" for r in context['pdfReferences']]) if context and context.get('pdfReferences') else None
+    
+    c.execute('''
+        INSERT INTO messages (id, session_id, role, content, image_ids, pdf_references, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (assistant_message_id, session_id, 'assistant', assistant_response, image_ids, pdf_refs, datetime.now().isoformat()))
+    
+    c.execute('''
+        UPDATE chat_sessions
+        SET updated_at = ?
+        WHERE id = ?
+    ''', (datetime.now().isoformat(), session_id))
+
+def sse_event(data, event=None):
+    frame = f"event: {event}\n" if event else ''
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_chat_response(session_id, messages, context, cache_key=None):
+    """Respuesta SSE: evento 'meta', un evento por token y 'done' al terminar.
+
+    La respuesta completa se guarda en messages cuando termina el stream.
+    """
+    def generate():
+        yield sse_event({'sessionId': session_id, 'context': chat_response_context(context)}, 'meta')
+        
+        tokens = []
+        # La cabecera Server-Timing ya se envió: estas etapas solo van al histograma
+        llm_start = time.perf_counter()
+        try:
+            for token in llm_client.stream_chat_completion(openrouter_payload(messages)):
+                if not tokens:
+                    STAGE_SECONDS.observe(time.perf_counter() - llm_start, stage='llm_first_token')
+                tokens.append(token)
+                yield sse_event({'token': token})
+            STAGE_SECONDS.observe(time.perf_counter() - llm_start, stage='llm')
+            CHAT_REQUESTS.inc(result='llm')
+            
+            if not tokens:
+                tokens.append("No se pudo obtener una respuesta del modelo.")
+                yield sse_event({'token': tokens[0]})
+            elif cache_key:
+                answer_cache.store(*cache_key, ''.join(tokens), context)
+            yield sse_event({'response': ''.join(tokens), 'sessionId': session_id}, 'done')
+        except requests.exceptions.RequestException as e:
+            CHAT_REQUESTS.inc(result='error')
+            log_openrouter_error(e)
+            yield sse_event({'error': f'Error al comunicarse con la API: {str(e)}'}, 'error')
+        except Exception as e:
+            print(f"Error en el stream de /api/chat: {str(e)}")
+            yield sse_event({'error': f'Error al procesar el chat: {str(e)}'}, 'error')
+        finally:
+            # Guardar lo recibido aunque el cliente se haya desconectado
+            if tokens:
+                conn = get_db()
+                save_assistant_message(conn.cursor(), session_id, ''.join(tokens), context)
+                conn.commit()
+                conn.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/history', methods=['GET'])
 def history():
     session_id = request.args.get('sessionId')
+    try:
+        limit, cursor = page_params(DEFAULT_MESSAGES_PAGE_SIZE if session_id else DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     conn = get_db()
     c = conn.cursor()
     
     if session_id:
-        c.execute('''
-            SELECT id, role, content, image_ids, pdf_references, created_at
-            FROM messages
-            WHERE session_id = ?
-            ORDER BY created_at ASC
-        ''', (session_id,))
+        # Mensajes en orden cronológico; el cursor apunta al último devuelto
+        if cursor:
+            c.execute('''
+                SELECT id, role, content, image_ids, pdf_references, created_at
+                FROM messages
+                WHERE session_id = ? AND (created_at, id) > (?, ?)
+                ORDER BY created_at ASC, id ASC
+                LIMIT ?
+            ''', (session_id, *cursor, limit + 1))
+        else:
+            c.execute('''
+                SELECT id, role, content, image_ids, pdf_references, created_at
+                FROM messages
+                WHERE session_id = ?
+                ORDER BY created_at ASC, id ASC
+                LIMIT ?
+            ''', (session_id, limit + 1))
+        rows, next_cursor = split_page(c.fetchall(), limit, ('created_at', 'id'))
         
         messages = []
-        for row in c.fetchall():
+        for row in rows:
             messages.append({
                 'id': row['id'],
                 'role': row['role'],
@@ -608,11 +2061,26 @@ def history():
         } if session_row else None
         
         conn.close()
-        return jsonify({'session': session, 'messages': messages})
+        return jsonify({'session': session, 'messages': messages, 'nextCursor': next_cursor})
     else:
-        c.execute('SELECT id, title, created_at, updated_at FROM chat_sessions ORDER BY updated_at DESC')
+        # Sesiones más recientes primero
+        if cursor:
+            c.execute('''
+                SELECT id, title, created_at, updated_at FROM chat_sessions
+                WHERE (updated_at, id) < (?, ?)
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+            ''', (*cursor, limit + 1))
+        else:
+            c.execute('''
+                SELECT id, title, created_at, updated_at FROM chat_sessions
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+            ''', (limit + 1,))
+        rows, next_cursor = split_page(c.fetchall(), limit, ('updated_at', 'id'))
+        
         sessions = []
-        for row in c.fetchall():
+        for row in rows:
             sessions.append({
                 'id': row['id'],
                 'title': row['title'],
@@ -620,9 +2088,9 @@ def history():
                 'updated_at': row['updated_at']
             })
         conn.close()
-        return jsonify({'sessions': sessions})
+        return jsonify({'sessions': sessions, 'nextCursor': next_cursor})
 
-@app.route('/api/recommended-questions', methods=['GET'])
+@bp.route('/api/recommended-questions', methods=['GET'])
 def recommended_questions():
     session_id = request.args.get('sessionId')
     pdf_id = request.args.get('pdfId')
@@ -647,16 +2115,22 @@ def recommended_questions():
     
     return jsonify({'questions': questions[:limit]})
 
-@app.route('/api/image', methods=['GET'])
+@bp.route('/api/image', methods=['GET'])
 def get_image():
     # Obtener la ruta de la imagen de manera segura
     image_path = request.args.get('path')
     if not image_path:
         return jsonify({'error': 'Se requiere la ruta de la imagen'}), 400
     
+    # Tamaño: 'thumb' o 'medium' (derivadas reducidas) o 'full' (original)
+    size = request.args.get('size', 'full')
+    if size != 'full' and size not in IMAGE_SIZES:
+        return jsonify({'error': f"Tamaño no válido: {size}"}), 400
+    
     # Asegurarse de que la ruta esté dentro del directorio permitido
-    upload_dir = os.path.abspath(app.config['IMAGES_FOLDER'])
+    upload_dir = os.path.abspath(current_app.config['IMAGES_FOLDER'])
     try:
+        rel_path = image_path
         image_path = os.path.abspath(os.path.join(upload_dir, image_path))
         if not image_path.startswith(upload_dir):
             return jsonify({'error': 'Ruta de imagen no permitida'}), 403
@@ -667,25 +2141,46 @@ def get_image():
     if not os.path.isfile(image_path):
         return jsonify({'error': 'Imagen no encontrada'}), 404
     
+    key = derivative_key(os.path.relpath(image_path, upload_dir))
+    if size != 'full':
+        try:
+            thumbs_dir = os.path.abspath(current_app.config['THUMBNAILS_FOLDER'])
+            image_path = make_derivative(image_path, thumbs_dir, key, size)
+        except Exception as e:
+            print(f"Advertencia: no se pudo generar la imagen '{size}' de {rel_path}: {str(e)}")
+    
     # Determinar el tipo MIME basado en la extensión del archivo
     mimetype = 'application/octet-stream'
     if image_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
         mimetype = f'image/{image_path.split(".")[-1].lower()}'
+        if mimetype == 'image/jpg':
+            mimetype = 'image/jpeg'
+    
+    # Las imágenes compartidas se nombran por su hash: su contenido nunca
+    # cambia y el navegador puede guardarlas indefinidamente
+    immutable = rel_path.replace('\\', '/').startswith('shared/')
     
     try:
-        # Enviar el archivo con el tipo MIME correcto
-        return send_file(
+        # Enviar el archivo con el tipo MIME correcto; send_file responde 304
+        # a If-None-Match con el mismo ETag
+        response = send_file(
             image_path,
             mimetype=mimetype,
             as_attachment=False,
-            download_name=os.path.basename(image_path)
+            download_name=os.path.basename(image_path),
+            etag=f'{key}-{size}' if immutable else True,
+            conditional=True,
+            max_age=31536000 if immutable else 3600
         )
     except Exception as e:
         return jsonify({'error': f'Error al cargar la imagen: {str(e)}'}), 500
+    
+    if immutable:
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+    return response
 
-    return send_file(image_path, mimetype='image/png')
-
-@app.route('/api/ai-chat', methods=['POST'])
+@bp.route('/api/ai-chat', methods=['POST'])
 def ai_chat():
     """Chat IA con acceso a la base de datos"""
     data = request.json
@@ -757,25 +2252,11 @@ Sé preciso, útil y amigable en tus respuestas.'''
     user_message = f"{db_info_text}\n\nPregunta del usuario: {message}"
     
     try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": os.getenv('OPENROUTER_HTTP_REFERER', 'http://localhost:5000'),
-            "X-Title": os.getenv('OPENROUTER_APP_NAME', 'RAG Chatbot'),
-        }
-        
-        data = {
-            "model": MODEL_NAME,
-            "messages": [
+        with stage_timer('llm'):
+            api_response = llm_client.chat_completion(openrouter_payload([
                 system_message,
                 {'role': 'user', 'content': user_message}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 2000
-        }
-        
-        api_response = requests.post(API_URL, headers=headers, json=data)
-        api_response.raise_for_status()
+            ]))
         response_data = api_response.json()
         
         if 'choices' in response_data and len(response_data['choices']) > 0:
@@ -795,6 +2276,60 @@ Sé preciso, útil y amigable en tus respuestas.'''
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def create_app(config=None):
+    """Crea la aplicación Flask (factoría).
+
+    Inicializa la base de datos y los directorios; no carga el modelo de
+    embeddings salvo que PRELOAD_EMBEDDING_MODEL=1.
+    """
+    flask_app = Flask(__name__)
+    flask_app.config['UPLOAD_FOLDER'] = 'data/uploads'
+    flask_app.config['IMAGES_FOLDER'] = 'data/images'
+    flask_app.config['THUMBNAILS_FOLDER'] = 'data/thumbs'
+    flask_app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max
+    if config:
+        flask_app.config.update(config)
+    
+    # Crear directorios necesarios
+    os.makedirs(flask_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(flask_app.config['IMAGES_FOLDER'], exist_ok=True)
+    os.makedirs(flask_app.config['THUMBNAILS_FOLDER'], exist_ok=True)
+    
+    init_db()
+    flask_app.register_blueprint(bp)
+    
+    if os.getenv('PRELOAD_EMBEDDING_MODEL') == '1':
+        get_embedding_model()
+    
+    return flask_app
+
+def start_background_tasks(flask_app):
+    """Arranca los hilos de ingesta y la preparación del modelo del proceso actual.
+
+    Se llama tras el fork de cada worker de gunicorn (ver gunicorn.conf.py).
+    """
+    with flask_app.app_context():
+        start_ingest_workers()
+    start_warm_up()
+
+# El objeto 'app' (el que usan 'gunicorn app:app' y los scripts) se crea al
+# accederse por primera vez, no al importar el módulo: importar app.py no
+# toca la base de datos ni crea directorios.
+_app = None
+_app_lock = threading.Lock()
+
+def get_app():
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+    return _app
+
+def __getattr__(name):
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
     # Este bloque no es necesario cuando se usa Gunicorn
     pass
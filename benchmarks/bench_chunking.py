@@ -0,0 +1,169 @@
+"""Compara el chunker por tokens con el chunker clásico de 500 palabras.
+
+Para cada chunker mide el número de chunks, cuántos superan la longitud
+máxima del modelo (y por tanto se truncan al codificarlos), el tiempo de
+encode y el recall@k de la recuperación: una consulta acierta si alguno de
+los k chunks más similares contiene la frase de la que salió la pregunta.
+
+Sin argumentos usa un corpus sintético con datos únicos por página
+("La pieza XR-1234 tiene un par de apriete de 35 Nm") y pregunta por ellos.
+Con --pdf usa el texto de PDFs reales y, como consultas, frases del propio
+documento con parte de sus palabras eliminadas.
+
+    python benchmarks/bench_chunking.py
+    python benchmarks/bench_chunking.py --pdf manual.pdf --queries 300 --json resultados.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import WordChunker, chunker_for_model, split_sentences  # noqa: E402
+from vector_index import normalize_rows  # noqa: E402
+
+FILLER = [
+    'El equipo debe revisarse antes de cada turno',
+    'Consulte la sección de seguridad para más detalles',
+    'Las tolerancias indicadas se aplican a temperatura ambiente',
+    'El mantenimiento preventivo reduce las paradas no planificadas',
+    'Utilice siempre el equipo de protección individual adecuado',
+    'Los valores pueden variar según la versión del fabricante',
+    'Registre cualquier incidencia en el libro de mantenimiento',
+    'La garantía no cubre los daños por uso indebido',
+]
+
+
+def synthetic_corpus(pages, facts_per_page, filler_sentences, seed):
+    """Páginas con relleno y datos únicos. Devuelve (páginas, consultas)."""
+    rng = random.Random(seed)
+    texts = []
+    queries = []
+    for page in range(pages):
+        sentences = [rng.choice(FILLER) + '.' for _ in range(filler_sentences)]
+        facts = []
+        for _ in range(facts_per_page):
+            code = f'XR-{rng.randint(1000, 9999)}'
+            torque = rng.randint(5, 120)
+            fact = f'La pieza {code} tiene un par de apriete de {torque} Nm.'
+            sentences.insert(rng.randint(0, len(sentences)), fact)
+            facts.append((fact, f'¿Qué par de apriete tiene la pieza {code}?'))
+
+        text = ' '.join(sentences)
+        for fact, question in facts:
+            start = text.index(fact)
+            queries.append((question, page, start, start + len(fact)))
+        texts.append(text)
+    return texts, queries
+
+
+def pdf_corpus(paths, num_queries, seed):
+    """Texto de PDFs reales; las consultas son frases con palabras eliminadas."""
+    from pdf_extraction import extract_pages
+
+    import fitz
+
+    texts = []
+    for path in paths:
+        with fitz.open(path) as document:
+            num_pages = len(document)
+        texts.extend(page.text for page in extract_pages(path, num_pages) if page.text)
+
+    rng = random.Random(seed)
+    candidates = [
+        (page, start, end)
+        for page, text in enumerate(texts)
+        for start, end in split_sentences(text)
+        if len(text[start:end].split()) >= 8
+    ]
+    queries = []
+    for page, start, end in rng.sample(candidates, min(num_queries, len(candidates))):
+        words = texts[page][start:end].split()
+        kept = [word for word in words if rng.random() > 0.3] or words
+        queries.append((' '.join(kept), page, start, end))
+    return texts, queries
+
+
+def evaluate(name, chunker, model, texts, queries, k, batch_size):
+    chunks = []
+    for page, text in enumerate(texts):
+        chunks.extend((page, chunk) for chunk in chunker.chunk(text))
+
+    chunk_texts = [chunk.text for _, chunk in chunks]
+    token_counts = np.array([len(ids) for ids in model.tokenizer(chunk_texts, add_special_tokens=False)['input_ids']])
+    limit = model.max_seq_length - 2
+
+    start = time.perf_counter()
+    matrix = normalize_rows(model.encode(chunk_texts, batch_size=batch_size))
+    encode_seconds = time.perf_counter() - start
+
+    query_matrix = normalize_rows(model.encode([query for query, _, _, _ in queries], batch_size=batch_size))
+    hits = 0
+    for (_, page, target_start, target_end), query in zip(queries, query_matrix):
+        scores = matrix @ query
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        for i in top:
+            chunk_page, chunk = chunks[i]
+            if chunk_page == page and chunk.char_start <= target_start and chunk.char_end >= target_end:
+                hits += 1
+                break
+
+    return {
+        'chunker': name,
+        'chunks': len(chunks),
+        'avg_tokens': float(token_counts.mean()) if len(chunks) else 0.0,
+        'truncated_chunks': int((token_counts > limit).sum()),
+        'truncated_tokens_pct': float(np.maximum(token_counts - limit, 0).sum() / max(token_counts.sum(), 1) * 100),
+        'encode_seconds': encode_seconds,
+        f'recall_at_{k}': hits / len(queries) if queries else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del chunker por tokens frente al de 500 palabras')
+    parser.add_argument('--pdf', nargs='*', help='PDFs a usar en lugar del corpus sintético')
+    parser.add_argument('--model', default=os.getenv('EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2'))
+    parser.add_argument('--pages', type=int, default=50, help='Páginas del corpus sintético')
+    parser.add_argument('--facts-per-page', type=int, default=6)
+    parser.add_argument('--filler', type=int, default=60, help='Frases de relleno por página sintética')
+    parser.add_argument('--queries', type=int, default=200, help='Consultas con --pdf')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(args.model)
+    if args.pdf:
+        texts, queries = pdf_corpus(args.pdf, args.queries, args.seed)
+    else:
+        texts, queries = synthetic_corpus(args.pages, args.facts_per_page, args.filler, args.seed)
+    print(f"Corpus: {len(texts)} páginas, {len(queries)} consultas, modelo {args.model} "
+          f"(max_seq_length={model.max_seq_length})")
+
+    results = [
+        evaluate('words-500', WordChunker(), model, texts, queries, args.k, args.batch_size),
+        evaluate('tokens', chunker_for_model(model, args.model), model, texts, queries, args.k, args.batch_size),
+    ]
+
+    recall_key = f'recall_at_{args.k}'
+    print(f"\n{'chunker':<12}{'chunks':>8}{'tokens/chunk':>14}{'truncados':>11}{'% tokens perdidos':>19}{'encode (s)':>12}{recall_key:>14}")
+    for r in results:
+        print(f"{r['chunker']:<12}{r['chunks']:>8}{r['avg_tokens']:>14.1f}{r['truncated_chunks']:>11}"
+              f"{r['truncated_tokens_pct']:>19.1f}{r['encode_seconds']:>12.2f}{r[recall_key]:>14.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'model': args.model, 'pages': len(texts), 'queries': len(queries), 'results': results}, f, indent=2)
+        print(f"\nResultados guardados en {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Rendimiento de la ingesta: páginas/s, chunks/s, tiempo por etapa y memoria.
+
+Sube PDFs sintéticos por ``/api/upload-pdf`` (con el cliente de pruebas de
+Flask, sin servidor HTTP), espera a que los workers de ingesta terminen y
+mide el tiempo total, la latencia de cada PDF desde la subida hasta 'done',
+el desglose por etapa (extract, chunk, encode, db_insert, images) y el pico
+de memoria. Usa el modelo de embeddings real.
+
+    python benchmarks/bench_ingest.py --docs 5 --pages 100 --images-per-page 1 --json ingest.json
+    python benchmarks/bench_ingest.py --docs 20 --pages 20 --workers 4
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import (current_rss_mb, load_app, peak_rss_mb, percentiles, print_cases,  # noqa: E402
+                    stage_totals, start_stub_server, write_results)
+from synthetic_pdf import add_arguments, generate_pdf, pdf_options  # noqa: E402
+
+INGEST_STAGES = ('extract', 'chunk', 'encode', 'db_insert', 'images')
+
+
+def wait_for_jobs(client, jobs, timeout):
+    """Espera a que terminen los trabajos. Devuelve {job_id: segundos desde la subida}."""
+    pending = dict(jobs)
+    durations = {}
+    deadline = time.perf_counter() + timeout
+    while pending:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f'{len(pending)} ingestas sin terminar tras {timeout} s')
+        for job_id, submitted in list(pending.items()):
+            status = client.get(f'/api/ingest-status/{job_id}').get_json()
+            if status['status'] == 'error':
+                raise RuntimeError(f"La ingesta {job_id} falló: {status['error']}")
+            if status['status'] == 'done':
+                durations[job_id] = time.perf_counter() - submitted
+                del pending[job_id]
+        time.sleep(0.05)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la ingesta de PDFs')
+    parser.add_argument('--docs', type=int, default=5, help='PDFs a subir')
+    add_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1, help='Hilos de ingesta (INGEST_WORKERS)')
+    parser.add_argument('--extract-workers', type=int, default=1, help='Procesos de extracción (EXTRACT_WORKERS)')
+    parser.add_argument('--timeout', type=float, default=3600)
+    parser.add_argument('--workdir', help='Directorio de datos (por defecto, uno temporal que se borra al terminar)')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args()
+    # load_app cambia el directorio de trabajo
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_ingest_')
+    env = {
+        'OPENROUTER_API_URL': start_stub_server(),
+        'INGEST_WORKERS': args.workers,
+        'EXTRACT_WORKERS': args.extract_workers,
+        # Todos los PDFs son distintos, pero que no se reconozcan por el nombre
+        'REINGEST_BY_FILENAME': '0',
+    }
+    try:
+        appmod = load_app(workdir, env)
+        client = appmod.app.test_client()
+
+        print(f"Generando {args.docs} PDFs de {args.pages} páginas...")
+        documents = [generate_pdf(seed=args.seed + i, **pdf_options(args)) for i in range(args.docs)]
+
+        print("Cargando el modelo de embeddings...")
+        start = time.perf_counter()
+        appmod.get_embedding_model()
+        model_load_seconds = time.perf_counter() - start
+        rss_before = current_rss_mb()
+
+        print("Subiendo e ingiriendo...")
+        start = time.perf_counter()
+        jobs = {}
+        for i, data in enumerate(documents):
+            response = client.post('/api/upload-pdf', data={'file': (io.BytesIO(data), f'bench_{i}.pdf')},
+                                   content_type='multipart/form-data')
+            if response.status_code != 202:
+                raise RuntimeError(f'Subida rechazada ({response.status_code}): {response.get_json()}')
+            jobs[response.get_json()['jobId']] = time.perf_counter()
+        latencies = wait_for_jobs(client, jobs, args.timeout)
+        wall_seconds = time.perf_counter() - start
+
+        conn = appmod.get_db()
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*) FROM pdf_pages')
+        pages = c.fetchone()[0]
+        c.execute('SELECT COUNT(*) FROM embeddings')
+        chunks = c.fetchone()[0]
+        c.execute('SELECT COUNT(*), COUNT(DISTINCT content_hash) FROM pdf_images')
+        images, distinct_images = c.fetchone()
+        conn.close()
+
+        metrics = {
+            'wall_seconds': wall_seconds,
+            'pages_per_s': pages / wall_seconds,
+            'chunks_per_s': chunks / wall_seconds,
+            'pages': pages,
+            'chunks': chunks,
+            'images': images,
+            'distinct_images': distinct_images,
+            'model_load_seconds': model_load_seconds,
+            'rss_before_mb': rss_before,
+            'peak_rss_mb': peak_rss_mb(),
+            'db_size_mb': os.path.getsize(os.environ['DATABASE_PATH']) / (1024 * 1024),
+        }
+        metrics.update(percentiles([seconds * 1000 for seconds in latencies.values()], prefix='doc_latency'))
+        # Tiempo de cada etapa por página (sumado entre todos los workers)
+        for stage, total in stage_totals(appmod.STAGE_SECONDS).items():
+            if stage in INGEST_STAGES:
+                metrics[f'stage_{stage}_ms_per_page'] = total['seconds'] * 1000 / max(pages, 1)
+
+        cases = [{'name': f'docs={args.docs} pages={args.pages}', 'metrics': metrics}]
+        print_cases(cases, ['pages_per_s', 'chunks_per_s', 'doc_latency_p95_ms', 'peak_rss_mb'])
+        print('\nms por página: ' + ', '.join(
+            f"{stage}={metrics[f'stage_{stage}_ms_per_page']:.2f}"
+            for stage in INGEST_STAGES if f'stage_{stage}_ms_per_page' in metrics
+        ))
+
+        if json_path:
+            config = dict(vars(args), model=appmod.EMBEDDING_MODEL_NAME, pdf_engine=appmod.PDF_ENGINE)
+            write_results(json_path, 'ingest', config, cases)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Recall frente a memoria de la cuantización de embeddings (EMBEDDING_QUANTIZATION).
+
+Para cada modo (none, int8, binary) y cada tamaño de lista corta
+(QUANTIZATION_SHORTLIST) mide la memoria de los vectores, el recall@k
+respecto a la búsqueda exacta en float32 y la latencia de la búsqueda con
+su reordenación. Con ``--ann`` mide además el índice IVF global (scope
+'all'). No arranca la aplicación: usa vector_index y ann_index
+directamente, con embeddings sintéticos agrupados en clústeres o con los de
+una base de datos real (``--db``).
+
+El rescore lee los float32 de memoria, no de SQLite: la latencia medida es
+la del cálculo, sin la consulta a la base de datos que hace la aplicación.
+
+    python benchmarks/bench_quantization.py --vectors 100000 --json quantization.json
+    python benchmarks/bench_quantization.py --db data/database.sqlite --shortlists 50 100 200 --ann
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import percentiles, print_cases, write_results  # noqa: E402
+
+from ann_index import IVFIndex  # noqa: E402
+from quantization import bytes_per_vector  # noqa: E402
+from vector_index import VectorIndex, embedding_from_blob, normalize_rows, top_indices  # noqa: E402
+
+MODES = ('none', 'int8', 'binary')
+
+
+def synthetic_corpus(options):
+    """Vectores y consultas agrupados en clústeres (como los de bench_retrieval)."""
+    rng = np.random.default_rng(options['seed'])
+    centers = rng.standard_normal((options['clusters'], options['dim'])).astype(np.float32)
+
+    def sample(count):
+        return centers[rng.integers(0, len(centers), count)] + \
+            0.5 * rng.standard_normal((count, options['dim'])).astype(np.float32)
+
+    return sample(options['vectors']), sample(options['queries'])
+
+
+def database_corpus(options):
+    """Embeddings de una base de datos; las consultas son chunks al azar con ruido."""
+    conn = sqlite3.connect(options['db'])
+    rows = conn.execute('SELECT embedding FROM embeddings LIMIT ?', (options['vectors'],)).fetchall()
+    conn.close()
+    if not rows:
+        raise SystemExit(f"No hay embeddings en {options['db']}")
+    vectors = np.vstack([embedding_from_blob(value) for (value,) in rows])
+    rng = np.random.default_rng(options['seed'])
+    queries = vectors[rng.integers(0, len(vectors), options['queries'])]
+    queries = queries + 0.3 * queries.std() * rng.standard_normal(queries.shape).astype(np.float32)
+    return vectors, queries
+
+
+def recall(found, expected):
+    return len(set(found) & set(expected)) / len(expected)
+
+
+def exact_neighbours(vectors, queries, k):
+    return [top_indices(vectors @ query, k) for query in normalize_rows(queries)]
+
+
+def fetcher(vectors):
+    """Rescore contra la matriz float32 en memoria (los ids son posiciones)."""
+    return lambda ids: (ids, vectors[ids])
+
+
+def measure(search, queries, exact, k):
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, exact):
+        start = time.perf_counter()
+        results = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(recall([chunk_id for chunk_id, _ in results][:k], list(expected)))
+    metrics = {f'recall_at_{k}': float(np.mean(recalls))}
+    metrics.update(percentiles(latencies))
+    return metrics
+
+
+def flat_cases(vectors, queries, exact, options):
+    """Un PDF con todos los vectores: VectorIndex.search (scope 'pdf')."""
+    ids = list(range(len(vectors)))
+    dim = vectors.shape[1]
+    cases = []
+    for mode in options['modes']:
+        quantization = None if mode == 'none' else mode
+        for shortlist in (options['shortlists'] if quantization else [0]):
+            index = VectorIndex(lambda pdf_id: (ids, vectors), quantization=quantization,
+                                fetcher=fetcher(vectors), shortlist=shortlist)
+            index.search('bench', queries[0], k=options['k'])  # carga
+            metrics = {
+                'bytes_per_vector': bytes_per_vector(quantization, dim),
+                'memory_mb': index.memory_bytes() / (1024 * 1024),
+            }
+            metrics.update(measure(lambda query: index.search('bench', query, k=options['k']),
+                                   queries, exact, options['k']))
+            name = f'flat mode={mode}' + (f' shortlist={shortlist}' if quantization else '')
+            cases.append({'name': name, 'metrics': metrics})
+    return cases
+
+
+def ann_cases(vectors, queries, exact, options):
+    """Índice IVF global (scope 'all'), con el mismo rescore que vector_search."""
+    ids = list(range(len(vectors)))
+    cases = []
+    for mode in options['modes']:
+        quantization = None if mode == 'none' else mode
+        index = IVFIndex(quantization=quantization, nprobe=options['nprobe'])
+        start = time.perf_counter()
+        index.build([('bench', ids, vectors)])
+        build_seconds = time.perf_counter() - start
+        for shortlist in (options['shortlists'] if quantization else [0]):
+            def search(query):
+                matches = index.search(query, k=max(options['k'], shortlist))
+                if not quantization:
+                    return [(int(chunk_id), score) for chunk_id, _, score in matches]
+                candidates = np.array([int(chunk_id) for chunk_id, _, _ in matches], dtype=np.int64)
+                scores = normalize_rows(vectors[candidates]) @ normalize_rows(query)[0]
+                return [(candidates[i], scores[i]) for i in top_indices(scores, options['k'])]
+
+            metrics = {
+                'bytes_per_vector': bytes_per_vector(quantization, vectors.shape[1]),
+                'memory_mb': index.memory_bytes() / (1024 * 1024),
+                'build_seconds': build_seconds,
+            }
+            metrics.update(measure(search, queries, exact, options['k']))
+            name = f'ann mode={mode}' + (f' shortlist={shortlist}' if quantization else '')
+            cases.append({'name': name, 'metrics': metrics})
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall y memoria de la cuantización de embeddings')
+    parser.add_argument('--vectors', type=int, default=50000, help='Vectores del corpus')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=384, help='Dimensión de los vectores sintéticos')
+    parser.add_argument('--clusters', type=int, default=256, help='Clústeres de los vectores sintéticos')
+    parser.add_argument('--db', help='Usar los embeddings de esta base de datos en lugar de sintéticos')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--shortlists', type=int, nargs='+', default=[20, 100, 400],
+                        help='Tamaños de la lista corta que se reordena con float32')
+    parser.add_argument('-k', type=int, default=10, help='Vecinos para el recall@k')
+    parser.add_argument('--ann', action='store_true', help='Medir también el índice IVF global')
+    parser.add_argument('--nprobe', type=int, default=8, help='ANN_NPROBE')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args()
+    options = vars(args)
+
+    vectors, queries = database_corpus(options) if args.db else synthetic_corpus(options)
+    print(f"{len(vectors)} vectores de dimensión {vectors.shape[1]}, {len(queries)} consultas")
+    exact = exact_neighbours(normalize_rows(vectors), queries, args.k)
+
+    cases = flat_cases(vectors, queries, exact, options)
+    if args.ann:
+        cases.extend(ann_cases(vectors, queries, exact, options))
+
+    print_cases(cases, ['bytes_per_vector', 'memory_mb', f'recall_at_{args.k}', 'latency_p50_ms', 'latency_p95_ms'])
+    if args.json:
+        write_results(os.path.abspath(args.json), 'quantization', options, cases)
+
+
+if __name__ == '__main__':
+    main()
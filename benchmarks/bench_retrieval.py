@@ -0,0 +1,239 @@
+"""Latencia de /api/chat frente al tamaño de la base de datos (10k a 1M chunks).
+
+Para cada tamaño construye, en un proceso nuevo, una base de datos sintética
+(chunks con texto de un vocabulario artificial y embeddings agrupados en
+clústeres, insertados directamente sin pasar por el modelo) y lanza
+preguntas a ``/api/chat`` con OpenRouter sustituido por el servidor stub.
+Mide p50/p95/p99 de la petición completa y de cada etapa (a partir de la
+cabecera Server-Timing), el rendimiento con ``--concurrency`` hilos, el
+tiempo de la primera consulta (carga del índice) y el pico de memoria.
+
+La caché de respuestas se desactiva y todas las preguntas son distintas,
+así que cada petición codifica su pregunta con el modelo real
+(etapa ``embed_query``).
+
+    python benchmarks/bench_retrieval.py --chunks 10000 100000 --json retrieval.json
+    python benchmarks/bench_retrieval.py --chunks 1000000 --pdfs 100 --scopes all --queries 500
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import (current_rss_mb, load_app, parse_server_timing, peak_rss_mb, percentiles,  # noqa: E402
+                    print_cases, start_stub_server, write_results)
+
+CHAT_STAGES = ('embed_query', 'retrieve', 'vector_search', 'bm25', 'context', 'history', 'llm')
+INSERT_BATCH = 10000
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'la', 'me', 'ni', 'po', 'ru', 'sa', 'te', 'vi', 'zo', 'tra', 'pre', 'cli', 'mon']
+
+
+def vocabulary(size, seed):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def embedding_dimension(model):
+    if hasattr(model, 'get_sentence_embedding_dimension'):
+        return model.get_sentence_embedding_dimension()
+    return len(model.encode('dimensión'))
+
+
+def populate(appmod, options, total_chunks, dim):
+    """Inserta PDFs, páginas y chunks sintéticos. Devuelve los ids de los PDFs."""
+    from vector_index import embedding_to_blob
+
+    rng = random.Random(options['seed'])
+    np_rng = np.random.default_rng(options['seed'])
+    words = vocabulary(options['vocabulary'], options['seed'])
+    # Clústeres: los vecinos de una consulta se concentran en unas pocas listas IVF
+    centers = np_rng.standard_normal((options['clusters'], dim)).astype(np.float32)
+
+    pdf_ids = [f'bench-pdf-{i}' for i in range(options['pdfs'])]
+    chunks_per_pdf = -(-total_chunks // len(pdf_ids))
+    chunks_per_page = options['chunks_per_page']
+
+    conn = appmod.get_db()
+    c = conn.cursor()
+    inserted = 0
+    for pdf_number, pdf_id in enumerate(pdf_ids):
+        count = min(chunks_per_pdf, total_chunks - inserted)
+        pages = -(-count // chunks_per_page)
+        c.execute('''
+            INSERT INTO pdf_files (id, filename, file_path, file_size, total_pages, status)
+            VALUES (?, ?, ?, 0, ?, 'ready')
+        ''', (pdf_id, f'{pdf_id}.pdf', f'{pdf_id}.pdf', pages))
+        c.executemany('INSERT INTO pdf_pages (id, pdf_id, page_number, text_content) VALUES (?, ?, ?, ?)',
+                      [(f'{pdf_id}-p{page}', pdf_id, page + 1, '') for page in range(pages)])
+
+        for start in range(0, count, INSERT_BATCH):
+            size = min(INSERT_BATCH, count - start)
+            vectors = centers[np_rng.integers(0, len(centers), size)] + \
+                0.5 * np_rng.standard_normal((size, dim)).astype(np.float32)
+            rows = []
+            for i, vector in zip(range(start, start + size), vectors):
+                text = ' '.join(rng.choices(words, k=options['words_per_chunk']))
+                rows.append((f'{pdf_id}-c{i}', pdf_id, f'{pdf_id}-p{i // chunks_per_page}', text,
+                             embedding_to_blob(vector), i % chunks_per_page, 0, len(text)))
+            c.executemany('''
+                INSERT INTO embeddings (id, pdf_id, page_id, chunk_text, embedding, chunk_index, char_start, char_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+            inserted += size
+            if inserted % 100000 < size:
+                print(f"  {inserted}/{total_chunks} chunks insertados")
+        if inserted >= total_chunks:
+            pdf_ids = pdf_ids[:pdf_number + 1]
+            break
+    conn.close()
+    return pdf_ids
+
+
+def run_queries(appmod, queries, concurrency):
+    """Lanza las peticiones y devuelve ``(latencias_ms, tiempos_por_etapa, segundos)``."""
+    def worker(batch):
+        client = appmod.app.test_client()
+        results = []
+        for payload in batch:
+            start = time.perf_counter()
+            response = client.post('/api/chat', json=payload)
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f'/api/chat respondió {response.status_code}: {response.get_json()}')
+            results.append((elapsed, parse_server_timing(response.headers.get('Server-Timing'))))
+        return results
+
+    batches = [queries[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = [result for batch in executor.map(worker, batches) for result in batch]
+    return [latency for latency, _ in results], [timings for _, timings in results], time.perf_counter() - start
+
+
+def run_case(options, total_chunks):
+    """Un tamaño de base de datos, en su propio proceso. Devuelve los casos medidos."""
+    workdir = tempfile.mkdtemp(prefix=f'bench_retrieval_{total_chunks}_', dir=options['workdir'])
+    env = {
+        'OPENROUTER_API_URL': start_stub_server(latency=options['llm_latency']),
+        'ANSWER_CACHE_ENABLED': '0',
+        'HYBRID_SEARCH_ENABLED': '1' if options['hybrid'] else '0',
+        'ANN_NPROBE': options['nprobe'],
+        'INGEST_WORKERS': 0,
+    }
+    try:
+        appmod = load_app(workdir, env)
+        dim = embedding_dimension(appmod.get_embedding_model())
+
+        print(f"\n[{total_chunks} chunks] Construyendo la base de datos (dimensión {dim})...")
+        start = time.perf_counter()
+        pdf_ids = populate(appmod, options, total_chunks, dim)
+        build_seconds = time.perf_counter() - start
+        db_size_mb = os.path.getsize(os.environ['DATABASE_PATH']) / (1024 * 1024)
+        rss_base = current_rss_mb()
+
+        rng = random.Random(options['seed'] + 1)
+        words = vocabulary(options['vocabulary'], options['seed'])
+        client = appmod.app.test_client()
+        cases = []
+        for scope in options['scopes']:
+            # Primera consulta: carga las matrices del PDF o construye el índice ANN
+            first = {'message': 'consulta inicial'}
+            if scope == 'all':
+                first['scope'] = 'all'
+                targets = [first]
+            else:
+                targets = [dict(first, pdfId=pdf_id) for pdf_id in pdf_ids]
+            start = time.perf_counter()
+            for payload in targets:
+                client.post('/api/chat', json=payload)
+            cold_ms = (time.perf_counter() - start) * 1000 / len(targets)
+
+            queries = []
+            for i in range(options['queries']):
+                payload = {'message': f"{' '.join(rng.choices(words, k=6))} {i}"}
+                if scope == 'all':
+                    payload['scope'] = 'all'
+                else:
+                    payload['pdfId'] = rng.choice(pdf_ids)
+                queries.append(payload)
+
+            print(f"[{total_chunks} chunks] {len(queries)} consultas (scope={scope}, "
+                  f"concurrencia {options['concurrency']})...")
+            latencies, timings, seconds = run_queries(appmod, queries, options['concurrency'])
+
+            metrics = {
+                'requests_per_s': len(queries) / seconds,
+                'cold_query_ms': cold_ms,
+            }
+            metrics.update(percentiles(latencies))
+            for stage in CHAT_STAGES:
+                values = [t[stage] for t in timings if stage in t]
+                if values:
+                    metrics[f'stage_{stage}_p50_ms'] = float(np.percentile(values, 50))
+                    metrics[f'stage_{stage}_p95_ms'] = float(np.percentile(values, 95))
+            metrics.update({
+                'build_seconds': build_seconds,
+                'db_size_mb': db_size_mb,
+                'rss_after_build_mb': rss_base,
+                'peak_rss_mb': peak_rss_mb(),
+            })
+            cases.append({'name': f'chunks={total_chunks} scope={scope}', 'metrics': metrics})
+        return cases
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de latencia de /api/chat según el número de chunks')
+    parser.add_argument('--chunks', type=int, nargs='+', default=[10000, 100000], help='Tamaños de base de datos')
+    parser.add_argument('--pdfs', type=int, default=10, help='PDFs entre los que se reparten los chunks')
+    parser.add_argument('--chunks-per-page', type=int, default=4)
+    parser.add_argument('--words-per-chunk', type=int, default=80)
+    parser.add_argument('--vocabulary', type=int, default=5000, help='Palabras distintas del texto sintético')
+    parser.add_argument('--clusters', type=int, default=256, help='Clústeres de los embeddings sintéticos')
+    parser.add_argument('--scopes', nargs='+', choices=['pdf', 'all'], default=['pdf', 'all'],
+                        help="'pdf': pregunta sobre un PDF; 'all': todos los documentos (índice ANN)")
+    parser.add_argument('--queries', type=int, default=200, help='Consultas medidas por tamaño y scope')
+    parser.add_argument('--concurrency', type=int, default=1, help='Hilos lanzando consultas')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Segundos que tarda el stub en responder')
+    parser.add_argument('--nprobe', type=int, default=8, help='ANN_NPROBE')
+    parser.add_argument('--no-hybrid', dest='hybrid', action='store_false', help='Solo vectores (sin BM25)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='Directorio para las bases de datos temporales (por defecto, el del sistema)')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args()
+
+    options = vars(args)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        options['workdir'] = os.path.abspath(args.workdir)
+
+    cases = []
+    # Un proceso por tamaño: app.py se configura al importarse y así el pico
+    # de memoria de cada caso no arrastra el de los anteriores
+    context = multiprocessing.get_context('spawn')
+    for total_chunks in sorted(args.chunks):
+        with context.Pool(1) as pool:
+            cases.extend(pool.apply(run_case, (options, total_chunks)))
+
+    print_cases(cases, ['latency_p50_ms', 'latency_p95_ms', 'latency_p99_ms', 'stage_retrieve_p95_ms',
+                        'requests_per_s', 'peak_rss_mb'])
+    if args.json:
+        write_results(os.path.abspath(args.json), 'retrieval', options, cases)
+
+
+if __name__ == '__main__':
+    main()
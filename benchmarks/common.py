@@ -0,0 +1,142 @@
+"""Utilidades compartidas por los benchmarks de ingesta y recuperación.
+
+Cada benchmark arranca la aplicación en un directorio temporal (base de
+datos, subidas e índices propios) con OpenRouter sustituido por el servidor
+stub de llm_client, y guarda sus resultados en JSON con el formato que lee
+``compare.py``::
+
+    {"benchmark": ..., "git_commit": ..., "config": {...},
+     "cases": [{"name": ..., "metrics": {"latency_p95_ms": ..., ...}}]}
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def start_stub_server(latency=0.0, token_delay=0.0, tokens=40):
+    """Arranca el servidor stub de chat completions en un puerto libre. Devuelve su URL."""
+    from llm_client import run_stub_server
+
+    server = run_stub_server('127.0.0.1', 0, latency, token_delay, tokens)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return f'http://{host}:{port}/v1'
+
+
+def load_app(workdir, env=None):
+    """Importa app.py con sus datos en ``workdir``.
+
+    app.py lee la configuración al importarse, así que solo se puede cargar
+    una vez por proceso: cada caso que necesite otra base de datos se ejecuta
+    en un proceso nuevo.
+    """
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(workdir, 'data', 'database.sqlite'),
+        'ANN_INDEX_PATH': os.path.join(workdir, 'data', 'ann_index.npz'),
+    })
+    os.environ.update({key: str(value) for key, value in (env or {}).items()})
+    import app as appmod
+    return appmod
+
+
+def percentiles(values, prefix='latency', unit='ms'):
+    """p50/p95/p99, media y máximo de una lista de valores."""
+    if not len(values):
+        return {}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        f'{prefix}_p50_{unit}': float(np.percentile(values, 50)),
+        f'{prefix}_p95_{unit}': float(np.percentile(values, 95)),
+        f'{prefix}_p99_{unit}': float(np.percentile(values, 99)),
+        f'{prefix}_mean_{unit}': float(values.mean()),
+        f'{prefix}_max_{unit}': float(values.max()),
+    }
+
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso desde que arrancó."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB; macOS, en bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+def parse_server_timing(header):
+    """``"retrieve;dur=1.2, llm;dur=30.0"`` -> ``{'retrieve': 1.2, 'llm': 30.0}`` (ms)."""
+    timings = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if name and key == 'dur':
+                timings[name] = float(value)
+    return timings
+
+
+def stage_totals(histogram):
+    """Segundos acumulados y observaciones por etapa de un histograma de metrics.py."""
+    totals = {}
+    for suffix, _, key, value in histogram.samples():
+        if suffix in ('_sum', '_count'):
+            totals.setdefault(key[0], {})['seconds' if suffix == '_sum' else 'count'] = value
+    return totals
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, benchmark, config, cases):
+    results = {
+        'benchmark': benchmark,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': config,
+        'cases': cases,
+    }
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {path}")
+
+
+def print_cases(cases, columns):
+    """Tabla con una fila por caso y las métricas de ``columns``."""
+    width = max([len(case['name']) for case in cases] + [4]) + 2
+    print(f"\n{'caso':<{width}}" + ''.join(f'{column:>{max(len(column), 10) + 2}}' for column in columns))
+    for case in cases:
+        row = f"{case['name']:<{width}}"
+        for column in columns:
+            value = case['metrics'].get(column)
+            cell = '-' if value is None else f'{value:.2f}'
+            row += f'{cell:>{max(len(column), 10) + 2}}'
+        print(row)
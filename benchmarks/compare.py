@@ -0,0 +1,88 @@
+"""Compara dos resultados JSON de los benchmarks y señala las regresiones.
+
+Empareja los casos por nombre y, para cada métrica común, calcula la
+variación del candidato respecto a la referencia. Las métricas ``*_per_s``
+son mejores cuanto más altas; el resto (latencias, memoria, tamaños),
+cuanto más bajas. Una métrica empeora si la variación supera
+``--threshold`` y la diferencia absoluta supera ``--min-delta`` (para no
+señalar ruido en etapas de décimas de milisegundo). Sale con código 1 si
+hay regresiones, de modo que se puede usar en CI.
+
+    python benchmarks/compare.py base.json candidato.json
+    python benchmarks/compare.py base.json candidato.json --threshold 0.05 --metrics latency_p95_ms pages_per_s
+"""
+import argparse
+import json
+import sys
+
+# Métricas descriptivas del caso, no de rendimiento
+IGNORED_METRICS = {'pages', 'chunks', 'images', 'distinct_images', 'bytes_per_vector'}
+
+
+def higher_is_better(metric):
+    return metric.endswith('_per_s') or metric.startswith('recall_')
+
+
+def compare(baseline, candidate, threshold, min_delta, metrics=None):
+    """Devuelve ``[(caso, métrica, referencia, candidato, variación, regresión), ...]``."""
+    baseline_cases = {case['name']: case['metrics'] for case in baseline['cases']}
+    rows = []
+    for case in candidate['cases']:
+        reference = baseline_cases.get(case['name'])
+        if reference is None:
+            continue
+        for metric, value in case['metrics'].items():
+            old = reference.get(metric)
+            if old is None or value is None or metric in IGNORED_METRICS:
+                continue
+            if metrics and metric not in metrics:
+                continue
+            change = (value - old) / old if old else 0.0
+            worse = -change if higher_is_better(metric) else change
+            regression = worse > threshold and abs(value - old) > min_delta
+            rows.append((case['name'], metric, old, value, change, regression))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara dos resultados de benchmarks')
+    parser.add_argument('baseline', help='JSON de referencia')
+    parser.add_argument('candidate', help='JSON a evaluar')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Empeoramiento relativo tolerado (0.10 = 10%%)')
+    parser.add_argument('--min-delta', type=float, default=0.5, help='Diferencia absoluta mínima para contar')
+    parser.add_argument('--metrics', nargs='*', help='Comparar solo estas métricas')
+    parser.add_argument('--all', action='store_true', help='Mostrar también las métricas sin regresión')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline.get('benchmark') != candidate.get('benchmark'):
+        print(f"Error: benchmarks distintos ({baseline.get('benchmark')} y {candidate.get('benchmark')})")
+        sys.exit(2)
+
+    print(f"Referencia: {baseline.get('git_commit')} ({baseline.get('timestamp')})")
+    print(f"Candidato:  {candidate.get('git_commit')} ({candidate.get('timestamp')})")
+
+    rows = compare(baseline, candidate, args.threshold, args.min_delta, args.metrics)
+    if not rows:
+        print("No hay casos ni métricas en común.")
+        sys.exit(2)
+
+    regressions = [row for row in rows if row[5]]
+    shown = rows if args.all else regressions
+    if shown:
+        width = max(len(row[0]) for row in shown) + 2
+        metric_width = max(len(row[1]) for row in shown) + 2
+        print(f"\n{'caso':<{width}}{'métrica':<{metric_width}}{'referencia':>12}{'candidato':>12}{'cambio':>10}")
+        for name, metric, old, value, change, regression in shown:
+            flag = '  REGRESIÓN' if regression else ''
+            print(f"{name:<{width}}{metric:<{metric_width}}{old:>12.2f}{value:>12.2f}{change * 100:>9.1f}%{flag}")
+
+    print(f"\n{len(rows)} métricas comparadas, {len(regressions)} regresiones (umbral {args.threshold * 100:.0f}%)")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
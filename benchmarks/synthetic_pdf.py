@@ -0,0 +1,123 @@
+"""Generador de PDFs sintéticos para los benchmarks.
+
+Cada página lleva texto de relleno con datos únicos ("La pieza XR-1234 tiene
+un par de apriete de 35 Nm") y, opcionalmente, imágenes. Una parte de las
+imágenes puede repetirse en todas las páginas (logos, cabeceras) para medir
+también la deduplicación. Con la misma semilla el PDF es idéntico.
+
+    python benchmarks/synthetic_pdf.py manual.pdf --pages 200 --words-per-page 400 --images-per-page 2
+"""
+import argparse
+import random
+
+import numpy as np
+
+FILLER = [
+    'El equipo debe revisarse antes de cada turno',
+    'Consulte la sección de seguridad para más detalles',
+    'Las tolerancias indicadas se aplican a temperatura ambiente',
+    'El mantenimiento preventivo reduce las paradas no planificadas',
+    'Utilice siempre el equipo de protección individual adecuado',
+    'Los valores pueden variar según la versión del fabricante',
+    'Registre cualquier incidencia en el libro de mantenimiento',
+    'La garantía no cubre los daños por uso indebido',
+]
+
+# A4 en puntos
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 36
+
+
+def page_text(rng, words, facts):
+    """Texto de una página con unas ``words`` palabras y ``facts`` datos únicos."""
+    sentences = []
+    count = 0
+    while count < words:
+        sentence = rng.choice(FILLER) + '.'
+        sentences.append(sentence)
+        count += len(sentence.split())
+    for _ in range(facts):
+        fact = f'La pieza XR-{rng.randint(1000, 9999)} tiene un par de apriete de {rng.randint(5, 120)} Nm.'
+        sentences.insert(rng.randint(0, len(sentences)), fact)
+    return ' '.join(sentences)
+
+
+def block_image(np_rng, size, blocks=8):
+    """Imagen RGB de bloques de colores: única, pero se comprime como una figura real."""
+    import fitz
+
+    cell = max(1, size // blocks)
+    colors = np_rng.integers(0, 256, size=(blocks, blocks, 3), dtype=np.uint8)
+    pixels = np.ascontiguousarray(colors.repeat(cell, axis=0).repeat(cell, axis=1))
+    side = blocks * cell
+    return fitz.Pixmap(fitz.csRGB, side, side, pixels.tobytes(), 0)
+
+
+def generate_pdf(pages=50, words_per_page=300, facts_per_page=4, images_per_page=0, image_size=256,
+                 shared_images=0, font_size=7, seed=0):
+    """Devuelve los bytes de un PDF sintético."""
+    import fitz
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    shared = [block_image(np_rng, image_size) for _ in range(shared_images)]
+
+    document = fitz.open()
+    try:
+        for _ in range(pages):
+            page = document.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            images = shared + [block_image(np_rng, image_size) for _ in range(images_per_page)]
+
+            # Las imágenes ocupan una franja inferior; el texto, el resto
+            image_band = 0
+            if images:
+                side = min(120, (PAGE_WIDTH - 2 * MARGIN) / len(images))
+                image_band = side + MARGIN
+                for i, pixmap in enumerate(images):
+                    x = MARGIN + i * side
+                    rect = fitz.Rect(x, PAGE_HEIGHT - MARGIN - side, x + side, PAGE_HEIGHT - MARGIN)
+                    page.insert_image(rect, pixmap=pixmap)
+
+            text_rect = fitz.Rect(MARGIN, MARGIN, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN - image_band)
+            page.insert_textbox(text_rect, page_text(rng, words_per_page, facts_per_page), fontsize=font_size)
+        return document.tobytes(garbage=3, deflate=True)
+    finally:
+        document.close()
+
+
+def add_arguments(parser):
+    """Opciones de densidad comunes a los benchmarks que generan PDFs."""
+    parser.add_argument('--pages', type=int, default=50, help='Páginas por PDF')
+    parser.add_argument('--words-per-page', type=int, default=300)
+    parser.add_argument('--facts-per-page', type=int, default=4)
+    parser.add_argument('--images-per-page', type=int, default=0, help='Imágenes únicas por página')
+    parser.add_argument('--shared-images', type=int, default=0, help='Imágenes repetidas en todas las páginas')
+    parser.add_argument('--image-size', type=int, default=256, help='Lado de las imágenes en píxeles')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def pdf_options(args):
+    return {
+        'pages': args.pages,
+        'words_per_page': args.words_per_page,
+        'facts_per_page': args.facts_per_page,
+        'images_per_page': args.images_per_page,
+        'shared_images': args.shared_images,
+        'image_size': args.image_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera un PDF sintético para pruebas de rendimiento')
+    parser.add_argument('output', help='Ruta del PDF a generar')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    data = generate_pdf(seed=args.seed, **pdf_options(args))
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    print(f"PDF generado: {args.output} ({args.pages} páginas, {len(data) / (1024 * 1024):.2f} MB)")
+
+
+if __name__ == '__main__':
+    main()
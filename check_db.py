@@ -1,6 +1,8 @@
 import sqlite3
 import os
 
+from vector_index import embedding_from_blob
+
 def check_database():
     db_path = 'data/database.sqlite'
     
@@ -57,6 +59,22 @@ def check_database():
                 emb_count = c.fetchone()['count']
                 print(f"Embeddings generados: {emb_count}")
                 
+                # Formato de almacenamiento de los embeddings
+                if emb_count > 0:
+                    c.execute('''
+                        SELECT typeof(embedding) as kind, COUNT(*) as count
+                        FROM embeddings WHERE pdf_id = ?
+                        GROUP BY kind
+                    ''', (pdf['id'],))
+                    formats = {row['kind']: row['count'] for row in c.fetchall()}
+                    print(f"  - Binarios (float32): {formats.get('blob', 0)}")
+                    if formats.get('text'):
+                        print(f"  - JSON (pendientes de migrar): {formats['text']} -> ejecuta migrate_embeddings.py")
+                    
+                    c.execute("SELECT embedding FROM embeddings WHERE pdf_id = ? LIMIT 1", (pdf['id'],))
+                    sample = embedding_from_blob(c.fetchone()['embedding'])
+                    print(f"  - Dimensión: {sample.shape[0]}")
+                
                 # Verificar imágenes
                 c.execute("SELECT COUNT(*) as count FROM pdf_images WHERE pdf_id = ?", (pdf['id'],))
                 img_count = c.fetchone()['count']
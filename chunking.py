@@ -0,0 +1,155 @@
+"""Troceado del texto de las páginas en chunks para los embeddings.
+
+El chunker por tokens agrupa frases completas hasta llenar la longitud
+máxima de secuencia del modelo (contada con su propio tokenizer), de modo
+que ningún chunk se trunca al codificarlo. Cada chunk conserva sus
+posiciones ``[char_start, char_end)`` dentro del texto de la página para
+poder citarlo.
+"""
+import hashlib
+import json
+import re
+from collections import namedtuple
+
+Chunk = namedtuple('Chunk', ['text', 'char_start', 'char_end'])
+
+# Límites por modelo: max_tokens se recorta además a model.max_seq_length
+MODEL_CHUNKING = {
+    'all-MiniLM-L6-v2': {'max_tokens': 256, 'overlap_tokens': 32},
+    'all-MiniLM-L12-v2': {'max_tokens': 256, 'overlap_tokens': 32},
+    'all-mpnet-base-v2': {'max_tokens': 384, 'overlap_tokens': 48},
+    'paraphrase-multilingual-MiniLM-L12-v2': {'max_tokens': 128, 'overlap_tokens': 16},
+}
+DEFAULT_CHUNKING = {'max_tokens': 256, 'overlap_tokens': 32}
+
+# [CLS] y [SEP] que el modelo añade a cada secuencia
+SPECIAL_TOKENS = 2
+
+# Fin de frase: puntuación seguida de espacio, o un salto de línea doble
+SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+|\n\s*\n')
+WORD = re.compile(r'\S+')
+
+
+def chunk_words(text, chunk_size=500, overlap=50):
+    """Chunker clásico: ventanas de ``chunk_size`` palabras solapadas."""
+    spans = [match.span() for match in WORD.finditer(text)]
+    chunks = []
+    for i in range(0, len(spans), chunk_size - overlap):
+        window = spans[i:i + chunk_size]
+        if window:
+            chunks.append(Chunk(' '.join(text[s:e] for s, e in window), window[0][0], window[-1][1]))
+    return chunks
+
+
+def split_sentences(text):
+    """Devuelve las posiciones ``(inicio, fin)`` de cada frase, sin espacios en los bordes."""
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return [(s, e) for s, e in spans if text[s:e].strip()]
+
+
+class TokenChunker:
+    """Agrupa frases en chunks de como mucho ``max_tokens`` tokens del modelo.
+
+    Entre chunks consecutivos se repiten las últimas frases hasta sumar
+    ``overlap_tokens``. Una frase más larga que el límite se corta por
+    palabras.
+    """
+
+    def __init__(self, tokenizer, max_tokens=256, overlap_tokens=32):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.budget = max(1, max_tokens - SPECIAL_TOKENS)
+
+    @property
+    def signature(self):
+        """Identifica la configuración; cambia si cambian los límites."""
+        config = {'chunker': 'tokens', 'max_tokens': self.max_tokens, 'overlap_tokens': self.overlap_tokens}
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+    def count_tokens(self, texts):
+        if not texts:
+            return []
+        encoded = self.tokenizer(list(texts), add_special_tokens=False)['input_ids']
+        return [len(ids) for ids in encoded]
+
+    def _pieces(self, text):
+        """Frases (o trozos de frase) con su número de tokens."""
+        sentences = split_sentences(text)
+        counts = self.count_tokens([text[s:e] for s, e in sentences])
+        pieces = []
+        for (start, end), count in zip(sentences, counts):
+            if count <= self.budget:
+                pieces.append((start, end, count))
+                continue
+            # Frase demasiado larga: repartir sus palabras
+            words = [(start + s, start + e) for s, e in (m.span() for m in WORD.finditer(text[start:end]))]
+            word_counts = self.count_tokens([text[s:e] for s, e in words])
+            piece_start, piece_end, piece_count = None, None, 0
+            for (s, e), n in zip(words, word_counts):
+                if piece_start is not None and piece_count + n > self.budget:
+                    pieces.append((piece_start, piece_end, piece_count))
+                    piece_start, piece_count = None, 0
+                if piece_start is None:
+                    piece_start = s
+                piece_end = e
+                piece_count += n
+            if piece_start is not None:
+                pieces.append((piece_start, piece_end, piece_count))
+        return pieces
+
+    def chunk(self, text):
+        pieces = self._pieces(text)
+        chunks = []
+        current = []
+        current_tokens = 0
+        for piece in pieces:
+            if current and current_tokens + piece[2] > self.budget:
+                chunks.append(current)
+                # Solapamiento: arrastrar las últimas frases del chunk anterior
+                carried = []
+                carried_tokens = 0
+                for previous in reversed(current):
+                    if carried_tokens + previous[2] > self.overlap_tokens or carried_tokens + previous[2] + piece[2] > self.budget:
+                        break
+                    carried.insert(0, previous)
+                    carried_tokens += previous[2]
+                current, current_tokens = carried, carried_tokens
+            current.append(piece)
+            current_tokens += piece[2]
+        if current:
+            chunks.append(current)
+
+        return [Chunk(text[group[0][0]:group[-1][1]], group[0][0], group[-1][1]) for group in chunks]
+
+
+class WordChunker:
+    """Adaptador del chunker clásico por palabras (CHUNKING_STRATEGY=words)."""
+
+    def __init__(self, chunk_size=500, overlap=50):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    @property
+    def signature(self):
+        return f'words-{self.chunk_size}-{self.overlap}'
+
+    def chunk(self, text):
+        return chunk_words(text, self.chunk_size, self.overlap)
+
+
+def chunker_for_model(model, model_name, max_tokens=None, overlap_tokens=None):
+    """Construye el TokenChunker adecuado para un SentenceTransformer."""
+    config = MODEL_CHUNKING.get(model_name, DEFAULT_CHUNKING)
+    max_tokens = max_tokens or config['max_tokens']
+    model_limit = getattr(model, 'max_seq_length', None)
+    if model_limit:
+        max_tokens = min(max_tokens, model_limit)
+    if overlap_tokens is None:
+        overlap_tokens = config['overlap_tokens']
+    return TokenChunker(model.tokenizer, max_tokens, overlap_tokens)
@@ -0,0 +1,99 @@
+import os
+import queue
+import sqlite3
+import threading
+
+# PRAGMAs aplicados a cada conexión. WAL permite que los lectores (/api/chat,
+# /api/history) no se bloqueen mientras una ingesta escribe.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'cache_size': -int(os.getenv('SQLITE_CACHE_KB', 20000)),  # negativo = KiB
+    'mmap_size': int(os.getenv('SQLITE_MMAP_BYTES', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+    # Aplica las restricciones FOREIGN KEY (y los ON DELETE CASCADE)
+    'foreign_keys': 'ON',
+}
+
+
+def configure_connection(conn, pragmas=None):
+    """Aplica los PRAGMAs de rendimiento y concurrencia a una conexión."""
+    for name, value in (pragmas or DEFAULT_PRAGMAS).items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+class PooledConnection:
+    """Conexión prestada por el pool; ``close()`` la devuelve al pool."""
+
+    def __init__(self, conn, pool):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.release(conn)
+
+
+class ConnectionPool:
+    """Pool de conexiones SQLite por proceso.
+
+    Cada proceso de gunicorn tiene su propio pool (se reinicia tras un
+    fork). Las conexiones se prestan con ``connect()`` y vuelven al pool al
+    cerrarlas; como mucho se conservan ``max_idle`` conexiones ociosas.
+    """
+
+    def __init__(self, path, max_idle=8, pragmas=None):
+        self.path = path
+        self.max_idle = max_idle
+        self.pragmas = pragmas or DEFAULT_PRAGMAS
+        self._lock = threading.Lock()
+        self._pid = None
+        self._idle = None
+
+    def _idle_queue(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Las conexiones heredadas de un fork no se pueden reutilizar
+                self._pid = os.getpid()
+                self._idle = queue.LifoQueue()
+            return self._idle
+
+    def _new_connection(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.pragmas.get('busy_timeout', 5000) / 1000,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        return configure_connection(conn, self.pragmas)
+
+    def connect(self):
+        try:
+            conn = self._idle_queue().get_nowait()
+        except queue.Empty:
+            conn = self._new_connection()
+        return PooledConnection(conn, self)
+
+    def release(self, conn):
+        try:
+            # No devolver al pool una transacción a medias
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+
+        idle = self._idle_queue()
+        if idle.qsize() >= self.max_idle:
+            conn.close()
+        else:
+            idle.put(conn)
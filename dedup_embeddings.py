@@ -0,0 +1,72 @@
+import sqlite3
+import os
+import sys
+
+from text_search import has_fts, rebuild_fts
+
+def dedup_embeddings(db_path='data/database.sqlite', dry_run=False):
+    """Elimina los embeddings duplicados por (pdf_id, page_id, chunk_index).
+
+    Conserva la primera fila insertada de cada chunk y después crea el índice
+    único que impide que vuelvan a aparecer duplicados.
+    """
+    if not os.path.exists(db_path):
+        print(f"Error: No se encontró la base de datos en {os.path.abspath(db_path)}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    c.execute('''
+        SELECT pdf_id, SUM(copies - 1) as duplicates
+        FROM (
+            SELECT pdf_id, COUNT(*) as copies
+            FROM embeddings
+            GROUP BY pdf_id, page_id, chunk_index
+            HAVING copies > 1
+        )
+        GROUP BY pdf_id
+    ''')
+    per_pdf = c.fetchall()
+    total = sum(count for _, count in per_pdf)
+
+    if total == 0:
+        print("No se encontraron embeddings duplicados.")
+    else:
+        for pdf_id, count in per_pdf:
+            print(f"- PDF {pdf_id}: {count} embeddings duplicados")
+
+        if dry_run:
+            print(f"\n{total} filas se eliminarían (modo de prueba, no se modificó nada).")
+            conn.close()
+            return
+
+        c.execute('''
+            DELETE FROM embeddings
+            WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM embeddings
+                GROUP BY pdf_id, page_id, chunk_index
+            )
+        ''')
+        print(f"\nEliminados {c.rowcount} embeddings duplicados.")
+
+    c.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_embeddings_chunk
+        ON embeddings(pdf_id, page_id, chunk_index)
+    ''')
+    conn.commit()
+
+    if total:
+        print("Compactando la base de datos (VACUUM)...")
+        conn.execute('VACUUM')
+        # VACUUM puede renumerar los rowid a los que apunta el índice FTS
+        if has_fts(c):
+            rebuild_fts(c)
+            conn.commit()
+    conn.close()
+    print("Base de datos reparada.")
+
+if __name__ == '__main__':
+    print("=== Eliminación de embeddings duplicados ===")
+    args = [arg for arg in sys.argv[1:] if arg != '--dry-run']
+    dedup_embeddings(args[0] if args else 'data/database.sqlite', dry_run='--dry-run' in sys.argv)
@@ -0,0 +1,18 @@
+import os
+
+# Cargar la aplicación (y el modelo de embeddings) una sola vez en el proceso
+# maestro; los workers lo heredan al hacer fork y comparten sus páginas de
+# memoria en lugar de cargar cada uno su propia copia.
+preload_app = True
+os.environ.setdefault('PRELOAD_EMBEDDING_MODEL', '1')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+
+
+def post_fork(server, worker):
+    # Los hilos no sobreviven al fork: arrancar la ingesta y la preparación
+    # del modelo en cada worker
+    from app import app, start_background_tasks
+
+    start_background_tasks(app)
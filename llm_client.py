@@ -0,0 +1,234 @@
+"""Cliente HTTP compartido para las llamadas a OpenRouter.
+
+Mantiene un pool de conexiones keep-alive por proceso, aplica timeouts
+acotados, reintenta con backoff exponencial y jitter ante 429/5xx y limita
+el número de llamadas simultáneas.
+
+También incluye un servidor stub compatible con la API de chat completions
+para pruebas de carga sin conexión:
+
+    python llm_client.py --stub --port 8765
+    OPENROUTER_API_URL=http://127.0.0.1:8765/v1 gunicorn --config gunicorn.conf.py app:app
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMBusyError(requests.exceptions.RequestException):
+    """No hubo un hueco libre en el limitador de concurrencia a tiempo."""
+
+
+def completions_url(url):
+    """Acepta tanto la URL base (``.../api/v1``) como el endpoint completo."""
+    url = url.rstrip('/')
+    if not url.endswith('/chat/completions'):
+        url += '/chat/completions'
+    return url
+
+
+def iter_sse_tokens(response):
+    """Recorre un stream SSE de chat completions y devuelve los fragmentos de texto."""
+    # SSE siempre es UTF-8, aunque la cabecera no indique el charset
+    response.encoding = 'utf-8'
+    for line in response.iter_lines(decode_unicode=True):
+        # Las líneas vacías separan eventos; las que empiezan por ':' son comentarios
+        if not line or not line.startswith('data:'):
+            continue
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            break
+        try:
+            chunk = json.loads(payload)
+        except ValueError:
+            continue
+        if chunk.get('error'):
+            raise RuntimeError(chunk['error'].get('message', str(chunk['error'])))
+        choices = chunk.get('choices') or []
+        if choices:
+            token = (choices[0].get('delta') or {}).get('content')
+            if token:
+                yield token
+
+
+class LLMClient:
+    def __init__(self, api_url, headers=None, pool_size=16, connect_timeout=5.0, read_timeout=30.0,
+                 max_retries=2, backoff_base=0.5, backoff_max=8.0, max_concurrency=8, queue_timeout=30.0):
+        self.api_url = completions_url(api_url)
+        self.headers = headers or {}
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self._limiter = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        # Llamadas en curso (para /metrics)
+        self.in_flight = 0
+        self._session = None
+        self._session_pid = None
+
+    def _get_session(self):
+        # Los sockets heredados de un fork no se pueden compartir entre procesos
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                self._session_pid = os.getpid()
+            return self._session
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Backoff exponencial con jitter completo
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _acquire(self):
+        if not self._limiter.acquire(timeout=self.queue_timeout):
+            raise LLMBusyError('Demasiadas llamadas simultáneas al LLM')
+        with self._lock:
+            self.in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._limiter.release()
+
+    def _post(self, payload, stream=False):
+        """POST con reintentos. Devuelve la respuesta ya validada."""
+        session = self._get_session()
+        attempt = 0
+        while True:
+            try:
+                response = session.post(self.api_url, headers=self.headers, json=payload,
+                                        timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._backoff(attempt, response)
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def chat_completion(self, payload):
+        """Llamada sin streaming; devuelve la respuesta HTTP."""
+        self._acquire()
+        try:
+            response = self._post(payload)
+            # Leer el cuerpo aquí para liberar la conexión al pool
+            response.content
+            return response
+        finally:
+            self._release()
+
+    def stream_chat_completion(self, payload):
+        """Llamada con ``stream: true``; genera los fragmentos de texto.
+
+        Solo se reintenta antes de recibir la respuesta: una vez empiezan a
+        llegar tokens, un error se propaga al llamador.
+        """
+        self._acquire()
+        try:
+            response = self._post(dict(payload, stream=True), stream=True)
+            with response:
+                yield from iter_sse_tokens(response)
+        finally:
+            self._release()
+
+
+# ---------------------------------------------------------------------------
+# Servidor stub para pruebas sin conexión
+# ---------------------------------------------------------------------------
+
+def run_stub_server(host='127.0.0.1', port=8765, latency=0.05, token_delay=0.01, tokens=40):
+    """Servidor compatible con /chat/completions que responde texto sintético."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Cabeceras y cuerpo van en escrituras separadas: sin TCP_NODELAY cada
+        # respuesta esperaría ~40 ms al ACK retardado del cliente
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                payload = {}
+            time.sleep(latency)
+
+            words = [f'token{i}' for i in range(tokens)]
+            if payload.get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for i, word in enumerate(words):
+                    chunk = {'choices': [{'delta': {'content': word if i == 0 else ' ' + word}}]}
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                    self.wfile.flush()
+                    time.sleep(token_delay)
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.close_connection = True
+                return
+
+            body = json.dumps({
+                'choices': [{'message': {'role': 'assistant', 'content': ' '.join(words)}}]
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Servidor stub de chat completions para pruebas de carga')
+    parser.add_argument('--stub', action='store_true', help='Arrancar el servidor stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='Segundos antes de responder')
+    parser.add_argument('--token-delay', type=float, default=0.01, help='Segundos entre tokens en streaming')
+    parser.add_argument('--tokens', type=int, default=40, help='Tokens por respuesta')
+    args = parser.parse_args()
+
+    if not args.stub:
+        parser.error('Usa --stub para arrancar el servidor de pruebas')
+
+    server = run_stub_server(args.host, args.port, args.latency, args.token_delay, args.tokens)
+    print(f"Servidor stub escuchando en http://{args.host}:{args.port}/v1/chat/completions")
+    server.serve_forever()
@@ -0,0 +1,181 @@
+"""Métricas en el formato de texto de Prometheus, sin dependencias externas.
+
+Los contadores, gauges e histogramas viven en memoria de cada proceso; con
+varios workers de gunicorn cada uno expone los suyos en ``/metrics``. Los
+valores que ya existen en otro sitio (tamaño de la cola de ingesta, aciertos
+de una caché) se leen en el momento de la consulta mediante funciones
+``callback`` en lugar de duplicarlos.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Segundos: de 1 ms (consulta a un índice en memoria) a 2 min (ingesta de un PDF grande)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # callback() -> {(valores de etiquetas): valor}, evaluado en cada consulta
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} espera las etiquetas {self.labelnames}, recibió {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Devuelve ``[(sufijo, etiquetas_extra, valores_etiquetas, valor), ...]``."""
+        if self.callback is not None:
+            values = self.callback()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [('', None, key, value) for key, value in sorted(values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, extra, key, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(self.labelnames, key, extra)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [recuentos por bucket (no acumulados) + el de +Inf, suma]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', [('le', format_value(bound))], key, cumulative))
+            samples.append(('_sum', None, key, total))
+            samples.append(('_count', None, key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Texto para ``/metrics`` (formato de exposición 0.0.4 de Prometheus)."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Una métrica calculada que falla no debe tumbar las demás
+                print(f"Error al calcular la métrica {metric.name}: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def server_timing_header(timings):
+    """Valor de la cabecera ``Server-Timing`` a partir de ``[(etapa, segundos), ...]``.
+
+    Las etapas repetidas (p. ej. varios lotes de encode) se suman.
+    """
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in totals.items())
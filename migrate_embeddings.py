@@ -0,0 +1,73 @@
+import sqlite3
+import os
+import sys
+
+from text_search import has_fts, rebuild_fts
+from vector_index import embedding_from_blob, embedding_to_blob
+
+BATCH_SIZE = 1000
+
+def migrate_embeddings(db_path='data/database.sqlite'):
+    """Convierte los embeddings guardados como JSON a BLOB float32.
+
+    Es idempotente: solo toca las filas cuyo valor todavía es texto.
+    """
+    if not os.path.exists(db_path):
+        print(f"Error: No se encontró la base de datos en {os.path.abspath(db_path)}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    c.execute("SELECT COUNT(*) FROM embeddings WHERE typeof(embedding) = 'text'")
+    pending = c.fetchone()[0]
+    if pending == 0:
+        print("No hay embeddings en formato JSON. Nada que migrar.")
+        conn.close()
+        return
+
+    print(f"Migrando {pending} embeddings de JSON a float32...")
+    size_before = os.path.getsize(db_path)
+    migrated = 0
+    last_rowid = 0
+
+    while True:
+        c.execute('''
+            SELECT rowid, id, embedding FROM embeddings
+            WHERE typeof(embedding) = 'text' AND rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+        ''', (last_rowid, BATCH_SIZE))
+        rows = c.fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+
+        updates = []
+        for _, embedding_id, value in rows:
+            try:
+                updates.append((embedding_to_blob(embedding_from_blob(value)), embedding_id))
+            except Exception as e:
+                print(f"Error al convertir el embedding {embedding_id}: {str(e)}")
+
+        c.executemany('UPDATE embeddings SET embedding = ? WHERE id = ?', updates)
+        conn.commit()
+        migrated += len(updates)
+        print(f"Migrados {migrated}/{pending} embeddings...")
+
+    # Recuperar el espacio que ocupaba el JSON
+    print("Compactando la base de datos (VACUUM)...")
+    conn.execute('VACUUM')
+    # VACUUM puede renumerar los rowid a los que apunta el índice FTS
+    if has_fts(c):
+        rebuild_fts(c)
+        conn.commit()
+    conn.close()
+
+    size_after = os.path.getsize(db_path)
+    print(f"Migración completada: {migrated} embeddings convertidos.")
+    print(f"Tamaño de la base de datos: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+
+if __name__ == '__main__':
+    print("=== Migración de embeddings a formato binario ===")
+    migrate_embeddings(sys.argv[1] if len(sys.argv) > 1 else 'data/database.sqlite')
@@ -0,0 +1,149 @@
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Resultado de extraer una página:
+# - text: texto de la página (o None si falló la extracción)
+# - error: mensaje de error (o None)
+# - image_xrefs: xrefs de las imágenes de la página; None si el motor no
+#   las conoce (PyPDF2) y hay que buscarlas en la etapa de imágenes
+# - needs_render: la página no tiene imágenes ni texto y debe renderizarse
+ExtractedPage = namedtuple('ExtractedPage', ['page_num', 'text', 'error', 'image_xrefs', 'needs_render'])
+
+ENGINES = ('pymupdf', 'pypdf2')
+
+
+def finalize_page_text(text, page_num):
+    """Sustituye el texto vacío por un marcador y registra una advertencia."""
+    if not text.strip():
+        print(f"Advertencia: No se pudo extraer texto de la página {page_num + 1}")
+        text = f"[Contenido no extraíble de la página {page_num + 1}]"
+    return text
+
+
+def extract_page_text(page, page_num):
+    """Extrae el texto de una página de PyPDF2 probando varios métodos."""
+    # Método 1: Extracción estándar
+    text = page.extract_text() or ''
+
+    # Si no se extrajo suficiente texto, intentar con parámetros alternativos
+    if len(text.strip()) < 10:  # Si el texto es muy corto
+        # Intentar con extracción más agresiva (no todas las versiones lo admiten)
+        try:
+            text = page.extract_text(x_tolerance=3, y_tolerance=3) or ''
+        except TypeError:
+            pass
+
+    # Si aún no hay suficiente texto, intentar extraer por palabras
+    if len(text.strip()) < 10 and hasattr(page, 'extract_words'):
+        words = page.extract_words()
+        if words:
+            text = ' '.join(word['text'] for word in words)
+
+    return finalize_page_text(text, page_num)
+
+
+def extract_page_pymupdf(page, page_num):
+    """Extrae en una sola pasada el texto, las imágenes y si hay que renderizar."""
+    raw_text = page.get_text()
+    text = raw_text
+
+    # Si el texto es muy corto, reconstruirlo a partir de las palabras
+    if len(text.strip()) < 10:
+        words = page.get_text('words')
+        if words:
+            text = ' '.join(word[4] for word in words)
+
+    image_xrefs = [img[0] for img in page.get_images(full=True)]
+    needs_render = not image_xrefs and raw_text.strip() == ''
+    return ExtractedPage(page_num, finalize_page_text(text, page_num), None, image_xrefs, needs_render)
+
+
+def extract_range_from_document(pdf_document, start, end, engine):
+    """Extrae las páginas [start, end) de un documento ya abierto."""
+    results = []
+    for page_num in range(start, end):
+        try:
+            if engine == 'pypdf2':
+                text = extract_page_text(pdf_document.pages[page_num], page_num)
+                results.append(ExtractedPage(page_num, text, None, None, False))
+            else:
+                results.append(extract_page_pymupdf(pdf_document.load_page(page_num), page_num))
+        except Exception as e:
+            results.append(ExtractedPage(page_num, None, str(e), None, False))
+    return results
+
+
+def extract_range(file_path, start, end, engine):
+    """Extrae las páginas [start, end) abriendo su propio documento.
+
+    Se ejecuta dentro de los procesos del pool.
+    """
+    if engine == 'pypdf2':
+        import PyPDF2
+
+        with open(file_path, 'rb') as f:
+            return extract_range_from_document(PyPDF2.PdfReader(f), start, end, engine)
+
+    import fitz  # PyMuPDF is the package name, but we import fitz
+
+    with fitz.open(file_path) as pdf_document:
+        return extract_range_from_document(pdf_document, start, end, engine)
+
+
+def extract_serial(pdf_document, num_pages, engine, progress=None):
+    """Extrae todas las páginas de un documento abierto, una a una."""
+    results = []
+    for page_num in range(num_pages):
+        results.extend(extract_range_from_document(pdf_document, page_num, page_num + 1, engine))
+        if progress:
+            progress(page_num + 1)
+    return results
+
+
+def extract_pages(file_path, num_pages, engine='pymupdf', workers=1, min_parallel_pages=32,
+                  progress=None, document=None):
+    """Extrae todas las páginas, en paralelo si conviene.
+
+    ``document`` es el documento PyMuPDF ya abierto por el llamador; en modo
+    serie se reutiliza para no volver a parsear el PDF. Con ``workers > 1``
+    y al menos ``min_parallel_pages`` páginas, los rangos de páginas se
+    reparten en un pool de procesos. Los resultados se devuelven siempre en
+    orden de página. ``progress(paginas_listas)`` se llama a medida que
+    avanzan.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Motor de extracción desconocido: {engine}")
+
+    if workers <= 1 or num_pages < min_parallel_pages:
+        if engine == 'pymupdf' and document is not None:
+            return extract_serial(document, num_pages, engine, progress)
+
+        if engine == 'pypdf2':
+            import PyPDF2
+
+            with open(file_path, 'rb') as f:
+                return extract_serial(PyPDF2.PdfReader(f), num_pages, engine, progress)
+
+        import fitz  # PyMuPDF is the package name, but we import fitz
+
+        with fitz.open(file_path) as pdf_document:
+            return extract_serial(pdf_document, num_pages, engine, progress)
+
+    # Rangos más pequeños que páginas/workers para repartir mejor la carga
+    # y poder informar del progreso con más frecuencia
+    range_size = max(1, -(-num_pages // (workers * 4)))
+    ranges = [(start, min(start + range_size, num_pages)) for start in range(0, num_pages, range_size)]
+
+    results = []
+    # 'spawn' evita heredar hilos y modelos del proceso padre al hacer fork
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(extract_range, file_path, start, end, engine) for start, end in ranges]
+        for future in as_completed(futures):
+            results.extend(future.result())
+            if progress:
+                progress(len(results))
+
+    results.sort(key=lambda result: result.page_num)
+    return results
@@ -0,0 +1,129 @@
+"""Cuantización de embeddings (EMBEDDING_QUANTIZATION=int8|binary).
+
+- ``int8``: cada componente se guarda como un entero entre -127 y 127 con una
+  escala por vector (``max|x| / 127``). Ocupa 4 veces menos que float32.
+- ``binary``: se guarda solo el signo de cada componente (1 bit) con la
+  media de ``|x|`` como escala. Ocupa 32 veces menos.
+
+Las similitudes calculadas con vectores cuantizados son aproximadas: sirven
+para elegir una lista corta de candidatos que después se reordena con los
+embeddings float32 originales (ver ``vector_index.rescore``). Los vectores
+de entrada deben estar normalizados.
+"""
+import struct
+
+import numpy as np
+
+MODES = ('int8', 'binary')
+MODE_CODES = {'int8': 1, 'binary': 2}
+
+# Cabecera de la columna embeddings.embedding_q: modo (1 byte) y escala (float32)
+BLOB_HEADER = struct.Struct('<Bf')
+
+# Filas convertidas a float32 a la vez al puntuar: bloques pequeños caben en
+# la caché de la CPU y la conversión cuesta casi lo mismo que el producto
+SCORE_BLOCK_ROWS = 1024
+
+
+def quantize(mode, vectors):
+    """Cuantiza una matriz N x D. Devuelve ``(códigos, escalas)``."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    if mode == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    elif mode == 'binary':
+        scales = np.abs(vectors).mean(axis=1)
+        codes = np.packbits(vectors > 0, axis=1)
+    else:
+        raise ValueError(f'Modo de cuantización desconocido: {mode}')
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(mode, codes, scales, dim):
+    """Reconstrucción aproximada en float32 (para entrenar o asignar listas IVF)."""
+    if mode == 'int8':
+        return codes.astype(np.float32) * scales[:, None]
+    signs = np.unpackbits(codes, axis=1, count=dim).astype(np.float32) * 2 - 1
+    return signs * scales[:, None]
+
+
+def approximate_scores(mode, codes, scales, query):
+    """Producto escalar aproximado entre ``query`` (float32) y cada vector cuantizado."""
+    query = np.asarray(query, dtype=np.float32)
+    scores = np.empty(len(codes), dtype=np.float32)
+    query_sum = float(query.sum())
+    for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+        block = codes[start:start + SCORE_BLOCK_ROWS]
+        if mode == 'int8':
+            raw = block.astype(np.float32) @ query
+        else:
+            # signo(x)·q = 2·(bits·q) - Σq, con bits en {0, 1}
+            bits = np.unpackbits(block, axis=1, count=len(query)).astype(np.float32)
+            raw = 2 * (bits @ query) - query_sum
+        scores[start:start + len(block)] = raw * scales[start:start + len(block)]
+    return scores
+
+
+def bytes_per_vector(mode, dim):
+    """Memoria por vector, incluida la escala."""
+    if mode == 'int8':
+        return dim + 4
+    if mode == 'binary':
+        return (dim + 7) // 8 + 4
+    return dim * 4
+
+
+def quantized_to_blob(mode, code_row, scale):
+    return BLOB_HEADER.pack(MODE_CODES[mode], float(scale)) + np.ascontiguousarray(code_row).tobytes()
+
+
+def quantized_from_blob(mode, value):
+    """Devuelve ``(códigos, escala)``, o None si el BLOB falta o es de otro modo."""
+    if not value or len(value) <= BLOB_HEADER.size:
+        return None
+    mode_code, scale = BLOB_HEADER.unpack_from(value)
+    if mode_code != MODE_CODES[mode]:
+        return None
+    dtype = np.int8 if mode == 'int8' else np.uint8
+    return np.frombuffer(value, dtype=dtype, offset=BLOB_HEADER.size), scale
+
+
+class QuantizedMatrix:
+    """Matriz de vectores cuantizados con sus escalas (una por fila)."""
+
+    def __init__(self, mode, codes, scales, dim):
+        self.mode = mode
+        self.codes = codes
+        self.scales = np.asarray(scales, dtype=np.float32)
+        self.dim = dim
+
+    @classmethod
+    def from_vectors(cls, mode, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes, scales = quantize(mode, vectors)
+        return cls(mode, codes, scales, vectors.shape[1])
+
+    @classmethod
+    def from_rows(cls, mode, rows, dim=None):
+        """Construye la matriz a partir de ``[(códigos, escala), ...]``."""
+        codes = np.vstack([row for row, _ in rows])
+        if dim is None:
+            dim = codes.shape[1] * 8 if mode == 'binary' else codes.shape[1]
+        return cls(mode, codes, [scale for _, scale in rows], dim)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def scores(self, query):
+        return approximate_scores(self.mode, self.codes, self.scales, query)
+
+    def append(self, other):
+        return QuantizedMatrix(self.mode, np.vstack([self.codes, other.codes]),
+                               np.concatenate([self.scales, other.scales]), self.dim)
@@ -0,0 +1,89 @@
+import sqlite3
+import os
+import sys
+
+from quantization import MODE_CODES, MODES, quantize, quantized_to_blob
+from vector_index import embedding_from_blob, normalize_rows
+
+BATCH_SIZE = 1000
+
+def quantize_embeddings(mode, db_path='data/database.sqlite'):
+    """Rellena embeddings.embedding_q con la copia cuantizada de cada embedding.
+
+    Es idempotente: solo toca las filas sin copia o con una de otro modo. Con
+    mode='none' borra las copias para recuperar el espacio. El float32 de la
+    columna embedding no se modifica.
+    """
+    if not os.path.exists(db_path):
+        print(f"Error: No se encontró la base de datos en {os.path.abspath(db_path)}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('PRAGMA table_info(embeddings)')
+    if 'embedding_q' not in [row[1] for row in c.fetchall()]:
+        c.execute('ALTER TABLE embeddings ADD COLUMN embedding_q BLOB')
+
+    if mode == 'none':
+        c.execute('UPDATE embeddings SET embedding_q = NULL WHERE embedding_q IS NOT NULL')
+        conn.commit()
+        print(f"Copias cuantizadas eliminadas: {c.rowcount}. Ejecuta storage_gc.py para compactar la base de datos.")
+        conn.close()
+        return
+
+    # Primer byte del BLOB: el modo con el que se cuantizó
+    mode_prefix = bytes([MODE_CODES[mode]])
+    pending_filter = 'embedding_q IS NULL OR substr(embedding_q, 1, 1) != ?'
+    c.execute(f'SELECT COUNT(*) FROM embeddings WHERE {pending_filter}', (mode_prefix,))
+    pending = c.fetchone()[0]
+    if pending == 0:
+        print(f"Todos los embeddings tienen ya su copia {mode}. Nada que hacer.")
+        conn.close()
+        return
+
+    print(f"Cuantizando {pending} embeddings ({mode})...")
+    quantized = 0
+    last_rowid = 0
+
+    while True:
+        c.execute(f'''
+            SELECT rowid, id, embedding FROM embeddings
+            WHERE ({pending_filter}) AND rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+        ''', (mode_prefix, last_rowid, BATCH_SIZE))
+        rows = c.fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+
+        ids = []
+        vectors = []
+        for _, embedding_id, value in rows:
+            try:
+                vectors.append(embedding_from_blob(value))
+                ids.append(embedding_id)
+            except Exception as e:
+                print(f"Error al leer el embedding {embedding_id}: {str(e)}")
+        if not vectors:
+            continue
+
+        codes, scales = quantize(mode, normalize_rows(vectors))
+        c.executemany('UPDATE embeddings SET embedding_q = ? WHERE id = ?', [
+            (quantized_to_blob(mode, code_row, scale), embedding_id)
+            for embedding_id, code_row, scale in zip(ids, codes, scales)
+        ])
+        conn.commit()
+        quantized += len(ids)
+        print(f"Cuantizados {quantized}/{pending} embeddings...")
+
+    conn.close()
+    print(f"Completado: {quantized} embeddings con copia {mode}.")
+    print(f"Arranca la aplicación con EMBEDDING_QUANTIZATION={mode} para usarla.")
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in MODES + ('none',):
+        print(f"Uso: python {sys.argv[0]} {{int8|binary|none}} [ruta de la base de datos]")
+        sys.exit(1)
+    print("=== Cuantización de embeddings ===")
+    quantize_embeddings(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'data/database.sqlite')
@@ -0,0 +1,189 @@
+import sqlite3
+import os
+import sys
+import time
+
+from ann_index import IVFIndex
+from quantization import MODES as QUANTIZATION_MODES
+from text_search import has_fts, rebuild_fts
+from thumbnails import derivative_key
+
+UPLOAD_FOLDER = 'data/uploads'
+IMAGES_FOLDER = 'data/images'
+THUMBNAILS_FOLDER = 'data/thumbs'
+ANN_INDEX_PATH = os.getenv('ANN_INDEX_PATH', 'data/ann_index.npz')
+# Debe coincidir con la de la aplicación para poder cargar el índice ANN
+EMBEDDING_QUANTIZATION = os.getenv('EMBEDDING_QUANTIZATION', 'none').lower()
+if EMBEDDING_QUANTIZATION not in QUANTIZATION_MODES:
+    EMBEDDING_QUANTIZATION = None
+
+# Los archivos más recientes que esto no se tocan: pueden pertenecer a una
+# subida o una ingesta en curso que todavía no tiene su fila
+MIN_FILE_AGE_SECONDS = 3600
+
+# Filas huérfanas: (descripción, tabla, condición)
+ORPHAN_QUERIES = [
+    ('PDFs en proceso sin trabajo de ingesta activo', 'pdf_files', '''
+        status = 'processing' AND id NOT IN (
+            SELECT pdf_id FROM ingest_jobs WHERE status IN ('queued', 'running')
+        )
+    '''),
+    ('páginas sin PDF', 'pdf_pages', 'pdf_id NOT IN (SELECT id FROM pdf_files)'),
+    ('imágenes sin PDF', 'pdf_images', 'pdf_id NOT IN (SELECT id FROM pdf_files)'),
+    ('embeddings sin PDF o sin página', 'embeddings', '''
+        pdf_id NOT IN (SELECT id FROM pdf_files)
+        OR (page_id IS NOT NULL AND page_id NOT IN (SELECT id FROM pdf_pages))
+    '''),
+    ('mensajes sin sesión', 'messages', 'session_id NOT IN (SELECT id FROM chat_sessions)'),
+    ('trabajos terminados de PDFs eliminados', 'ingest_jobs', '''
+        status NOT IN ('queued', 'running') AND pdf_id NOT IN (SELECT id FROM pdf_files)
+    '''),
+]
+
+def format_size(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.2f} MB"
+
+def database_size(db_path):
+    return sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path))
+
+def delete_orphan_rows(c, dry_run):
+    total = 0
+    for description, table, condition in ORPHAN_QUERIES:
+        c.execute(f'SELECT COUNT(*) FROM {table} WHERE {condition}')
+        count = c.fetchone()[0]
+        if count:
+            print(f"- {description}: {count}")
+            if not dry_run:
+                c.execute(f'DELETE FROM {table} WHERE {condition}')
+            total += count
+    return total
+
+def orphan_files(folder, referenced, now):
+    """Archivos de ``folder`` que no están en ``referenced`` (rutas absolutas)."""
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.abspath(os.path.join(root, name))
+            if path in referenced:
+                continue
+            try:
+                if now - os.path.getmtime(path) < MIN_FILE_AGE_SECONDS:
+                    continue
+            except OSError:
+                continue
+            yield path
+
+def remove_empty_dirs(folder):
+    for root, dirs, files in os.walk(folder, topdown=False):
+        if root != folder and not dirs and not files:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+def delete_orphan_files(c, dry_run):
+    """Borra subidas, imágenes y miniaturas que ya no referencia ninguna fila."""
+    c.execute('SELECT file_path FROM pdf_files UNION SELECT file_path FROM ingest_jobs')
+    uploads = {os.path.abspath(path) for (path,) in c.fetchall() if path}
+    c.execute('SELECT DISTINCT image_path FROM pdf_images WHERE image_path IS NOT NULL')
+    images = {os.path.abspath(path) for (path,) in c.fetchall()}
+
+    # Claves de las derivadas que siguen siendo válidas
+    images_root = os.path.abspath(IMAGES_FOLDER)
+    keys = {derivative_key(os.path.relpath(path, images_root)) for path in images}
+
+    now = time.time()
+    candidates = list(orphan_files(UPLOAD_FOLDER, uploads, now)) + list(orphan_files(IMAGES_FOLDER, images, now))
+    for path in orphan_files(THUMBNAILS_FOLDER, set(), now):
+        key = os.path.basename(path).split('.', 1)[0]
+        if key not in keys:
+            candidates.append(path)
+
+    freed = 0
+    for path in candidates:
+        try:
+            freed += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+        except OSError as e:
+            print(f"Advertencia: no se pudo eliminar {path}: {str(e)}")
+
+    if not dry_run:
+        for folder in (UPLOAD_FOLDER, IMAGES_FOLDER, THUMBNAILS_FOLDER):
+            remove_empty_dirs(folder)
+    return len(candidates), freed
+
+def prune_ann_index(c, dry_run):
+    """Quita del índice ANN los vectores de PDFs que ya no están listos."""
+    index = IVFIndex(ANN_INDEX_PATH, quantization=EMBEDDING_QUANTIZATION)
+    if not index.load():
+        return 0
+    c.execute("SELECT id FROM pdf_files WHERE status = 'ready'")
+    ready = {pdf_id for (pdf_id,) in c.fetchall()}
+    stale = sorted(index.pdf_ids() - ready)
+    if stale and not dry_run:
+        index.remove(stale)
+    return len(stale)
+
+def compact_database(conn, c):
+    """Devuelve al sistema de archivos las páginas libres de la base de datos.
+
+    La primera vez cambia la base de datos a auto_vacuum=INCREMENTAL (requiere
+    un VACUUM completo); a partir de ahí basta con PRAGMA incremental_vacuum.
+    """
+    c.execute('PRAGMA auto_vacuum')
+    if c.fetchone()[0] != 2:
+        print("Convirtiendo la base de datos a auto_vacuum=INCREMENTAL (VACUUM)...")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        # VACUUM puede renumerar los rowid a los que apunta el índice FTS
+        if has_fts(c):
+            rebuild_fts(c)
+            conn.commit()
+    else:
+        c.execute('PRAGMA freelist_count')
+        print(f"Liberando {c.fetchone()[0]} páginas libres (incremental_vacuum)...")
+        c.execute('PRAGMA incremental_vacuum').fetchall()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+def storage_gc(db_path='data/database.sqlite', dry_run=False):
+    """Elimina filas y archivos huérfanos y compacta la base de datos.
+
+    Pensado para ejecutarse con la aplicación parada o en un momento de poca
+    carga; con --dry-run solo informa de lo que se eliminaría.
+    """
+    if not os.path.exists(db_path):
+        print(f"Error: No se encontró la base de datos en {os.path.abspath(db_path)}")
+        return
+
+    size_before = database_size(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA foreign_keys = ON')
+    c = conn.cursor()
+
+    print("Filas huérfanas:")
+    rows = delete_orphan_rows(c, dry_run)
+    if not rows:
+        print("- ninguna")
+    conn.commit()
+
+    files, freed = delete_orphan_files(c, dry_run)
+    print(f"Archivos huérfanos: {files} ({format_size(freed)})")
+
+    stale = prune_ann_index(c, dry_run)
+    print(f"PDFs eliminados presentes en el índice ANN: {stale}")
+
+    if dry_run:
+        conn.close()
+        print("\nModo de prueba: no se modificó nada.")
+        return
+
+    compact_database(conn, c)
+    conn.close()
+    size_after = database_size(db_path)
+    print(f"\nBase de datos: {format_size(size_before)} -> {format_size(size_after)}")
+    print("Limpieza completada.")
+
+if __name__ == '__main__':
+    print("=== Recolección de basura del almacenamiento ===")
+    args = [arg for arg in sys.argv[1:] if arg != '--dry-run']
+    storage_gc(args[0] if args else 'data/database.sqlite', dry_run='--dry-run' in sys.argv)
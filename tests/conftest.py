@@ -0,0 +1,48 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class HashingModel:
+    """Modelo de embeddings determinista para las pruebas (sin torch)."""
+
+    dim = 32
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        vectors = np.zeros((1 if single else len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate([texts] if single else texts):
+            for word in text.lower().split():
+                digest = hashlib.sha256(word.encode('utf-8')).digest()
+                vectors[row, digest[0] % self.dim] += 1.0
+        return vectors[0] if single else vectors
+
+
+@pytest.fixture(scope='session')
+def appmod(tmp_path_factory):
+    """Módulo app con la base de datos y los directorios en un temporal."""
+    data_dir = tmp_path_factory.mktemp('data')
+    os.environ['DATABASE_PATH'] = str(data_dir / 'database.sqlite')
+    os.environ['ANN_INDEX_PATH'] = str(data_dir / 'ann_index.npz')
+    os.environ['CHUNKING_STRATEGY'] = 'words'
+    os.environ['THUMBNAILS_AT_INGEST'] = '0'
+    import app as appmod
+
+    appmod._embedding_model = HashingModel()
+    appmod._app = appmod.create_app({
+        'TESTING': True,
+        'UPLOAD_FOLDER': str(data_dir / 'uploads'),
+        'IMAGES_FOLDER': str(data_dir / 'images'),
+        'THUMBNAILS_FOLDER': str(data_dir / 'thumbs'),
+    })
+    return appmod
+
+
+@pytest.fixture
+def client(appmod):
+    return appmod.app.test_client()
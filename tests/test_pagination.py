@@ -0,0 +1,35 @@
+import base64
+import json
+
+import pytest
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('cursor', [
+    raw_cursor([1, {}]),
+    raw_cursor(['2024-01-01T00:00:00']),
+    raw_cursor(['2024-01-01T00:00:00', 'a', 'b']),
+    raw_cursor(['2024-01-01T00:00:00', 7]),
+    raw_cursor([None, 'a']),
+    raw_cursor({'uploaded_at': '2024-01-01', 'id': 'a'}),
+    raw_cursor('texto'),
+    'no-es-base64!!',
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+])
+@pytest.mark.parametrize('path, params', [
+    ('/api/list-pdfs', {}),
+    ('/api/history', {}),
+    ('/api/history', {'sessionId': 'sesion'}),
+])
+def test_malformed_cursor_is_rejected(client, path, params, cursor):
+    response = client.get(path, query_string={**params, 'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Cursor inválido'
+
+
+def test_cursor_round_trip(appmod):
+    values = ['2024-01-01T00:00:00', 'b7c2']
+    assert appmod.decode_cursor(appmod.encode_cursor(values)) == values
@@ -0,0 +1,74 @@
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+
+def write_pdf(path, pages):
+    import fitz
+
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_text((72, 72), text)
+    doc.save(path)
+    doc.close()
+
+
+def run_ingest(appmod, pdf_id, path):
+    conn = appmod.get_db()
+    job_id = str(uuid.uuid4())
+    now = datetime.now().isoformat()
+    conn.execute('''
+        INSERT INTO ingest_jobs (id, pdf_id, filename, file_path, status, stage, created_at, updated_at)
+        VALUES (?, ?, ?, ?, 'running', 'queued', ?, ?)
+    ''', (job_id, pdf_id, os.path.basename(path), path, now, now))
+    conn.commit()
+    conn.close()
+    with appmod.app.app_context():
+        return appmod.ingest_pdf(job_id, pdf_id, os.path.basename(path), path)
+
+
+def snapshot(appmod, pdf_id):
+    conn = appmod.get_db()
+    try:
+        pages = [tuple(row) for row in conn.execute('''
+            SELECT page_number, text_content, text_hash FROM pdf_pages
+            WHERE pdf_id = ? ORDER BY page_number
+        ''', (pdf_id,))]
+        chunks = sorted(row[0] for row in conn.execute(
+            'SELECT chunk_text FROM embeddings WHERE pdf_id = ?', (pdf_id,)))
+        status = conn.execute('SELECT status FROM pdf_files WHERE id = ?', (pdf_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    return status, pages, chunks
+
+
+def test_failed_reingest_keeps_previous_version(appmod, tmp_path, monkeypatch):
+    pdf_id = str(uuid.uuid4())
+    first = str(tmp_path / 'v1.pdf')
+    write_pdf(first, ['alpha page one about turbines', 'beta page two about pumps'])
+    run_ingest(appmod, pdf_id, first)
+    before = snapshot(appmod, pdf_id)
+    assert before[0] == 'ready' and len(before[2]) == 2
+
+    second = str(tmp_path / 'v2.pdf')
+    write_pdf(second, ['alpha page one about turbines', 'gamma page two rewritten entirely',
+                       'delta new page three'])
+
+    def failing_encode(*args, **kwargs):
+        raise RuntimeError('modelo no disponible')
+
+    monkeypatch.setattr(appmod, 'encode_chunks', failing_encode)
+    with pytest.raises(RuntimeError):
+        run_ingest(appmod, pdf_id, second)
+    assert snapshot(appmod, pdf_id) == before
+
+    monkeypatch.undo()
+    run_ingest(appmod, pdf_id, second)
+    status, pages, chunks = snapshot(appmod, pdf_id)
+    assert status == 'ready'
+    assert [text.strip() for _, text, _ in pages] == [
+        'alpha page one about turbines', 'gamma page two rewritten entirely', 'delta new page three']
+    assert all(text_hash for _, _, text_hash in pages)
+    assert [chunk.strip() for chunk in chunks] == sorted(text.strip() for _, text, _ in pages)
@@ -0,0 +1,27 @@
+import sqlite3
+
+import pytest
+
+from text_search import bm25_search, create_fts
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(':memory:')
+    c = conn.cursor()
+    c.execute('CREATE TABLE pdf_files (id TEXT PRIMARY KEY, status TEXT)')
+    c.execute('CREATE TABLE embeddings (id TEXT PRIMARY KEY, pdf_id TEXT, chunk_text TEXT, embedding BLOB)')
+    create_fts(c)
+    c.executemany('INSERT INTO pdf_files VALUES (?, ?)', [('ready', 'ready'), ('processing', 'processing')])
+    c.executemany('INSERT INTO embeddings (id, pdf_id, chunk_text) VALUES (?, ?, ?)', [
+        ('a', 'ready', 'turbina XR-303'),
+        ('b', 'processing', 'turbina XR-303'),
+    ])
+    yield c
+    conn.close()
+
+
+def test_only_ready_pdfs_match(cursor):
+    assert [row[0] for row in bm25_search(cursor, 'XR-303')] == ['a']
+    assert [row[0] for row in bm25_search(cursor, 'XR-303', pdf_id='ready')] == ['a']
+    assert bm25_search(cursor, 'XR-303', pdf_id='processing') == []
@@ -0,0 +1,127 @@
+import re
+import sqlite3
+
+# Índice de texto completo sobre embeddings.chunk_text. Es una tabla FTS5 de
+# contenido externo (no duplica el texto) enlazada por rowid y mantenida por
+# triggers, así que cualquier INSERT/DELETE en embeddings la actualiza.
+# Los guiones y guiones bajos forman parte de los tokens para que códigos
+# como "XR-303" o "AB_12" se busquen como una sola palabra.
+FTS_TABLE_SQL = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS embeddings_fts USING fts5(
+        chunk_text,
+        content='embeddings',
+        content_rowid='rowid',
+        tokenize="unicode61 remove_diacritics 2 tokenchars '-_'"
+    )
+'''
+
+FTS_TRIGGERS_SQL = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS embeddings_fts_insert AFTER INSERT ON embeddings BEGIN
+        INSERT INTO embeddings_fts(rowid, chunk_text) VALUES (new.rowid, new.chunk_text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS embeddings_fts_delete AFTER DELETE ON embeddings BEGIN
+        INSERT INTO embeddings_fts(embeddings_fts, rowid, chunk_text) VALUES ('delete', old.rowid, old.chunk_text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS embeddings_fts_update AFTER UPDATE OF chunk_text ON embeddings BEGIN
+        INSERT INTO embeddings_fts(embeddings_fts, rowid, chunk_text) VALUES ('delete', old.rowid, old.chunk_text);
+        INSERT INTO embeddings_fts(rowid, chunk_text) VALUES (new.rowid, new.chunk_text);
+    END
+    '''
+]
+
+# Palabras (con guiones/guiones bajos) que se buscan como términos
+TOKEN_PATTERN = re.compile(r'[\w][\w\-]*', re.UNICODE)
+MAX_QUERY_TERMS = 32
+
+
+def create_fts(c):
+    """Crea la tabla FTS5 y sus triggers. Devuelve False si SQLite no tiene FTS5.
+
+    La primera vez rellena el índice con los chunks ya existentes.
+    """
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'embeddings_fts'")
+    existed = c.fetchone() is not None
+    try:
+        c.execute(FTS_TABLE_SQL)
+    except sqlite3.OperationalError as e:
+        print(f"Advertencia: búsqueda de texto completo no disponible (FTS5): {str(e)}")
+        return False
+
+    for sql in FTS_TRIGGERS_SQL:
+        c.execute(sql)
+    if not existed:
+        print("Indexando los chunks existentes para la búsqueda de texto completo...")
+        rebuild_fts(c)
+    return True
+
+
+def rebuild_fts(c):
+    """Reconstruye el índice FTS a partir de embeddings.
+
+    Es necesario tras un VACUUM, que puede renumerar los rowid de embeddings.
+    """
+    c.execute("INSERT INTO embeddings_fts(embeddings_fts) VALUES ('rebuild')")
+
+
+def has_fts(c):
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'embeddings_fts'")
+    return c.fetchone() is not None
+
+
+def fts_query(text):
+    """Convierte la pregunta del usuario en una expresión MATCH segura (OR de términos)."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        token = token.strip('-')
+        if len(token) > 1 and token not in terms:
+            terms.append(token)
+    # Cada término entre comillas: la sintaxis de FTS5 (NEAR, AND, *...) no se interpreta
+    return ' OR '.join(f'"{term}"' for term in terms[:MAX_QUERY_TERMS])
+
+
+def bm25_search(c, text, pdf_id=None, limit=20, with_embeddings=False):
+    """Busca chunks por BM25. Devuelve filas (id[, embedding]) de mejor a peor.
+
+    Sin ``pdf_id`` busca en todos los PDFs listos. Los PDFs que no están
+    listos (primera ingesta en curso o fallida) no devuelven resultados.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+
+    columns = 'e.id, e.embedding' if with_embeddings else 'e.id'
+    if pdf_id:
+        c.execute(f'''
+            SELECT {columns}
+            FROM embeddings_fts
+            JOIN embeddings e ON e.rowid = embeddings_fts.rowid
+            JOIN pdf_files f ON f.id = e.pdf_id
+            WHERE embeddings_fts MATCH ? AND e.pdf_id = ? AND f.status = 'ready'
+            ORDER BY bm25(embeddings_fts)
+            LIMIT ?
+        ''', (query, pdf_id, limit))
+    else:
+        c.execute(f'''
+            SELECT {columns}
+            FROM embeddings_fts
+            JOIN embeddings e ON e.rowid = embeddings_fts.rowid
+            JOIN pdf_files f ON f.id = e.pdf_id
+            WHERE embeddings_fts MATCH ? AND f.status = 'ready'
+            ORDER BY bm25(embeddings_fts)
+            LIMIT ?
+        ''', (query, limit))
+    return c.fetchall()
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fusiona varias listas de ids ordenadas (RRF). Devuelve ``[(id, puntuación), ...]``."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,76 @@
+"""Miniaturas y versiones reducidas de las imágenes extraídas.
+
+Las derivadas se guardan en disco, en ``<carpeta>/<tamaño>/<clave[:2]>/<clave>.<ext>``,
+y se generan una sola vez: en la ingesta (miniaturas) o en la primera
+petición. Para las imágenes direccionadas por contenido (``shared/``) la
+clave es su hash SHA-256, así que una derivada nunca queda desactualizada.
+"""
+import hashlib
+import os
+import uuid
+
+# Lado mayor en píxeles de cada tamaño; 'full' es la imagen original
+IMAGE_SIZES = {'thumb': 256, 'medium': 1024}
+JPEG_QUALITY = 80
+
+
+def derivative_key(rel_path):
+    """Clave de la derivada: el hash del contenido si la ruta lo lleva."""
+    rel_path = rel_path.replace('\\', '/')
+    if rel_path.startswith('shared/'):
+        return os.path.splitext(os.path.basename(rel_path))[0]
+    return hashlib.sha256(rel_path.encode('utf-8')).hexdigest()
+
+
+def derivative_candidates(thumbs_dir, key, size):
+    base = os.path.join(thumbs_dir, size, key[:2], key)
+    return [f'{base}.jpg', f'{base}.png']
+
+
+def find_derivative(thumbs_dir, key, size):
+    for path in derivative_candidates(thumbs_dir, key, size):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def make_derivative(source_path, thumbs_dir, key, size):
+    """Genera (si no existe) la versión reducida y devuelve su ruta.
+
+    Si la imagen original ya es más pequeña que el tamaño pedido devuelve
+    la ruta original: recomprimirla no ahorraría nada.
+    """
+    existing = find_derivative(thumbs_dir, key, size)
+    if existing:
+        return existing
+
+    from PIL import Image
+
+    max_side = IMAGE_SIZES[size]
+    with Image.open(source_path) as image:
+        if max(image.size) <= max_side:
+            return source_path
+
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        # PNG solo si hay transparencia; el resto se recomprime como JPEG
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        jpg_path, png_path = derivative_candidates(thumbs_dir, key, size)
+        path = png_path if has_alpha else jpg_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Escribir en un temporal y renombrar para no servir archivos a medias
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        if has_alpha:
+            image.save(tmp_path, 'PNG', optimize=True)
+        else:
+            image.convert('RGB').save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    return path
+
+
+def remove_derivatives(thumbs_dir, key):
+    """Elimina todas las derivadas de una imagen (p. ej. al borrarla)."""
+    for size in IMAGE_SIZES:
+        for path in derivative_candidates(thumbs_dir, key, size):
+            if os.path.isfile(path):
+                os.remove(path)
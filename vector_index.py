@@ -0,0 +1,179 @@
+import json
+import threading
+
+import numpy as np
+
+from quantization import QuantizedMatrix
+
+# Los embeddings se guardan como float32 crudo (little-endian) en la columna
+# embeddings.embedding. Las filas antiguas guardaban una lista JSON.
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+def embedding_to_blob(vector):
+    """Serializa un embedding como bytes float32 para la columna BLOB."""
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def embedding_from_blob(value):
+    """Lee un embedding guardado como BLOB float32 (o como JSON heredado).
+
+    Para BLOBs devuelve una vista de solo lectura sobre los bytes, sin copia.
+    """
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float32)
+    return np.frombuffer(value, dtype=EMBEDDING_DTYPE)
+
+
+def normalize_rows(matrix):
+    """Normaliza cada fila a norma 1 (las filas nulas quedan en cero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_indices(scores, k):
+    """Índices de las ``k`` puntuaciones más altas, de mayor a menor."""
+    if len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+
+def rescore(ids, query, fetch, k):
+    """Reordena candidatos con sus embeddings float32 originales.
+
+    ``fetch(ids)`` devuelve ``(ids_encontrados, matriz)``. Devuelve
+    ``[(embedding_id, similitud), ...]`` con los ``k`` mejores.
+    """
+    if not ids or k <= 0:
+        return []
+    found_ids, matrix = fetch(ids)
+    if not len(found_ids):
+        return []
+    scores = normalize_rows(matrix) @ normalize_rows(query)[0]
+    return [(found_ids[i], float(scores[i])) for i in top_indices(scores, k)]
+
+
+class VectorIndex:
+    """Índice vectorial residente en memoria, una matriz por PDF.
+
+    Las matrices se cargan una sola vez desde la base de datos (mediante
+    ``loader``) y se guardan ya normalizadas, de modo que la similitud coseno
+    de una consulta contra todo el documento es un único producto
+    matriz-vector.
+
+    Con ``version`` el índice se mantiene al día entre procesos: cada
+    búsqueda consulta la versión actual del PDF (p. ej. la fecha de su última
+    ingesta) y recarga la matriz si cambió, o la descarta si el PDF ya no
+    existe (``version`` devuelve None).
+
+    Con ``quantization`` ('int8' o 'binary') las matrices se guardan
+    cuantizadas: la búsqueda puntúa todo el PDF de forma aproximada y
+    reordena los ``shortlist`` mejores con los float32 que devuelve
+    ``fetcher``.
+    """
+
+    def __init__(self, loader, quantization=None, fetcher=None, shortlist=100, version=None):
+        # loader(pdf_id) -> (lista de ids de embeddings, matriz N x D o QuantizedMatrix)
+        # fetcher(ids) -> (ids encontrados, matriz float32) para el rescore
+        # version(pdf_id) -> versión actual del PDF, o None si no está disponible
+        self._loader = loader
+        self._version = version
+        self.quantization = quantization
+        self._fetcher = fetcher
+        self.shortlist = shortlist
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Consultas servidas desde memoria / que tuvieron que cargar el PDF
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, pdf_id):
+        version = self._version(pdf_id) if self._version else None
+        if self._version and version is None:
+            # Borrado (quizá por otro proceso): no queda nada que buscar
+            self.invalidate(pdf_id)
+            return [], None
+        with self._lock:
+            entry = self._entries.get(pdf_id)
+            if entry is not None and entry[2] == version:
+                self.hits += 1
+                return entry[:2]
+            self.misses += 1
+
+        ids, matrix = self._loader(pdf_id)
+        if not len(ids):
+            # Sin caché: puede ser un PDF aún en ingesta o un id desconocido
+            return [], None
+        entry = (list(ids), self._prepare(matrix), version)
+        with self._lock:
+            # Otro hilo pudo haberlo cargado mientras tanto
+            current = self._entries.get(pdf_id)
+            if current is not None and current[2] == version:
+                return current[:2]
+            self._entries[pdf_id] = entry
+            return entry[:2]
+
+    def _prepare(self, matrix):
+        if isinstance(matrix, QuantizedMatrix):
+            return matrix
+        matrix = normalize_rows(matrix)
+        if self.quantization:
+            return QuantizedMatrix.from_vectors(self.quantization, matrix)
+        return matrix
+
+    def add(self, pdf_id, ids, vectors, version=None):
+        """Agrega vectores de un PDF al índice (lo usa la ingesta).
+
+        ``version`` es la versión del PDF que resulta de la ingesta.
+        """
+        if not len(ids):
+            return
+        vectors = self._prepare(vectors)
+        with self._lock:
+            entry = self._entries.get(pdf_id)
+            if entry is None or not len(entry[0]):
+                self._entries[pdf_id] = (list(ids), vectors, version)
+            else:
+                old_ids, old_matrix, _ = entry
+                if isinstance(old_matrix, QuantizedMatrix):
+                    matrix = old_matrix.append(vectors)
+                else:
+                    matrix = np.vstack([old_matrix, vectors])
+                self._entries[pdf_id] = (old_ids + list(ids), matrix, version)
+
+    def invalidate(self, pdf_id):
+        """Descarta el PDF del índice; se recargará en la próxima consulta."""
+        with self._lock:
+            self._entries.pop(pdf_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def search(self, pdf_id, query, k=3):
+        """Devuelve ``[(embedding_id, similitud), ...]`` ordenado de mayor a menor."""
+        ids, matrix = self._get(pdf_id)
+        if not ids or k <= 0:
+            return []
+
+        query = normalize_rows(query)[0]
+        if isinstance(matrix, QuantizedMatrix):
+            scores = matrix.scores(query)
+            if self._fetcher is not None:
+                shortlist = top_indices(scores, max(k, self.shortlist))
+                return rescore([ids[i] for i in shortlist], query, self._fetcher, k)
+        else:
+            scores = matrix @ query
+
+        return [(ids[i], float(scores[i])) for i in top_indices(scores, k)]
+
+    def memory_bytes(self):
+        """Memoria ocupada por las matrices de todos los PDFs cargados."""
+        with self._lock:
+            return sum(matrix.nbytes for _, matrix, _ in self._entries.values())